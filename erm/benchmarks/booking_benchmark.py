@@ -0,0 +1,127 @@
+'''compare /rest/eng_booking_interval overlap lookup: four-way OR of start/end
+comparisons (previous implementation) with btree index on resource_login vs
+canonical end >= req_start and start <= req_end with btree index on 
+(resource_login, end_date, start_date), and int8range overlap with GiST index 
+on (resource_login, range) if btree_gist extension is available.
+Runs on synthetic temporary table, nothing is written to application tables.
+
+Usage: python benchmarks/booking_benchmark.py <config file name> [rows] [repeats]'''
+import configparser
+import random
+import statistics
+import sys
+import time
+
+import psycopg2
+
+
+ENGINEERS = 2000
+YEAR_START = 1546300800 #2019-01-01
+YEAR_SECONDS = 365*24*60*60
+WEEK_SECONDS = 7*24*60*60
+
+OR_CONDITION = (
+    '((start_date >=%(req_start_date)s and end_date <= %(req_end_date)s) or '
+    '(start_date < %(req_start_date)s and '
+    'end_date >= %(req_start_date)s and end_date < %(req_end_date)s) or '
+    '(end_date > %(req_end_date)s and '
+    'start_date > %(req_start_date)s and start_date <= %(req_end_date)s) or '
+    '(start_date < %(req_start_date)s and end_date > %(req_end_date)s))')
+
+CANONICAL_CONDITION = 'end_date >= %(req_start_date)s and start_date <= %(req_end_date)s'
+
+BOOKING_PERIOD = "int8range(start_date, greatest(start_date, end_date), '[]')"
+RANGE_CONDITION = (
+    BOOKING_PERIOD + " && int8range(%(req_start_date)s, %(req_end_date)s, '[]')")
+
+
+def create_synthetic_booking(cur, rows):
+    '''rows of booking over several years, from one hour to one month long'''
+    cur.execute('create temp table booking_bench as '
+                "select 'eng' || (n %% %(engineers)s) as resource_login, "
+                '    start_date, start_date + (3600 + random() * 30*24*3600)::bigint as end_date, '
+                "    'project ' || n as project_id "
+                'from (select n, %(year_start)s + (random() * 5 * %(year)s)::bigint as start_date '
+                '      from generate_series(1, %(rows)s) n) entries',
+                {'engineers': ENGINEERS, 'year_start': YEAR_START, 'year': YEAR_SECONDS,
+                 'rows': rows})
+
+
+def get_requests(count):
+    random.seed(1)
+    requests = []
+    for _ in range(count):
+        req_start_date = YEAR_START + random.randint(0, 5 * YEAR_SECONDS)
+        requests.append({'eng_login': 'eng{0}'.format(random.randrange(ENGINEERS)),
+                         'req_start_date': req_start_date,
+                         'req_end_date': req_start_date + WEEK_SECONDS})
+    return requests
+
+
+def lookup(cur, condition, request):
+    cur.execute('select project_id from booking_bench where '
+                'resource_login = %(eng_login)s and ' + condition, request)
+    return cur.fetchall()
+
+
+def measure(cur, condition, requests):
+    samples = []
+    for request in requests:
+        started = time.perf_counter()
+        lookup(cur, condition, request)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+if __name__ == '__main__':
+    config = configparser.ConfigParser()
+    config.read(sys.argv[1])
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    conn = psycopg2.connect(dbname = config['General']['DB_name'],
+                            user = config['General']['DB_user'],
+                            password = config['General']['DB_pass'],
+                            host = config['General']['DB_host'])
+    cur = conn.cursor()
+    create_synthetic_booking(cur, rows)
+    requests = get_requests(repeats)
+
+    #four-way OR misses entries starting exactly at requested start and ending after
+    #requested end, canonical condition finds every entry found by OR condition
+    for request in requests[:20]:
+        assert (set(lookup(cur, OR_CONDITION, request)) <= 
+                set(lookup(cur, CANONICAL_CONDITION, request)) == 
+                set(lookup(cur, RANGE_CONDITION, request)))
+
+    results = []
+    cur.execute('create index on booking_bench (resource_login)')
+    cur.execute('analyze booking_bench')
+    results.append(('4-way OR, btree(login)', measure(cur, OR_CONDITION, requests)))
+
+    cur.execute('create index on booking_bench (resource_login, end_date, start_date)')
+    cur.execute('analyze booking_bench')
+    results.append(('canonical, btree(login, end, start)', 
+                    measure(cur, CANONICAL_CONDITION, requests)))
+
+    cur.execute('savepoint gist')
+    try:
+        cur.execute('create extension if not exists btree_gist')
+    except psycopg2.Error as error:
+        cur.execute('rollback to savepoint gist')
+        print('btree_gist is not available, GiST variant skipped: {0}'.format(
+              str(error).splitlines()[0]))
+    else:
+        cur.execute('create index on booking_bench using gist (resource_login, ' +
+                    BOOKING_PERIOD + ')')
+        cur.execute('analyze booking_bench')
+        results.append(('int8range &&, gist(login, range)', 
+                        measure(cur, RANGE_CONDITION, requests)))
+
+    print('{0} booking rows, {1} engineers, {2} one week lookups, ms'.format(rows, ENGINEERS,
+                                                                            repeats))
+    print('{0:<40}{1:>10}{2:>10}'.format('condition', 'median', 'max'))
+    for name, (median, maximum) in results:
+        print('{0:<40}{1:>10.2f}{2:>10.2f}'.format(name, median, maximum))
+    conn.rollback()
+    conn.close()
@@ -0,0 +1,122 @@
+'''compare /rest/search latency: 4 ILIKE scans per word (previous implementation) 
+vs single statement over trigram-indexed search document, for any-word (or) 
+and all-words (and) modes.
+Runs on synthetic temporary table, nothing is written to application tables.
+Without pg_trgm extension single statement is measured without index and relevance ordering.
+
+Usage: python benchmarks/search_benchmark.py <config file name> [rows] [repeats]'''
+import configparser
+import random
+import statistics
+import sys
+import time
+
+import psycopg2
+
+
+SEARCH_DOCUMENT = ("(coalesce(skills, '') || ' ' || coalesce(tags, '') || ' ' || "
+                   "coalesce(org_unit_id, '') || ' ' || coalesce(full_name, ''))")
+
+SKILLS = ['linux', 'windows', 'oracle', 'postgresql', 'bmc', 'remedy', 'python', 'java',
+          'javascript', 'php', 'cisco', 'juniper', 'vmware', 'docker', 'kubernetes', 'sap',
+          'itil', 'jira', 'sharepoint', 'exchange', 'ansible', 'zabbix', 'nginx', 'kafka']
+NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев']
+QUERIES = ['linux', 'bmc remedy', 'python docker kubernetes', 'Иванов', 'отдел 15', 'zzzz']
+
+
+def create_synthetic_resources(cur, rows):
+    cur.execute('create temp table resources_bench (full_name text, tags text, skills text, '
+                'org_unit_id text, suir_id text)')
+    random.seed(1)
+    data = [(' '.join((random.choice(NAMES), str(num))),
+             ' '.join(random.sample(SKILLS, 3)),
+             ' '.join(random.sample(SKILLS, 6)),
+             'отдел {0}'.format(random.randint(1, 200)),
+             'eng{0}'.format(num)) for num in range(rows)]
+    cur.executemany('insert into resources_bench values (%s, %s, %s, %s, %s)', data)
+
+
+def search_ilike_scans(cur, search_string, match_all, trgm):
+    found_by_words = []
+    for search_word in search_string.split():
+        found = set()
+        search_word_like = '%' + search_word + '%'
+        for column in ('skills', 'tags', 'org_unit_id', 'full_name'):
+            cur.execute('select suir_id from resources_bench where ' + column + ' ilike %s',
+                        (search_word_like, ))
+            found.update(cur.fetchall())
+        found_by_words.append(found)
+    if match_all:
+        return list(set.intersection(*found_by_words))
+    return list(set.union(*found_by_words))
+
+
+def search_single_statement(cur, search_string, match_all, trgm):
+    '''same condition as rest.get_search_condition'''
+    search_words = {'search_word_{0}'.format(num): '%' + search_word + '%' 
+                    for num, search_word in enumerate(search_string.split())}
+    condition = (' and ' if match_all else ' or ').join(SEARCH_DOCUMENT + ' ilike %(' + name + ')s' 
+                                                       for name in search_words)
+    order = ('word_similarity(%(search_string)s, ' + SEARCH_DOCUMENT + ') desc, ' 
+             if trgm else '') + 'full_name'
+    cur.execute('select suir_id from resources_bench where (' + condition + ') order by ' + order,
+                dict(search_words, search_string = search_string))
+    return cur.fetchall()
+
+
+def measure(cur, search_func, match_all, trgm, repeats):
+    timings = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            search_func(cur, query, match_all, trgm)
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[query] = statistics.median(samples)
+    return timings
+
+
+if __name__ == '__main__':
+    config = configparser.ConfigParser()
+    config.read(sys.argv[1])
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    conn = psycopg2.connect(dbname = config['General']['DB_name'],
+                            user = config['General']['DB_user'],
+                            password = config['General']['DB_pass'],
+                            host = config['General']['DB_host'])
+    cur = conn.cursor()
+    try:
+        cur.execute('create extension if not exists pg_trgm')
+        trgm = True
+    except psycopg2.Error:
+        conn.rollback()
+        trgm = False
+        print('pg_trgm is not available, single statement runs without index')
+    create_synthetic_resources(cur, rows)
+    cur.execute('analyze resources_bench')
+
+    for match_all in (False, True):
+        for query in QUERIES:
+            assert (sorted(search_ilike_scans(cur, query, match_all, trgm)) == 
+                    sorted(search_single_statement(cur, query, match_all, trgm)))
+
+    ilike_scans = {match_all: measure(cur, search_ilike_scans, match_all, trgm, repeats) 
+                   for match_all in (False, True)}
+    if trgm:
+        cur.execute('create index on resources_bench using gin (' + SEARCH_DOCUMENT + ' gin_trgm_ops)')
+        cur.execute('analyze resources_bench')
+    single_statement = {match_all: measure(cur, search_single_statement, match_all, trgm, repeats) 
+                        for match_all in (False, True)}
+
+    print('{0} engineers, median of {1} runs, ms'.format(rows, repeats))
+    for match_all in (False, True):
+        print('mode={0}'.format('and' if match_all else 'or'))
+        print('{0:<28}{1:>14}{2:>18}'.format('query', '4 ILIKE/word', 
+                                             'trigram index' if trgm else 'single statement'))
+        for query in QUERIES:
+            print('{0:<28}{1:>14.2f}{2:>18.2f}'.format(query, ilike_scans[match_all][query], 
+                                                       single_statement[match_all][query]))
+    conn.rollback()
+    conn.close()
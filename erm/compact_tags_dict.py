@@ -0,0 +1,15 @@
+from modules.tagger import tagsDictionary
+import sys
+
+
+try:
+    pickle_path, compact_path = sys.argv[1:3]
+except ValueError:
+    print('''Usage: compact_tags_dict.py <tags_dict.pickle> <compact file name>\n\n
+    This utility converts pickled tags dictionary to compact words file, which is 
+    memory-mapped and shared by all REST workers instead of being loaded by each of them.\n
+    Set Tags_dict in [General] of backend config to compact file name and restart backend,
+    or replace the file in place, workers reload it when modification time changes.''')
+else:
+    tagsDictionary.convert_to_compact(pickle_path, compact_path)
+    print('Saved compact tags dictionary to {0}'.format(compact_path))
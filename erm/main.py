@@ -16,6 +16,7 @@ from .modules.user import User
 from .modules.search import *
 from .modules.booking import *
 from .modules.report import *
+from .modules.message import message
 from .modules.exceptions import MessagingError
 
 
@@ -42,9 +43,8 @@ def read_app_config(conf_file_name):
         app.logger.error('Error reading application configuration file ' +
 conf_file_name)
         exit() #need testing
-    app.config['sms_login'] = config['General']['SMS_login']
-    app.config['sms_pwd'] = config['General']['SMS_pwd']
-    app.config['sms_originator'] = config['General']['SMS_originator']
+    app.config['sms_outbox'] = config['General'].get('SMS_outbox', 'sms_outbox.db')
+    app.config['sms_coalesce_window'] = int(config['General'].get('SMS_coalesce_window', 60))
     app.config['db_name'] = config['General']['DB_name']
     app.config['db_user'] = config['General']['DB_user']
     app.config['db_pass'] = config['General']['DB_pass']
@@ -54,8 +54,14 @@ conf_file_name)
     app.config['premade'] = config['General']['Standard_ent']
     app.config['backend_ip'] = '127.0.0.1'
     app.config['backend_port'] = '8000'
+    app.config['search_page_size'] = int(config['General'].get('Search_page_size', 50))
+    app.config['user_cache_ttl'] = int(config['General'].get('User_cache_ttl', 60))
 
 read_app_config(environ['SUIR_CFG'])
+message.outbox_path = app.config['sms_outbox']
+message.coalesce_window = app.config['sms_coalesce_window']
+User.profile_cache_ttl = app.config['user_cache_ttl']
+User.session_cache_ttl = app.config['user_cache_ttl']
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -85,7 +91,7 @@ def login_page():
 @app.route('/login', methods=['POST'])
 def login():
     user = User(request.form['login'], request.form['pass'])
-    if user.is_authenticated:
+    if user.authenticate():
         active = login_user(user)
         if active:
             flash('Вы вошли в трекер задач', 'info')
@@ -100,6 +106,8 @@ def login():
 
 @app.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        current_user.close_session()
     logout_user()
     flash('Вы вышли из трекера задач','info')
     return redirect(url_for('login_page'))
@@ -119,10 +127,17 @@ def search():
                                    'engineer', 'manager'])
 def search_result():
     search_string = form_search_string(request)
-    logins = backend.search_logins(app.config['backend_ip'], 
-                              app.config['backend_port'], search_string)
-    resources = resource.get_resources_sorted_by_workload(logins)
+    page = max(0, request.form.get('page', 0, type = int))
+    page_size = app.config['search_page_size']
+    ranked = backend.get_ranked_engineers(search_string, '0', '0', 
+                                          page_size, page * page_size)
+    resources = resource.get_resources_from_ranked(ranked['engineers'] if ranked else [])
+    total = ranked['total'] if ranked else 0
+    prev_page, next_page = search_pages(page, page_size, total)
     return render_template('search_result.html', resources = resources, 
+                           total = total, first = page * page_size + 1,
+                           prev_page = prev_page, next_page = next_page,
+                           search_string = request.form['search_string'],
                            username = current_user.fullname, 
                            toolset = current_user.toolset_actions)
 
@@ -160,16 +175,13 @@ def book(eng_login, start, end):
                                   request.headers.get('User-agent'),
                                   current_user.fullname)))
         booking = get_booking_info_from_request(request)
-        booking_entries = dateutils.convert_booking_to_entries(**booking)
-
-        add_booking_entries(booking_entries)
+        add_booking(booking)
 
         try:
             if current_user.login != booking['resource_login']:
                 send_task_added_messages(booking['project_id'], 
                                          current_user.fullname, 
-                                         booking['resource_login'], 
-                                         app.config)
+                                         booking['resource_login'])
         except MessagingError as msg_error:
             app.logger.error(' '.join(('Error sending SMS', msg_error.error_data, current_user.fullname)))
             flash('Не удалось отправить SMS инженеру. Обратитесь к администратору', 'error')
@@ -277,28 +289,12 @@ def work_report(month, year, eng_login):
 @login_required
 @user_group_required(user_group = ['super-admin', 'admin', 'manager'])
 def cons_work_report(month, year):
-    all_workreports = backend.get_all_workreports(month, year)
-
-    report_with_full_names = get_report_with_full_names(all_workreports)
-    
-    #group raws by company/item column and columns by resource_logins/real names
-    #make utils dict, dict key is engineer + ' ' + company + ' ' + sla string 
-    utils_dict = get_utils_dict(report_with_full_names)
-
-    engineers = set([(row[0]['name'], row[0]['login']) for row in report_with_full_names])
-
-    companies_sla = get_companies_sla(report_with_full_names)
-
-    excel_file_path = generate_excel_report_file(month, year, 
-                                                 companies_sla, list(engineers), utils_dict, app.root_path)
-
-    not_reported_engineers = get_engineers_not_reported_workload(engineers)
+    report = get_consolidated_report(month, year, app.root_path)
     return render_template('cons_work_report.html', 
-                           no_rep_list = not_reported_engineers, 
-                           excel_file_path = excel_file_path, month = month, 
-                           year = year, engineers = engineers, 
-                           companies_sla = companies_sla, 
-                           utils_dict = utils_dict, 
+                           no_rep_list = report['not_reported'], 
+                           excel_file_path = report['excel_file_path'], month = month, 
+                           year = year, engineers = report['engineers'], 
+                           rows = report['rows'], 
                            username = current_user.fullname, 
                            toolset = current_user.toolset_actions)
 
@@ -329,6 +325,7 @@ def user_crud():
                                users = users)
     elif request.method == 'POST':
         success = backend.add_user(request)
+        User.invalidate_profile(request.form['login'])
         if success != 'PROBLEM':
             flash(''.join(('Пользователь добавлен в систему, пароль: ', success)), 'info')
         else:
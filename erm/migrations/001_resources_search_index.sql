@@ -0,0 +1,12 @@
+-- Trigram index for /rest/search and /rest/ranked_search.
+-- Indexed expression must stay identical to SEARCH_DOCUMENT in rest.py,
+-- otherwise planner falls back to sequential scan.
+-- Usage: psql -d <DB_name> -f migrations/001_resources_search_index.sql
+
+create extension if not exists pg_trgm;
+
+create index if not exists resources_search_trgm_idx on resources
+    using gin ((coalesce(skills, '') || ' ' || coalesce(tags, '') || ' ' ||
+                coalesce(org_unit_id, '') || ' ' || coalesce(full_name, '')) gin_trgm_ops);
+
+analyze resources;
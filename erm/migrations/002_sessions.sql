@@ -0,0 +1,10 @@
+-- Server-side sessions for frontend users (see /rest/sessions in rest.py).
+-- Usage: psql -d <DB_name> -f migrations/002_sessions.sql
+
+create table if not exists sessions (
+    token text primary key,
+    login text not null,
+    expires bigint not null
+);
+
+create index if not exists sessions_expires_idx on sessions (expires);
@@ -0,0 +1,6 @@
+-- Index for matching synced tickets by project_id in /rest/eng_booking_bulk.
+-- Usage: psql -d <DB_name> -f migrations/003_booking_project_id_index.sql
+
+create index if not exists booking_project_id_idx on booking (project_id);
+
+analyze booking;
@@ -0,0 +1,25 @@
+-- Recurring booking stored as rule instead of row per occurrence.
+-- Occurrences start at start_date + k * repeat period (daily, weekly or monthly -
+-- same day of month, clamped to month end), last duration seconds and must end
+-- before end_date. They are generated for requested interval only (see
+-- get_series_occurrences in rest.py).
+-- Usage: psql -d <DB_name> -f migrations/004_booking_series.sql
+
+create table if not exists booking_series (
+    id serial primary key,
+    booking_type text,
+    percent text,
+    hours text,
+    active int not null default 1,
+    project_id text,
+    repeat text not null,
+    start_date bigint not null,
+    end_date bigint not null,
+    duration int not null,
+    company text,
+    sla text,
+    resource_login text not null
+);
+
+create index if not exists booking_series_login_idx 
+    on booking_series (resource_login, start_date, end_date);
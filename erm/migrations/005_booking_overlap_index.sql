@@ -0,0 +1,10 @@
+-- Index for booking overlap lookups by engineer (BOOKING_OVERLAP_CONDITION in rest.py):
+-- equality on resource_login, range scan on end_date, start_date checked in index.
+-- end_date goes first because lookups are mostly for current and recent weeks,
+-- so entries ended before requested interval (most of history) are skipped.
+-- Usage: psql -d <DB_name> -f migrations/005_booking_overlap_index.sql
+
+create index if not exists booking_login_end_idx on booking
+    (resource_login, end_date, start_date);
+
+analyze booking;
@@ -0,0 +1,11 @@
+-- External ticket key (Jira issue key, Remedy incident number, Sharepoint item id)
+-- and source system (sync config section) of synced booking, see /rest/eng_booking_bulk.
+-- Existing synced booking gets the key on first sync of its ticket.
+-- Usage: psql -d <DB_name> -f migrations/006_booking_ext_key.sql
+
+alter table booking add column if not exists ext_system text;
+alter table booking add column if not exists ext_key text;
+
+create unique index if not exists booking_ext_key_idx on booking (ext_key, ext_system);
+
+analyze booking;
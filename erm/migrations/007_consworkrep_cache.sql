@@ -0,0 +1,11 @@
+-- Materialized consolidated work report of period, built by /rest/consworkrep
+-- on first request and dropped by /rest/workrep POST for the same period.
+-- Usage: psql -d <DB_name> -f migrations/007_consworkrep_cache.sql
+
+create table if not exists consworkrep_cache (
+    month integer not null,
+    year integer not null,
+    built double precision,
+    report json,
+    primary key (month, year)
+);
@@ -0,0 +1,5 @@
+-- Consolidated work report is materialized joined to engineers names and pivoted
+-- (see /rest/consworkrep), reports materialized in previous format are dropped.
+-- Usage: psql -d <DB_name> -f migrations/008_consworkrep_cache_pivot.sql
+
+update consworkrep_cache set built = null, report = null;
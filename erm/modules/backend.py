@@ -2,6 +2,11 @@ import json
 import http.client
 import urllib.parse
 import time
+import configparser
+import queue
+import socket
+import threading
+from os import environ, getpid
 
 from .dateutils import dateutils 
 from .exceptions import DBError, NoDataError
@@ -9,8 +14,130 @@ from .exceptions import DBError, NoDataError
 from flask import flash
 
 
+def read_client_config(conf_file_name):
+    '''read backend client settings from [General] section of application config,
+    returns dict with pool_size and timeout (seconds)'''
+    config = configparser.ConfigParser()
+    if conf_file_name:
+        config.read(conf_file_name)
+    general = config['General'] if config.has_section('General') else {}
+    return {'pool_size': int(general.get('Backend_pool_size', 10)),
+            'timeout': float(general.get('Backend_timeout', 10))}
+
+
+class backendClient():
+    '''thread-safe HTTP client for erm backend(rest) with bounded pool
+    of keep-alive connections.
+    Pool is recreated in child process after fork (gunicorn workers)'''
+
+    RETRIED_METHODS = ('GET', 'HEAD')
+
+    def __init__(self, host, port, pool_size = 10, timeout = 10):
+        self.host = host
+        self.port = int(port)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.__lock = threading.Lock()
+        self.__init_pool()
+
+    def __init_pool(self):
+        self.hits = 0
+        self.misses = 0
+        self.__idle = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(self.pool_size)
+        self.__pid = getpid()
+
+    def __new_connection(self):
+        with self.__lock:
+            self.misses += 1
+        return http.client.HTTPConnection(self.host, self.port,
+                                          timeout = self.timeout)
+
+    def __checkout(self):
+        '''returns tuple of (connection, reused flag)'''
+        if self.__pid != getpid():
+            with self.__lock:
+                if self.__pid != getpid():
+                    self.__init_pool()
+        if not self.__slots.acquire(timeout = self.timeout):
+            raise ConnectionError('backend connection pool exhausted')
+        try:
+            conn = self.__idle.get_nowait()
+        except queue.Empty:
+            return self.__new_connection(), False
+        with self.__lock:
+            self.hits += 1
+        return conn, True
+
+    def __checkin(self, conn, reusable):
+        if reusable:
+            self.__idle.put(conn)
+        else:
+            conn.close()
+        self.__slots.release()
+
+    def request(self, method, url, body = None, headers = {}):
+        '''send request to backend through pooled connection,
+        returns tuple of (response body, response status)'''
+        conn, reused = self.__checkout()
+        try:
+            try:
+                conn.request(method, url, body, headers)
+                answ = conn.getresponse()
+            except (ConnectionResetError, BrokenPipeError):
+                #idle keep-alive connection could be closed by server, retry once,
+                #POST/PATCH could be already applied by backend, so they are not retried
+                conn.close()
+                if not reused or method not in self.RETRIED_METHODS:
+                    raise
+                conn = self.__new_connection()
+                conn.request(method, url, body, headers)
+                answ = conn.getresponse()
+            data = answ.read()
+        except socket.timeout as error:
+            conn.close()
+            self.__slots.release()
+            raise ConnectionError('backend request timed out') from error
+        except Exception:
+            conn.close()
+            self.__slots.release()
+            raise
+        self.__checkin(conn, not answ.will_close)
+        return data, answ.status
+
+    def stats(self):
+        '''returns pool hits/misses counters and current pool state'''
+        return {'hits': self.hits, 'misses': self.misses,
+                'idle': self.__idle.qsize(), 'pool_size': self.pool_size}
+
+    def close(self):
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 class backend:
     '''class represents erm backend(rest)'''
+    BACKEND_IP = '127.0.0.1'
+    BACKEND_PORT = 8000
+
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    @staticmethod
+    def client(host = BACKEND_IP, port = BACKEND_PORT):
+        '''returns shared pooled client for given backend address,
+        pool settings are read from SUIR_CFG configuration file'''
+        key = (host, int(port))
+        if key not in backend._clients:
+            with backend._clients_lock:
+                if key not in backend._clients:
+                    settings = read_client_config(environ.get('SUIR_CFG'))
+                    backend._clients[key] = backendClient(host, port, **settings)
+        return backend._clients[key]
+
     def add_error_processing(func):
         def func_with_msg(*args, **kwargs):
             try:
@@ -36,62 +163,48 @@ class backend:
 
     @staticmethod
     @add_error_processing
-    def search_logins(backend_ip, backend_port, search_string):
-        conn = http.client.HTTPConnection(backend_ip, backend_port)
-        conn.request('GET', 
-                     '/rest/search/{0}'.format(urllib.parse.quote(search_string)))
-        answ = conn.getresponse()
-        logins = answ.read()
-        conn.close()
-        return logins, answ.status, 'поисковому запросу'
-
+    def get_ranked_engineers(search_string, start, end, limit, offset = 0):
+        '''engineers found by search string, ranked by workload on backend side'''
+        url = '/rest/ranked_search/{0}/{1}/{2}?{3}'.format(urllib.parse.quote(search_string),
+                                                           start, end,
+                                                           urllib.parse.urlencode({'limit': limit,
+                                                                                   'offset': offset}))
+        ranked, status = backend.client().request('GET', url)
+        return ranked, status, 'поисковому запросу'
 
     @staticmethod
     @add_error_processing
     def get_engineers_list():
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET','/rest/eng_list')
-        answ = conn.getresponse()
-        eng_list = answ.read()
-        conn.close()
-        return eng_list, answ.status, 'инженерам'
+        eng_list, status = backend.client().request('GET','/rest/eng_list')
+        return eng_list, status, 'инженерам'
 
     @staticmethod
     @add_error_processing
     def get_eng_booking_week(eng_login):
         ONE_WEEK_SECONDS = 604800
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET',
+        bookinfo, status = backend.client().request('GET',
                      '/rest/eng_booking_interval/{0}/{1}/{2}'.format(eng_login, 
                                                                      dateutils.unix2iso(int(time.time())), 
                                                                      dateutils.unix2iso(int(time.time()) + ONE_WEEK_SECONDS)))
-        answ = conn.getresponse()
-        bookinfo = answ.read()
-        conn.close()
-        return bookinfo, answ.status, 'загрузке инженера {0} на текущую неделю'.format(eng_login)
-    
+        return bookinfo, status, 'загрузке инженера {0} на текущую неделю'.format(eng_login)
+
     @staticmethod
     @add_error_processing
     def get_engineer_booking(eng_login, start, end):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET','/rest/eng_booking_interval/' + eng_login + '/' + start + '/' + end)
-        answ = conn.getresponse()
-        booking_entries = answ.read()
-        return booking_entries, answ.status, 'загрузке инженера {0} в заданный период времени'.format(eng_login)
+        booking_entries, status = backend.client().request('GET',
+                     '/rest/eng_booking_interval/' + eng_login + '/' + start + '/' + end)
+        return booking_entries, status, 'загрузке инженера {0} в заданный период времени'.format(eng_login)
 
     @staticmethod
     @add_error_processing
     def get_eng_booking_info(eng_login, prj_id):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
         if prj_id != None:
             prj_id_encoded = urllib.parse.quote(prj_id)
-            conn.request('GET','/'.join(['/rest/eng_booking', eng_login, prj_id_encoded]))
+            url = '/'.join(['/rest/eng_booking', eng_login, prj_id_encoded])
         elif prj_id == None:
-            conn.request('GET','/'.join(['/rest/eng_booking', eng_login, '0']))
-        answ = conn.getresponse()
-        bookinfo = answ.read()
-        conn.close()
-        return bookinfo, answ.status, 'загрузке инженера {0}'.format(eng_login) 
+            url = '/'.join(['/rest/eng_booking', eng_login, '0'])
+        bookinfo, status = backend.client().request('GET', url)
+        return bookinfo, status, 'загрузке инженера {0}'.format(eng_login)
 
     @staticmethod
     @add_error_processing
@@ -106,35 +219,98 @@ class backend:
             'sla': sla})
         headers = {"Content-type": "application/x-www-form-urlencoded", 
                    "Accept": "text/plain"}
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('POST','/rest/eng_booking/' + resource_login + '/0', params, headers)
-        answ = conn.getresponse()
-        conn.close()
-        return json.dumps([]), answ.status, ''
+        _, status = backend.client().request('POST','/rest/eng_booking/' + resource_login + '/0',
+                                             params, headers)
+        return json.dumps([]), status, ''
+
+    @staticmethod
+    @add_error_processing
+    def add_booking_entries(booking_entries):
+        '''insert series of booking entries (dicts from dateutils.convert_booking_to_entries)
+        in one request, returns list of created ids'''
+        params = urllib.parse.urlencode({'entries': json.dumps(booking_entries)})
+        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
+        ids, status = backend.client().request('POST', '/rest/eng_booking_batch', params, headers)
+        return ids, status, ''
+
+    @staticmethod
+    @add_error_processing
+    def add_booking_series(series):
+        '''create recurring booking rule (dict from dateutils.convert_booking_to_series),
+        returns series id'''
+        params = urllib.parse.urlencode({'booking_type': series['booking_type'],
+            'percent': series['percent'], 'hours': series['hours'], 
+            'res_login': series['resource_login'], 'project_id': series['project_id'],
+            'repeat': series['repeat'], 'start_datetime': series['start_date'], 
+            'end_datetime': series['end_date'], 'duration': series['duration'],
+            'company': series['company'], 'sla': series['sla']})
+        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
+        series_id, status = backend.client().request('POST', '/rest/booking_series', 
+                                                     params, headers)
+        return series_id, status, ''
+
+    @staticmethod
+    @add_error_processing
+    def update_booking_series(series_id, changes):
+        '''change whole series, changes may have project_id, company, sla and 
+        end_datetime (ISO, to stop series from that date)'''
+        params = urllib.parse.urlencode(changes)
+        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
+        _, status = backend.client().request('PATCH', '/rest/booking_series/{0}'.format(series_id),
+                                             params, headers)
+        return json.dumps([]), status, 'серии бронирования {0}'.format(series_id)
+
+    @staticmethod
+    @add_error_processing
+    def delete_booking_series(series_id):
+        _, status = backend.client().request('DELETE', 
+                                             '/rest/booking_series/{0}'.format(series_id))
+        return json.dumps([]), status, 'серии бронирования {0}'.format(series_id)
 
     @staticmethod
     @add_error_processing
-    def update_booking(prj_id, assignee, sla):
-        '''update entry about incident based on list from SOAP-answer'''
-        params = urllib.parse.urlencode({'prj_id': prj_id, 
-                                         'res_login': assignee,
-                                         'sla': sla})
+    def delete_booking(booking_id):
+        '''delete booking entry by id, negative id of series occurrence deletes the series'''
+        _, status = backend.client().request('DELETE', '/rest/spec_booking/{0}'.format(booking_id))
+        return json.dumps([]), status, 'бронированию {0}'.format(booking_id)
+
+    @staticmethod
+    @add_error_processing
+    def update_booking(prj_id, assignee, sla, end_date = None, ext_key = None, ext_system = None):
+        '''update entry about incident based on list from SOAP-answer,
+        booking ends at end_date (ISO) or in one hour if not set.
+        Entry is found by ticket key if ext_key is set, by prj_id otherwise'''
+        form = {'prj_id': prj_id, 'res_login': assignee, 'sla': sla}
+        if end_date is not None:
+            form['end_datetime'] = end_date
+        if ext_key is not None:
+            form['ext_key'] = ext_key
+            form['ext_system'] = ext_system
+        params = urllib.parse.urlencode(form)
         headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('PATCH','/rest/eng_booking/' + assignee + '/0', params, headers)
-        answ = conn.getresponse()
-        conn.close()
-        return json.dumps([]), answ.status, ''
+        _, status = backend.client().request('PATCH','/rest/eng_booking/' + assignee + '/0',
+                                             params, headers)
+        return json.dumps([]), status, ''
+
+    @staticmethod
+    @add_error_processing
+    def upsert_bookings(entries, ext_system, start_date, end_date):
+        '''create or prolong booking for list of (prj_id, assignee, company, sla, ext_key)
+        from ext_system in one request, returns list of [ext_key, outcome]'''
+        params = urllib.parse.urlencode({'entries': json.dumps(entries),
+                                         'ext_system': ext_system,
+                                         'start_datetime': start_date,
+                                         'end_datetime': end_date})
+        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
+        outcomes, status = backend.client().request('POST', '/rest/eng_booking_bulk', 
+                                                    params, headers)
+        return outcomes, status, 'задачам'
 
     @staticmethod
     @add_error_processing
     def get_eng_info(eng_login):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET','/rest/eng/' + eng_login)
-        answ = conn.getresponse()
-        enginfo = answ.read()
-        conn.close()
-        return enginfo, answ.status, 'профилю инженера {0}'.format(eng_login)
+        enginfo, status = backend.client().request('GET','/rest/eng/' + eng_login)
+        return enginfo, status, 'профилю инженера {0}'.format(eng_login)
 
     @staticmethod
     @add_error_processing
@@ -149,12 +325,8 @@ class backend:
                                          'util': util, 'suir_id': suir_id, 'langs': langs})
         headers = {"Content-type": "application/x-www-form-urlencoded", 
                    "Accept": "text/plain"}
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('POST','/rest/eng/'+suir_id, params, headers)
-        answ = conn.getresponse()
-        print(answ.read())
-        conn.close()
-        return json.dumps([]), answ.status, ''
+        _, status = backend.client().request('POST','/rest/eng/'+suir_id, params, headers)
+        return json.dumps([]), status, ''
 
     @staticmethod
     @add_error_processing
@@ -169,95 +341,96 @@ class backend:
                                          'util': util, 'suir_id': suir_id, 'langs': langs})
         headers = {"Content-type": "application/x-www-form-urlencoded", 
                    "Accept": "text/plain"}
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('PATCH','/rest/eng/'+suir_id, params, headers)
-        answ = conn.getresponse()
-        print(answ.read())
-        conn.close()
-        return json.dumps([]), answ.status, ''
+        _, status = backend.client().request('PATCH','/rest/eng/'+suir_id, params, headers)
+        return json.dumps([]), status, ''
 
     @staticmethod
     @add_error_processing
     def delete_engineer(eng_login):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('DELETE','/rest/eng/' + eng_login)
-        answ = conn.getresponse()
-        conn.close()
-        return json.dumps([]), answ.status, ''
+        _, status = backend.client().request('DELETE','/rest/eng/' + eng_login)
+        return json.dumps([]), status, ''
 
     @staticmethod
     @add_error_processing
     def get_workreport(eng_login, month, year):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET','/rest/workrep/' + eng_login + '/' + str(month) + '/' + str(year))
-        answ = conn.getresponse()
-        report_from_db = answ.read()
-        return report_from_db, answ.status, 'ежемесячному отчету. Отчет необходимо заполнить и сохранить'
+        report_from_db, status = backend.client().request('GET',
+                     '/rest/workrep/' + eng_login + '/' + str(month) + '/' + str(year))
+        return report_from_db, status, 'ежемесячному отчету. Отчет необходимо заполнить и сохранить'
 
     @staticmethod
     @add_error_processing
     def save_workreport(request, eng_login, month, year):
         params = urllib.parse.urlencode(request.form.to_dict())
         headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('POST','/rest/workrep/' + eng_login + '/' + str(month) + '/' + str(year), body = params, headers = headers)
-        answ = conn.getresponse()
-        return json.dumps([]), answ.status, ''
+        _, status = backend.client().request('POST',
+                     '/rest/workrep/' + eng_login + '/' + str(month) + '/' + str(year),
+                     body = params, headers = headers)
+        return json.dumps([]), status, ''
 
     @staticmethod
     @add_error_processing
     def get_all_workreports(month, year):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET','/rest/consworkrep/' + str(month) + '/' + str(year))
-        answ = conn.getresponse()
-        all_workreports = answ.read()
-        return all_workreports, answ.status, 'ежемесячным отчетам'
+        all_workreports, status = backend.client().request('GET',
+                     '/rest/consworkrep/' + str(month) + '/' + str(year))
+        return all_workreports, status, 'ежемесячным отчетам'
 
     @staticmethod
     @add_error_processing 
     def get_user(login):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET','/rest/user/' + login)
-        answ = conn.getresponse()
-        users = answ.read()
-        return users, answ.status, 'пользователю {0}'.format(login)
+        users, status = backend.client().request('GET','/rest/user/' + login)
+        return users, status, 'пользователю {0}'.format(login)
 
     @staticmethod
     @add_error_processing 
     def get_users():
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET','/rest/users')
-        answ = conn.getresponse()
-        users = answ.read()
-        return users, answ.status, 'пользователям'
+        users, status = backend.client().request('GET','/rest/users')
+        return users, status, 'пользователям'
 
     @staticmethod
     @add_error_processing 
     def add_user(request):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
         headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
         params = urllib.parse.urlencode(request.form.to_dict())
-        conn.request('POST','/rest/users', body = params, headers = headers)
-        answ = conn.getresponse()
-        success = answ.read()
-        return success, answ.status, ''
+        success, status = backend.client().request('POST','/rest/users',
+                                                   body = params, headers = headers)
+        return success, status, ''
 
     @staticmethod
     @add_error_processing
     def check_credentials(login, pswd):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET', '/rest/check_credentials/{0}/{1}'.format(login, pswd))
-        answ = conn.getresponse()
-     
         #pswd_list[0] -> password hash, pswd_list[1] -> password salt
-        is_auth = answ.read()
-        return is_auth, answ.status, ''
+        is_auth, status = backend.client().request('GET',
+                     '/rest/check_credentials/{0}/{1}'.format(login, pswd))
+        return is_auth, status, ''
+     
+    @staticmethod
+    @add_error_processing
+    def create_session(login, pswd):
+        '''check credentials and open session on backend, 
+        returns dict with session token or False'''
+        params = urllib.parse.urlencode({'login': login, 'pswd': pswd})
+        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
+        session, status = backend.client().request('POST', '/rest/sessions', params, headers)
+        return session, status, ''
+
+    @staticmethod
+    @add_error_processing
+    def get_session(token):
+        '''returns dict with session login and expiration time, None if session is not valid'''
+        session, status = backend.client().request('GET', 
+                     '/rest/sessions/{0}'.format(urllib.parse.quote(token)))
+        return session, status, ''
+
+    @staticmethod
+    @add_error_processing
+    def delete_session(token):
+        _, status = backend.client().request('DELETE', 
+                     '/rest/sessions/{0}'.format(urllib.parse.quote(token)))
+        return json.dumps([]), status, ''
 
     @staticmethod
     @add_error_processing
     def get_user_group(login):
-        conn = http.client.HTTPConnection('127.0.0.1', 8000)
-        conn.request('GET', '/rest/get_user_group/{0}'.format(login))
-        answ = conn.getresponse()
-        user_group = answ.read()
-        return user_group, answ.status, ''
+        user_group, status = backend.client().request('GET',
+                     '/rest/get_user_group/{0}'.format(login))
+        return user_group, status, ''
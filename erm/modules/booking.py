@@ -1,6 +1,7 @@
 from flask import flash
 
 from .backend import backend
+from .dateutils import dateutils
 from .message import message as msg
 from .exceptions import MessagingError
 
@@ -19,10 +20,11 @@ def get_booking_info_from_request(request):
     booking['end_date'] = request.form['end_datetime']
     return booking
 
-def send_task_added_messages(project_id, username, resource_login, config):
+def send_task_added_messages(project_id, username, resource_login):
     msg_send_status = msg.send_sms('Вам назначена задача на http://st-erm: ' + project_id + ' :' + username, 
                                    resource_login, 
-                                   config['sms_login'], config['sms_pwd'], config['sms_originator'])
+                                   digest = 'Вам назначены задачи на http://st-erm:',
+                                   digest_item = project_id + ' :' + username)
     #app.logger.info(msg_send_status)
     #msg_send_status = msg.send_sms_to_head('Инженеру назначена задача на http://st-erm: ' + project_id, 
     #                                       resource_login, conf_dict['sms_login'], conf_dict['sms_pwd'])
@@ -37,19 +39,28 @@ def set_timeline_hist_or_act(start, end):
         act_hist = 'hist'
     return act_hist
 
+def add_booking(booking):
+    '''recurring booking is stored as one series rule, other booking as entries'''
+    if booking['repeat'] != 'no':
+        series_id = backend.add_booking_series(dateutils.convert_booking_to_series(**booking))
+        if series_id:
+            flash('Задача успешно добавлена', 'info')
+        return series_id
+    return add_booking_entries(dateutils.convert_booking_to_entries(**booking))
+
 def add_booking_entries(booking_entries):
-    for entry in booking_entries:
-        data = backend.add_booking_entry(**entry)
-    if data == []:
+    '''add all entries of booking in one request, returns list of created ids'''
+    ids = backend.add_booking_entries(booking_entries)
+    if ids:
         flash('Задача успешно добавлена', 'info')
-    return data
+    return ids
 
 def get_booking_entries_short_description(eng_list_login_name, start_date, end_date):
     activities_short_description = []
 
     for eng in eng_list_login_name:
         activities = backend.get_engineer_booking(eng['login'], start_date, end_date)
-        eng_activities = [{'id':act[0], 'descr': act[6], 'company': act[10], 'sla': act[11], 
+        eng_activities = [{'id':act[0], 'descr': act[1], 'company': act[4], 'sla': act[5], 
                            'eng': eng['fullname']} for act in activities]
         if eng_activities:
             for act in eng_activities:
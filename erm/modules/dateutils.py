@@ -62,6 +62,40 @@ class dateutils():
                    day_end = day_end + timedelta(days=_month_days)
  
 
+    @staticmethod
+    def get_booking_timeframe(percent, start_date, end_date):
+        '''start and end of booking as datetime.datetime instances, percent booking
+        starts at the begining of work day (10 AM) and lasts for percent of 9 hours work day'''
+        if percent == '':
+            start_date_obj = datetime.strptime(start_date, '%Y-%m-%dT%H:%M')
+            end_date_obj =  datetime.strptime(end_date, '%Y-%m-%dT%H:%M')
+        elif int(percent) > 0:
+            start_date_obj = datetime.strptime(start_date, 
+                                               '%Y-%m-%d') + timedelta(hours = 10)
+            task_duration = timedelta(hours = (9 * (int(percent)/100) + 10))
+            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d') + task_duration
+        return start_date_obj, end_date_obj
+
+    @staticmethod
+    def convert_booking_to_series(booking_type, percent, hours, 
+                                  repeat, start_date, end_date, company, sla,
+                                  project_id, resource_login):
+        '''prepare recurring booking rule for booking_series db table instead of 
+        one entry per occurrence: start_date is start of first occurrence,
+        end_date is end of series, duration is occurrence length in seconds
+        (same time of day window as in daterange)'''
+        start_date_obj, end_date_obj = dateutils.get_booking_timeframe(percent, start_date, 
+                                                                       end_date)
+        #time of day window with minutes (percent booking may end at 14:30)
+        work_timeframe = (end_date_obj - end_date_obj.replace(hour = 0, minute = 0) - 
+                          (start_date_obj - start_date_obj.replace(hour = 0, minute = 0)))
+        return {'booking_type': booking_type, 'percent': percent, 'hours': hours, 
+                'repeat': repeat, 
+                'start_date': datetime.strftime(start_date_obj, '%Y-%m-%dT%H:%M'),
+                'end_date': datetime.strftime(end_date_obj, '%Y-%m-%dT%H:%M'),
+                'duration': int(work_timeframe.total_seconds()), 'company': company, 
+                'sla': sla, 'project_id': project_id, 'resource_login': resource_login}
+
     @staticmethod
     def convert_booking_to_entries(booking_type, percent, hours, 
                                    repeat, start_date, end_date, company, sla,
@@ -76,14 +110,8 @@ class dateutils():
         function uses datetime and calendar standard modules
         '''
         
-        if percent == '':
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%dT%H:%M')
-            end_date_obj =  datetime.strptime(end_date, '%Y-%m-%dT%H:%M')
-        elif int(percent) > 0:
-            start_date_obj = datetime.strptime(start_date, 
-                                               '%Y-%m-%d') + timedelta(hours = 10)
-            task_duration = timedelta(hours = (9 * (int(percent)/100) + 10))
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d') + task_duration
+        start_date_obj, end_date_obj = dateutils.get_booking_timeframe(percent, start_date, 
+                                                                       end_date)
 
  
         booking_entries = []
@@ -114,11 +142,12 @@ class dateutils():
 
     @staticmethod
     def replace_timestamps(bk):
-        '''replaces all unix timestamps with ISO 8601 in select from booking table (from app db)'''
+        '''replaces all unix timestamps with ISO 8601 in booking row 
+        (id, project_id, start_date, end_date, company, sla) from app db'''
 
         bk_updated = list(bk)
-        bk_updated[8] = dateutils.unix2iso(bk[8])
-        bk_updated[9] = dateutils.unix2iso(bk[9])
+        bk_updated[2] = dateutils.unix2iso(bk[2])
+        bk_updated[3] = dateutils.unix2iso(bk[3])
         return bk_updated
 
     @staticmethod
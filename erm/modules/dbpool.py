@@ -0,0 +1,103 @@
+import threading
+from os import getpid
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+
+class dbPool():
+    '''process-wide PostgreSQL connections pool.
+    Underlying pool is created lazily and recreated after fork,
+    so every gunicorn worker gets its own connections.
+    When all maxconn connections are checked out, getconn waits up to timeout 
+    seconds for one of them to be returned'''
+
+    def __init__(self, minconn, maxconn, timeout = 10, **conn_params):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.conn_params = conn_params
+        self.__pool = None
+        self.__free = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+
+    def __get_pool(self):
+        if self.__pool is None or self.__pid != getpid():
+            with self.__lock:
+                if self.__pool is None or self.__pid != getpid():
+                    #connections inherited from parent process must not be closed here,
+                    #they are still used by parent
+                    self.__pool = psycopg2.pool.ThreadedConnectionPool(self.minconn,
+                                                                       self.maxconn,
+                                                                       **self.conn_params)
+                    self.__free = threading.BoundedSemaphore(self.maxconn)
+                    self.__pid = getpid()
+        return self.__pool
+
+    @staticmethod
+    def __is_usable(conn):
+        '''check without round trip to server: connection is not closed and is not 
+        left in broken transaction, dropped connections are found by failed requests'''
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    @staticmethod
+    def __is_alive(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute('select 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        '''checkout connection from pool, closed connections are replaced with new ones'''
+        pool = self.__get_pool()
+        if not self.__free.acquire(timeout = self.timeout):
+            raise psycopg2.OperationalError('no free DB connection in {0} s'.format(self.timeout))
+        try:
+            for _ in range(self.maxconn + 1):
+                conn = pool.getconn()
+                if self.__is_usable(conn):
+                    return conn
+                pool.putconn(conn, close = True)
+            raise psycopg2.OperationalError('no healthy DB connections available')
+        except Exception:
+            self.__free.release()
+            raise
+
+    def putconn(self, conn, failed = False):
+        '''return connection to pool: commit on success, rollback on failure,
+        connection is checked by round trip only after failure'''
+        pool = self.__get_pool()
+        close = False
+        try:
+            if failed:
+                conn.rollback()
+                close = not self.__is_alive(conn)
+            else:
+                conn.commit()
+        except psycopg2.Error:
+            close = True
+        try:
+            pool.putconn(conn, close = close or bool(conn.closed))
+        finally:
+            self.__free.release()
+
+    def closeall(self):
+        if self.__pool is not None and self.__pid == getpid():
+            self.__pool.closeall()
+        self.__pool = None
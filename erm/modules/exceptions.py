@@ -11,3 +11,9 @@ class NoDataError(ERMError):
 class MessagingError(ERMError):
     def __init__(self, error_data):
         self.error_data = error_data
+
+class ExternalSystemError(ERMError):
+    def __init__(self, status, error_data):
+        super().__init__('request failed with status {0}: {1}'.format(status, error_data))
+        self.status = status
+        self.error_data = error_data
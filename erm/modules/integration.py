@@ -1,33 +1,86 @@
 import http.client
 import urllib.parse
 import base64
+import gzip
 import json
 import requests
 import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 
 from requests_ntlm import HttpNtlmAuth
 import zeep
-from zeep import xsd, Client
+import zeep.helpers
+from zeep import xsd
+from zeep.cache import SqliteCache
 from zeep.transports import Transport
 
 from .backend import backend
 from .dateutils import dateutils
-from .exceptions import ERMError, NoDataError
+from .exceptions import ERMError, ExternalSystemError, NoDataError
 
 
 class externalSystem():
     '''all new integration types must be 
        added as subclasses inherited from externalSystem'''
-    def __init__(self, url, usr, pswd):
+
+    #fetched WSDLs are kept on disk between sync runs, zeep cache in user cache dir if not set
+    wsdl_cache_path = None
+    wsdl_cache_ttl = 24*60*60
+
+    #engineers per query in batched mode, 0 - one query per engineer
+    batch_size = 0
+
+    #unix time, if set only tickets modified since then are fetched (incremental sync)
+    modified_since = None
+
+    #if set, tickets which are not open (closed, resolved) are fetched instead of open ones,
+    #incremental sync uses it to end booking of tickets closed since last run
+    fetch_closed = False
+
+    _sessions = {}
+    _soap_clients = {}
+    _soap_lock = threading.Lock()
+
+    def __init__(self, url, usr, pswd, timeout = 30, source = None):
         self.url = url
         self.usr = usr
         self.pswd = pswd
+        #name of system in sync config, tickets keys are unique per source
+        self.source = source or type(self).__name__
+        self.timeout = timeout
         self.connection = None
 
     def connect(self):
         return True
 
+    def get_session(self, auth = None):
+        '''long-lived HTTP session (keep-alive) shared by all integrations with same auth'''
+        key = (type(auth).__name__, getattr(auth, 'username', None))
+        with externalSystem._soap_lock:
+            if key not in externalSystem._sessions:
+                session = requests.Session()
+                session.auth = auth
+                externalSystem._sessions[key] = session
+            return externalSystem._sessions[key]
+
+    def get_soap_client(self, auth = None):
+        '''zeep client for self.url, created once per process. WSDL and XSD
+        documents are fetched through shared session and cached on disk'''
+        session = self.get_session(auth)
+        key = (self.url, id(session))
+        with externalSystem._soap_lock:
+            if key not in externalSystem._soap_clients:
+                cache = SqliteCache(path = self.wsdl_cache_path, timeout = self.wsdl_cache_ttl)
+                transport = Transport(session = session, cache = cache, timeout = self.timeout,
+                                      operation_timeout = self.timeout)
+                externalSystem._soap_clients[key] = zeep.Client(wsdl = self.url, 
+                                                                transport = transport)
+            return externalSystem._soap_clients[key]
+
     def get_raw_entries(engineer):
         raise NotImplementedError 
  
@@ -39,51 +92,138 @@ class externalSystem():
         result = self.add_engineer_login_to_raw_entries(response, engineer)
         return result
 
+    def get_entries_batch(self, engineers):
+        '''get entries for several engineers with one query (see batch_size)'''
+        raise NotImplementedError 
+
+    def is_query_rejected(self, error):
+        '''True if system rejected whole batched query (e.g. because of one unknown login),
+        chunk is queried again engineer by engineer then'''
+        return False
+
+    def __get_entries_timed(self, engineers):
+        started = time.monotonic()
+        entries, failures = [], []
+        try:
+            if self.batch_size:
+                entries = self.get_entries_batch(engineers)
+            else:
+                entries = self.get_entries(engineers[0])
+        except Exception as error:
+            if self.batch_size and len(engineers) > 1 and self.is_query_rejected(error):
+                for engineer in engineers:
+                    try:
+                        entries = entries + self.get_entries(engineer)
+                    except Exception as engineer_error:
+                        failures.append((engineer[12], engineer_error))
+            else:
+                failures = [(engineer[12], error) for engineer in engineers]
+        return entries, failures, time.monotonic() - started
+
+    def get_entries_for_engineers(self, engineers, concurrency = 1):
+        '''get entries for list of engineers with up to concurrency parallel requests,
+        engineers are queried in chunks of batch_size if system supports batched mode.
+        Returns entries list and fetch stats: latencies (seconds) and 
+        failures (engineer login, error) lists'''
+        chunk_size = self.batch_size or 1
+        chunks = [engineers[i:i + chunk_size] for i in range(0, len(engineers), chunk_size)]
+        entries = []
+        stats = {'latencies': [], 'failures': []}
+        with ThreadPoolExecutor(max_workers = max(1, concurrency)) as executor:
+            for chunk_entries, failures, latency in executor.map(self.__get_entries_timed, chunks):
+                stats['latencies'].append(latency)
+                stats['failures'].extend(failures)
+                entries = entries + chunk_entries
+        return entries, stats
+
     def preprocess_entries():
+        '''convert raw entries to (prj_id, assignee, company, sla, ext_key) tuples,
+        ext_key is ticket key in external system'''
         raise NotImplementedError 
 
-    def __get_start_and_end_date_for_entry(self):
+    def __get_start_and_end_date_for_entry(self, lease = timedelta(hours = 1)):
         start_date = str(date.today()) + 'T' + str(datetime.today().hour) + ':' + ('0' if datetime.today().minute < 10 else '') + str(datetime.today().minute)
 
-        one_hour_delta = timedelta(hours = 1)
-        end_datetime = datetime.today() + one_hour_delta
+        end_datetime = datetime.today() + lease
         end_date = str(end_datetime.date()) + 'T' + str(end_datetime.hour) + ':' + str(end_datetime.minute)
         return start_date, end_date
 
-    def send_booking_to_backend(self, entriesList):
-        '''1. check if booking entry with same prj_id exists 
-           2. if entry exists -> update db 3. if no -> insert into db'''
-        for prj_id, assignee, company, sla in entriesList:
+    def send_booking_to_backend(self, entriesList, lease = timedelta(hours = 1)):
+        '''create booking for new tickets and prolong booking of known ones 
+        with one bulk request, booking of ticket lasts for lease time after sync, 
+        so every sync run must book all open tickets, fetched or not'''
+        if not entriesList:
+            return '200'
+        start_date, end_date = self.__get_start_and_end_date_for_entry(lease)
+        outcomes = backend.upsert_bookings([list(entry) for entry in entriesList], 
+                                           self.source, start_date, end_date)
+        for outcome in ('updated', 'created'):
+            print('{0} entries: {1}'.format(outcome.capitalize(), 
+                                            sum(1 for _, result in outcomes if result == outcome)))
+        return '200'
+
+    def close_booking(self, entriesList):
+        '''end booking of closed tickets now'''
+        end_date = self.__get_start_and_end_date_for_entry(timedelta(0))[1]
+        for prj_id, assignee, company, sla, ext_key in entriesList:
             try:
-                backend.update_booking(prj_id, assignee, sla)
-                print('Updating entries')
+                backend.update_booking(prj_id, assignee, sla, end_date = end_date, 
+                                       ext_key = ext_key, ext_system = self.source)
+                print('Closing entries')
             except NoDataError:
-                start_date, end_date = self.__get_start_and_end_date_for_entry()
-                print('Creating entries')
-                backend.add_booking_entry(booking_type = 'hours', percent = None, 
-                                                         hours = 1, repeat = 0, start_date=start_date, 
-                                                         end_date=end_date, company = company, 
-                                                         sla = sla, project_id = prj_id, 
-                                                         resource_login = assignee)
+                pass
         return '200'
 
 
 class Sharepoint(externalSystem):
-    def get_raw_entries(self, eng):
-        '''get entries from Sharepoint using SOAP and NTLM auth'''
-        session = requests.Session()
-        session.auth = HttpNtlmAuth(self.usr,self.pswd)
-        r = session.get(self.url)
-        client = Client(self.url, transport=Transport(session=session))
-        response = client.service.GetListItems(listName = '{AF9DFDD5-6EEB-44BA-B908-4E42A5221CD7}', 
-                                               viewName = '{2D63DFF6-F930-46AC-AD53-3E5688A1FD39}',
+    LIST_NAME = '{AF9DFDD5-6EEB-44BA-B908-4E42A5221CD7}'
+    VIEW_NAME = '{2D63DFF6-F930-46AC-AD53-3E5688A1FD39}'
+
+    def __init__(self, url, usr, pswd, timeout = 30, source = None):
+        super().__init__(url, usr, pswd, timeout, source)
+        self.__rows_by_assignee = None
+        self.__lock = threading.Lock()
+
+    def get_list_rows(self):
+        '''get all list rows from Sharepoint using SOAP and NTLM auth'''
+        client = self.get_soap_client(HttpNtlmAuth(self.usr,self.pswd))
+        response = client.service.GetListItems(listName = self.LIST_NAME, 
+                                               viewName = self.VIEW_NAME,
                                                rowLimit = 3000)
-        return response
+        return response[0].getchildren()
+
+    def __get_rows_by_assignee(self):
+        '''list is fetched once per instance (sync run) and indexed by assignee'''
+        if self.__rows_by_assignee is None:
+            with self.__lock:
+                if self.__rows_by_assignee is None:
+                    rows_by_assignee = {}
+                    for row in self.get_list_rows():
+                        assignee = row.get(key = 'ows_sl_WFSAssignedTo')
+                        rows_by_assignee.setdefault(assignee, []).append(row)
+                    self.__rows_by_assignee = rows_by_assignee
+        return self.__rows_by_assignee
+
+    def is_modified(self, row):
+        '''list has no server side filter by modification time, so it is checked here.
+        ows_Modified is server local time'''
+        if self.modified_since is None:
+            return True
+        modified = row.get(key = 'ows_Modified')
+        if not modified:
+            return True
+        modified = time.mktime(datetime.strptime(modified, '%Y-%m-%d %H:%M:%S').timetuple())
+        return modified >= self.modified_since
+
+    def get_raw_entries(self, eng):
+        '''get list rows assigned to engineer'''
+        return [row for row in self.__get_rows_by_assignee().get(eng[10], [])
+                if self.is_modified(row)]
 
     def add_engineer_login_to_raw_entries(self, response, engineer):
         result = []
-        for row in response[0].getchildren():
-            if engineer[10] == row.get(key = 'ows_sl_WFSAssignedTo') and row.get(key = 'ows_sl_WFSStatus') == 'Выполнение':
+        for row in response:
+            if (row.get(key = 'ows_sl_WFSStatus') == 'Выполнение') != self.fetch_closed:
                 result.append({'key': row.get(key = 'ows_ID'), 
                             'summary': row.get(key = 'ows_Title'), 
                             'assignee': row.get(key = 'ows_sl_WFSAssignedTo'), 
@@ -97,25 +237,113 @@ class Sharepoint(externalSystem):
         for entry in raw_entries:
             prj_id = entry['key'] + ' ' + entry['summary']
             assignee = entry['eng_id']
-            preproced_entries.append((prj_id, assignee, 'Стэп Лоджик', 'none'))
+            preproced_entries.append((prj_id, assignee, 'Стэп Лоджик', 'none', entry['key']))
         return preproced_entries
 
 
 class Jira(externalSystem):
-    def get_raw_entries(self, engineer):
-        '''get entries from JIRA using rest api and HTTP basic auth'''
-        jql_expr = 'resolution = Unresolved AND status in (Open, "In Progress", Reopened) AND assignee = {0}'.format(engineer[9])
-        params = urllib.parse.urlencode({'jql': jql_expr})
+    OPEN_ISSUES_JQL = 'resolution = Unresolved AND status in (Open, "In Progress", Reopened)'
+    FIELDS = 'key,summary,assignee'
+    port = 8080
+
+    batch_size = 50
+    page_size = 100
+
+    def __init__(self, url, usr, pswd, timeout = 30, source = None):
+        super().__init__(url, usr, pswd, timeout, source)
         b64usrpass = base64.b64encode(bytes(self.usr + ":" + self.pswd, "ascii"))
-        headers = {"Authorization": "Basic " + b64usrpass.decode("ascii"), 
-                   "Connection": b"keep-alive", 
-                   "Accept-Encoding": b"gzip, deflate"}
-        conn = http.client.HTTPConnection(self.url, 8080)
-        conn.request('GET', url = '/rest/api/latest/search?{0}'.format(params), headers = headers)
-        answ = conn.getresponse()
-        response = json.loads(answ.read().decode('utf-8'))['issues']
+        self.headers = {"Authorization": "Basic " + b64usrpass.decode("ascii"), 
+                        "Connection": "keep-alive", 
+                        "Accept-Encoding": "gzip, deflate"}
+        #persistent connection per sync thread
+        self.__local = threading.local()
+
+    def __get_connection(self):
+        if getattr(self.__local, 'connection', None) is None:
+            self.__local.connection = http.client.HTTPConnection(self.url, self.port, 
+                                                                 timeout = self.timeout)
+        return self.__local.connection
+
+    def __drop_connection(self, conn):
         conn.close()
-        return response
+        self.__local.connection = None
+
+    def __get(self, url):
+        for attempt in range(2):
+            conn = self.__get_connection()
+            try:
+                conn.request('GET', url = url, headers = self.headers)
+                answ = conn.getresponse()
+                data = answ.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                #server closed idle keep-alive connection, reconnect once
+                self.__drop_connection(conn)
+                if attempt:
+                    raise
+            except Exception:
+                #state of connection is unknown after timeout or other failure 
+                #(response may still arrive), it must not be reused
+                self.__drop_connection(conn)
+                raise
+        if answ.getheader('Connection', '').lower() == 'close':
+            self.__drop_connection(conn)
+
+        encoding = answ.getheader('Content-Encoding', '').lower()
+        if encoding == 'gzip':
+            data = gzip.decompress(data)
+        elif encoding == 'deflate':
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                data = zlib.decompress(data, -zlib.MAX_WBITS)
+        if answ.status != 200:
+            raise ExternalSystemError(answ.status, data[:200])
+        return json.loads(data.decode('utf-8'))
+
+    def search(self, jql_expr):
+        '''get all issues matching JQL with key, summary and assignee fields only,
+        paging with startAt'''
+        issues = []
+        while True:
+            params = urllib.parse.urlencode({'jql': jql_expr, 'fields': self.FIELDS,
+                                             'startAt': len(issues), 
+                                             'maxResults': self.page_size})
+            page = self.__get('/rest/api/latest/search?{0}'.format(params))
+            issues = issues + page['issues']
+            if not page['issues'] or len(issues) >= page.get('total', 0):
+                break
+        return issues
+
+    def get_jql(self, engineers):
+        assignees = ', '.join('"{0}"'.format(engineer[9].replace('"', '\\"')) 
+                              for engineer in engineers)
+        condition = ('NOT ({0})' if self.fetch_closed else '{0}').format(self.OPEN_ISSUES_JQL)
+        jql_expr = '{0} AND assignee in ({1})'.format(condition, assignees)
+        if self.modified_since is not None:
+            jql_expr += ' AND updated >= "{0}"'.format(time.strftime('%Y/%m/%d %H:%M', 
+                                                        time.localtime(self.modified_since)))
+        return jql_expr
+
+    def is_query_rejected(self, error):
+        '''JQL with unknown or deactivated assignee is rejected with 400 as a whole'''
+        return isinstance(error, ExternalSystemError) and error.status == 400
+
+    def get_raw_entries(self, engineer):
+        '''get entries from JIRA using rest api and HTTP basic auth'''
+        return self.search(self.get_jql([engineer]))
+
+    def get_entries_batch(self, engineers):
+        '''get issues for chunk of engineers with one JQL and split them back by assignee'''
+        eng_ids = {engineer[9].lower(): engineer[12] for engineer in engineers}
+        result = []
+        for entry in self.search(self.get_jql(engineers)):
+            assignee = entry['fields'].get('assignee') or {}
+            eng_id = eng_ids.get((assignee.get('name') or '').lower())
+            if eng_id is not None:
+                entry['eng_id'] = eng_id
+                result.append(entry)
+        return result
 
     def add_engineer_login_to_raw_entries(self, response, engineer):
         for entry in response:
@@ -127,14 +355,25 @@ class Jira(externalSystem):
         for entry in res:
             prj_id = entry['key'] + ' ' + entry['fields']['summary']
             assignee = entry['eng_id']
-            prep_res.append((prj_id, assignee, 'Стэп Лоджик', re.sub(r'-[0-9]+', '', entry['key'])))
+            prep_res.append((prj_id, assignee, 'Стэп Лоджик', re.sub(r'-[0-9]+', '', entry['key']), 
+                             entry['key']))
         return prep_res
 
 
 class Remedy(externalSystem):
+    '''subclasses set QueryList service name, assignee field name 
+    and condition for open tickets'''
+    query_service = None
+    assignee_field = None
+    open_condition = None
+
+    page_size = 100
+    #fault returned when there are no (more) entries matching qualification
+    NO_ENTRIES_FAULT = 'ERROR (302)'
+
     def connect(self):
         # typical WSDL URL http://<midtier_server>/arsys/WSDL/public/<servername>/HPD_IncidentInterface_WS
-        client = zeep.Client(wsdl=self.url)
+        client = self.get_soap_client()
         
         header = xsd.Element(
                 'AuthenticationInfo',
@@ -153,10 +392,80 @@ class Remedy(externalSystem):
         self.connection = (client, header_value)
         return True
 
+    @property
+    def assignee_key(self):
+        '''assignee element in returned entries, AR System web services name elements 
+        after fields with characters not allowed in XML names replaced by "_"'''
+        return re.sub(r'[^\w.-]', '_', self.assignee_field)
+
+    @staticmethod
+    def quote_value(value):
+        '''string literal for qualification, double quote is escaped by doubling it,
+        single quote needs no escaping inside double quoted literal'''
+        return '"{0}"'.format(value.replace('"', '""'))
+
+    def get_qualification(self, engineers):
+        assignees = ' OR '.join('\'{0}\'={1}'.format(self.assignee_field, 
+                                                      self.quote_value(engineer[8])) 
+                                for engineer in engineers)
+        condition = ('NOT ({0})' if self.fetch_closed else '{0}').format(self.open_condition)
+        qualification = '({0}) AND {1}'.format(assignees, condition)
+        if self.modified_since is not None:
+            #AR System accepts dates as unix timestamps
+            qualification += ' AND \'Last Modified Date\' > {0}'.format(int(self.modified_since))
+        return qualification
+
+    def query(self, qualification):
+        '''get all entries matching qualification, paging with startRecord.
+        Entries are returned as dicts, faults other than "no entries" are raised'''
+        client, header_value = self.connection
+        query_service = getattr(client.service, self.query_service)
+        result = []
+        with client.settings(strict=False):
+            while True:
+                try:
+                    page = query_service(Qualification = qualification, maxLimit = self.page_size, 
+                                         startRecord = len(result), _soapheaders=[header_value])
+                except zeep.exceptions.Fault as error:
+                    if self.NO_ENTRIES_FAULT not in (error.message or ''):
+                        raise
+                    break
+                page = zeep.helpers.serialize_object(page or [], dict)
+                result = result + list(page)
+                if len(page) < self.page_size:
+                    break
+        return result
+
+    def get_raw_entries(self, engineer):
+        '''get entries list from external system for particular engineer'''
+        return self.query(self.get_qualification([engineer]))
+
     def add_engineer_login_to_raw_entries(self, response, engineer):
         for entry in response:
             entry['eng_id'] = engineer[12]
         return response
+
+    def get_entries_batch(self, engineers):
+        '''get entries for chunk of engineers with OR'ed qualification
+        and split them back by assignee'''
+        eng_ids = {engineer[8].lower(): engineer[12] for engineer in engineers}
+        result = []
+        dropped = 0
+        for entry in self.query(self.get_qualification(engineers)):
+            if self.assignee_key not in entry:
+                raise ERMError('{0} returned entry without {1}, '
+                               'entries can not be split by assignee'.format(self.query_service, 
+                                                                            self.assignee_key))
+            eng_id = eng_ids.get((entry[self.assignee_key] or '').lower())
+            if eng_id is not None:
+                entry['eng_id'] = eng_id
+                result.append(entry)
+            else:
+                dropped += 1
+        if dropped:
+            print('{0}: {1} entries with empty or unknown {2} dropped'.format(self.source, dropped, 
+                                                                             self.assignee_key))
+        return result
     
     def preprocess_entries(self, res):
         prep_res = []
@@ -165,34 +474,19 @@ class Remedy(externalSystem):
             assignee = entry['eng_id']
             company = entry['Company']
             sla = entry['SLA']
-            prep_res.append((prj_id, assignee, company, sla))
+            prep_res.append((prj_id, assignee, company, sla, entry['Incident_Number']))
         return prep_res
 
 
 class Remedy_HPD(Remedy):
-    def get_raw_entries(self, engineer):
-        '''get incidents list from external system for particular engineer (eng variable)'''
-        client, header_value = self.connection
-        with client.settings(strict=False):
-            #get incidents with Status < 4, where 4 is id of "Resolved" status
-            try:
-                result = client.service.HelpDesk_QueryList_Service(Qualification ="'Assignee Login ID'=\"" + engineer[8] + "\" AND 'Status' < 4", 
-                    maxLimit=2, startRecord="", _soapheaders=[header_value])
-            except zeep.exceptions.Fault as error:
-                result = []
-                print(error) 
-        return result
+    '''incidents with Status < 4, where 4 is id of "Resolved" status'''
+    query_service = 'HelpDesk_QueryList_Service'
+    assignee_field = 'Assignee Login ID'
+    open_condition = "'Status' < 4"
 
 
 class Remedy_CHG(Remedy):
-    def get_raw_entries(self, engineer):
-        '''get changes list from external system for particular engineer (eng variable)'''
-        client, header_value = self.connection
-        with client.settings(strict=False):
-            try:
-                result = client.service.Change_QueryList_Service(Qualification ="'CAB Manager ( Change Co-ord )'=\"" + engineer[8] + "\" AND 'Change Request Status' < 9", 
-                                                            maxLimit=2, startRecord="", _soapheaders=[header_value])
-            except zeep.exceptions.Fault as error:
-                result = []
-                print(error) 
-        return result
+    '''changes with 'Change Request Status' < 9'''
+    query_service = 'Change_QueryList_Service'
+    assignee_field = 'CAB Manager ( Change Co-ord )'
+    open_condition = "'Change Request Status' < 9"
@@ -1,35 +1,270 @@
 import http.client
+import sqlite3
+import threading
+import time
 import urllib.parse
 
 import xml.etree.ElementTree as ET
 
-from .resource import resource
 
-class message():
-    '''class implements messaging subsystem'''
+class smsOutbox():
+    '''durable queue of SMS in local SQLite database, request handlers of frontend 
+    and backend only enqueue messages, they are sent by dispatcher (sms_dispatcher.py)
+    status of message: pending -> sent or failed (attempts exhausted or no phone)
+    messages with digest header are coalesced: all pending messages of recipient
+    with same header are sent as one digest when the first of them is due'''
 
-    @staticmethod
-    def send_sms(mes_text, eng_login, login, pwd, originator, phone = None):
-        '''send sms through smstraffic.ru
-        returns OK or ERROR string'''
-        
-        if eng_login != 0:
-            eng = resource(eng_login)
-            phone = eng.phone
-
-        params = urllib.parse.urlencode({'login': login, 'password': pwd, 
-                                         'phones': phone,'message': mes_text, 
-                                         'rus': '5', 'originator': originator})
+    MAX_ATTEMPTS = 8
+    RETRY_DELAY = 30
+    MAX_RETRY_DELAY = 60*60
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute('create table if not exists outbox ('
+                         'id integer primary key, created real, eng_login text, phone text, '
+                         'text text, status text default \'pending\', attempts integer default 0, '
+                         'next_attempt real, sent real, error text, digest text, digest_item text)')
+            #outbox created before digests were introduced
+            if 'digest' not in [column[1] for column in conn.execute('pragma table_info(outbox)')]:
+                conn.execute('alter table outbox add column digest text')
+                conn.execute('alter table outbox add column digest_item text')
+            conn.execute('create index if not exists outbox_due_idx '
+                         'on outbox (status, next_attempt)')
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout = 10)
+
+    def enqueue(self, text, eng_login = None, phone = None, digest = None, digest_item = None,
+                window = 0, now = None):
+        '''phone of engineer is resolved by dispatcher if only login is given,
+        message with digest header waits for others for window seconds'''
+        now = time.time() if now is None else now
+        next_attempt = now + window if digest else now
+        with self.connect() as conn:
+            cur = conn.execute('insert into outbox (created, eng_login, phone, text, next_attempt, '
+                               'digest, digest_item) values (?, ?, ?, ?, ?, ?, ?)', 
+                               (now, eng_login, phone, text, next_attempt, digest, digest_item))
+            return cur.lastrowid
+
+    def get_due(self, limit = 500, now = None):
+        '''due messages and pending messages to be coalesced with them
+        (id, eng_login, phone, text, digest, digest_item)'''
+        now = time.time() if now is None else now
+        with self.connect() as conn:
+            return conn.execute('select id, eng_login, phone, text, digest, digest_item '
+                                'from outbox o where status = \'pending\' and (next_attempt <= ? or '
+                                '(digest is not null and exists (select 1 from outbox d '
+                                ' where d.status = \'pending\' and d.next_attempt <= ? and '
+                                ' d.digest = o.digest and d.eng_login is o.eng_login and '
+                                ' d.phone is o.phone))) '
+                                'order by id limit ?', (now, now, limit)).fetchall()
+
+    def set_phones(self, phones):
+        '''save resolved phones {id: phone}'''
+        with self.connect() as conn:
+            conn.executemany('update outbox set phone = ? where id = ?', 
+                             [(phone, msg_id) for msg_id, phone in phones.items()])
+
+    def mark_sent(self, ids, gateway_answer, now = None):
+        now = time.time() if now is None else now
+        with self.connect() as conn:
+            conn.executemany('update outbox set status = \'sent\', sent = ?, error = ?, '
+                             'attempts = attempts + 1 where id = ?', 
+                             [(now, gateway_answer, msg_id) for msg_id in ids])
+
+    def mark_failed(self, ids, error, retry = True, now = None):
+        '''postpone next attempt with exponential backoff, message fails 
+        when attempts are exhausted or retry is useless'''
+        now = time.time() if now is None else now
+        with self.connect() as conn:
+            for msg_id in ids:
+                attempts = conn.execute('select attempts from outbox where id = ?', 
+                                        (msg_id, )).fetchone()[0] + 1
+                status = 'pending' if retry and attempts < self.MAX_ATTEMPTS else 'failed'
+                delay = min(self.RETRY_DELAY * 2 ** (attempts - 1), self.MAX_RETRY_DELAY)
+                conn.execute('update outbox set status = ?, attempts = ?, next_attempt = ?, '
+                             'error = ? where id = ?', 
+                             (status, attempts, now + delay, str(error), msg_id))
+
+    def get_status(self, msg_id):
+        with self.connect() as conn:
+            return conn.execute('select status, attempts, error from outbox where id = ?', 
+                                (msg_id, )).fetchone()
+
+
+class smsGateway():
+    '''client of smstraffic.ru HTTP API, one request sends same text to several phones
+    requests of one account are limited to rate_limit per second (0 - not limited)'''
+
+    _last_requests = {}
+    _rate_lock = threading.Lock()
+
+    def __init__(self, login, pwd, originator, host = 'api.smstraffic.ru', port = 80, 
+                 timeout = 10, rate_limit = 0):
+        self.login = login
+        self.pwd = pwd
+        self.originator = originator
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+
+    def __wait_for_rate_limit(self):
+        if not self.rate_limit:
+            return
+        account = (self.host, self.login)
+        with smsGateway._rate_lock:
+            now = time.monotonic()
+            request_time = max(now, smsGateway._last_requests.get(account, now) + 
+                                    1 / self.rate_limit)
+            smsGateway._last_requests[account] = request_time
+        time.sleep(request_time - now)
+
+    def send(self, phones, mes_text):
+        '''returns (OK or ERROR, description), raises OSError if gateway is unavailable'''
+        self.__wait_for_rate_limit()
+        params = urllib.parse.urlencode({'login': self.login, 'password': self.pwd, 
+                                         'phones': ','.join(phones), 'message': mes_text, 
+                                         'rus': '5', 'originator': self.originator})
         headers = {"Content-type": "application/x-www-form-urlencoded"}
-        conn = http.client.HTTPConnection('api.smstraffic.ru', 80)
-        conn.request('POST','/multi.php', params, headers)
-        answ = conn.getresponse()
-        
+        conn = http.client.HTTPConnection(self.host, self.port, timeout = self.timeout)
         try:
+            conn.request('POST','/multi.php', params, headers)
+            answ = conn.getresponse()
             root = ET.fromstring(answ.read())
+            return (root[0].text, ' '.join((root[1].text or '', root[2].text or '')))
+        except ET.ParseError as e:
+            return ('ERROR', e)
+        finally:
             conn.close()
-            return (root[0].text, ' '.join((root[1].text, root[2].text)))
+
+
+class smsDispatcher():
+    '''sends due messages of outbox, messages with same text are sent 
+    to all their recipients in one gateway request'''
+
+    PHONES_PER_REQUEST = 100
+    DIGEST_MAX_ITEMS = 10
+
+    def __init__(self, outbox, gateway, get_phones):
+        '''get_phones(eng_logins) returns {eng_login: phone}'''
+        self.outbox = outbox
+        self.gateway = gateway
+        self.get_phones = get_phones
+
+    @staticmethod
+    def get_engineers_phones(eng_logins, engineers):
+        '''phones of engineers from engineers list ('oid, *' rows of resources:
+        phone is column 2, login (suir_id) is column 12)'''
+        return {engineer[12]: engineer[2] for engineer in engineers 
+                if engineer[12] in eng_logins}
+
+    def __resolve_phones(self, due):
+        eng_logins = {msg[1] for msg in due if not msg[2] and msg[1]}
+        if not eng_logins:
+            return due
+        phones = self.get_phones(eng_logins)
+        resolved = {msg[0]: phones[msg[1]] for msg in due if not msg[2] and phones.get(msg[1])}
+        self.outbox.set_phones(resolved)
+        return [(msg[0], msg[1], resolved.get(msg[0], msg[2])) + tuple(msg[3:]) for msg in due]
+
+    def get_digest_text(self, digest, items):
+        text = ' '.join((digest, '; '.join(items[:self.DIGEST_MAX_ITEMS])))
+        if len(items) > self.DIGEST_MAX_ITEMS:
+            text = ' '.join((text, 'и еще {0}'.format(len(items) - self.DIGEST_MAX_ITEMS)))
+        return text
+
+    def coalesce(self, due):
+        '''returns [(ids, phone, text)], one digest per recipient and digest header'''
+        groups = {}
+        for msg_id, _, phone, text, digest, digest_item in due:
+            key = (phone, digest) if digest else msg_id
+            ids, items, _, _ = groups.setdefault(key, ([], [], phone, text))
+            ids.append(msg_id)
+            items.append(digest_item)
+        return [(ids, phone, text if len(ids) == 1 else self.get_digest_text(key[1], items))
+                for key, (ids, items, phone, text) in groups.items()]
+
+    def dispatch(self, now = None):
+        '''one pass over due messages, returns (sent, failed) message counts'''
+        due = self.outbox.get_due(now = now)
+        try:
+            due = self.__resolve_phones(due)
         except Exception as e:
-            conn.close()
-            print(e)
-            return ("ERROR", e)
+            print('Failed to get phones of engineers: {0!r}'.format(e))
+            self.outbox.mark_failed([msg[0] for msg in due if not msg[2]], e, now = now)
+            due = [msg for msg in due if msg[2]]
+
+        no_phone = [msg[0] for msg in due if not msg[2]]
+        self.outbox.mark_failed(no_phone, 'no phone', retry = False, now = now)
+
+        by_text = {}
+        for ids, phone, text in self.coalesce([msg for msg in due if msg[2]]):
+            by_text.setdefault(text, []).append((ids, phone))
+
+        sent = failed = 0
+        for text, recipients in by_text.items():
+            for i in range(0, len(recipients), self.PHONES_PER_REQUEST):
+                chunk = recipients[i:i + self.PHONES_PER_REQUEST]
+                ids = [msg_id for msg_ids, _ in chunk for msg_id in msg_ids]
+                try:
+                    status, answer = self.gateway.send([phone for _, phone in chunk], text)
+                except OSError as e:
+                    status, answer = 'ERROR', e
+                if status == 'OK':
+                    self.outbox.mark_sent(ids, answer, now = now)
+                    sent += len(ids)
+                else:
+                    self.outbox.mark_failed(ids, answer, now = now)
+                    failed += len(ids)
+        return sent, failed + len(no_phone)
+
+
+class message():
+    '''class implements messaging subsystem'''
+
+    #SMS outbox database and coalescing window of notifications, set from application config
+    outbox_path = 'sms_outbox.db'
+    coalesce_window = 60
+    #smsGateway for messages which must not be queued, set from application config
+    gateway = None
+    #opened outboxes: path -> smsOutbox
+    __outboxes = {}
+    __outboxes_lock = threading.Lock()
+
+    @staticmethod
+    def get_outbox():
+        '''outbox is opened (schema checked) once per process'''
+        with message.__outboxes_lock:
+            if message.outbox_path not in message.__outboxes:
+                message.__outboxes[message.outbox_path] = smsOutbox(message.outbox_path)
+            return message.__outboxes[message.outbox_path]
+
+    @staticmethod
+    def send_sms(mes_text, eng_login, phone = None, digest = None, digest_item = None):
+        '''put sms into outbox, it is sent by dispatcher with gateway credentials 
+        from its config, phone of engineer (eng_login != 0) is resolved there
+        notifications with digest header sent to one recipient within coalescing 
+        window are sent as one sms: digest header and their digest items
+        returns (OK or ERROR, description)'''
+        try:
+            msg_id = message.get_outbox().enqueue(
+                mes_text, eng_login = eng_login if eng_login != 0 else None, phone = phone,
+                digest = digest, digest_item = digest_item, window = message.coalesce_window)
+        except sqlite3.Error as e:
+            return ('ERROR', str(e))
+        return ('OK', 'queued {0}'.format(msg_id))
+
+    @staticmethod
+    def send_secret_sms(mes_text, phone):
+        '''send sms with credentials at once through gateway, it is never put 
+        into outbox, so secrets are not stored on disk
+        returns (OK or ERROR, description)'''
+        if message.gateway is None:
+            return ('ERROR', 'SMS gateway is not configured')
+        try:
+            return message.gateway.send([phone], mes_text)
+        except OSError as e:
+            return ('ERROR', str(e))
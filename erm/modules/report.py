@@ -16,19 +16,19 @@ def get_engineer_tasks_sorted_by_id(eng_login, start, end):
 
 def generate_report_from_tasks(tasks):
     report_from_tasks = []
-    tasks_sla_sorted = sorted(tasks, key=lambda item:(item[10], item[11]))
-    for sla, grp in groupby(tasks_sla_sorted, key=lambda item:(item[10], item[11])):
+    tasks_sla_sorted = sorted(tasks, key=lambda item:(item[4], item[5]))
+    for sla, grp in groupby(tasks_sla_sorted, key=lambda item:(item[4], item[5])):
         tasks_grp = list(grp)
-        hours = int(sum([task[15] for task in tasks_grp], timedelta()).total_seconds()/60/60)
-        report_from_tasks.append([tasks_grp[0][10], hours, sla[1]])
+        hours = int(sum([task[7] for task in tasks_grp], timedelta()).total_seconds()/60/60)
+        report_from_tasks.append([tasks_grp[0][4], hours, sla[1]])
     return report_from_tasks
 
 def calc_work_hours(tasks):
     for task in tasks:
-        task.append(str(timedelta(seconds=task[9] - task [8])))
-        task.append(timedelta(seconds=task[9] - task [8]))
-        task[8] = dateutils.unix2iso_ru(task[8])
-        task[9] = dateutils.unix2iso_ru(task[9])
+        task.append(str(timedelta(seconds=task[3] - task [2])))
+        task.append(timedelta(seconds=task[3] - task [2]))
+        task[2] = dateutils.unix2iso_ru(task[2])
+        task[3] = dateutils.unix2iso_ru(task[3])
     return tasks
 
 def mark_edited_entries_in_saved_report(saved_report, report_from_tasks):
@@ -76,64 +76,37 @@ def get_premade_workreport_entries(config, report):
     return premade
 
 #CONSOLIDATED WORK REPORT
-def get_report_with_full_names(raw_report):
-    report_with_full_names = []
-    for raw in raw_report:
-        engineer = backend.get_eng_info(raw[0])
-        if len(engineer) != 0:
-            eng_name, eng_login = engineer[0][1], engineer[0][12]
-        else:
-            eng_name, eng_login = '', ''
-        raw[0] = {'name': eng_name, 'login': eng_login}
-        report_with_full_names.append(raw)
-    return report_with_full_names
-
-def get_utils_dict(report_with_full_names):
-    utils_dict = {}
-    for row in report_with_full_names:
-        utils_dict[' '.join([row[0]['name'], row[0]['login'], row[1], row[2]])] = row[3]
-    return utils_dict
-
-def get_engineers_not_reported_workload(reported_engineers):
-    not_reported_engineers = []
-    eng_list = [(eng[1], eng[7], eng[11]) for eng in backend.get_engineers_list()]
-
-    engineers_names_from_consreport = [x[0] for x in reported_engineers]
-    for eng in eng_list:
-        if eng[0] not in engineers_names_from_consreport and eng[2] == 'yes':
-            not_reported_engineers.append(eng[1])
-    return not_reported_engineers
-
-def generate_excel_report_file(month, year, companies_sla, engineers, utils_dict, app_path):
+#consolidated reports prepared by this worker {(month, year): (built, report)},
+#excel file of report is generated again only when backend materialized 
+#report was rebuilt
+cons_reports = {}
+
+def get_consolidated_report(month, year, app_path):
+    '''engineers, rows of company, contract and util hours of engineers, 
+    not reported engineers (joined and pivoted by backend) and excel file 
+    of consolidated report'''
+    cons_report = backend.get_all_workreports(month, year)
+    if not cons_report:
+        return {'engineers': [], 'rows': [], 'not_reported': [], 'excel_file_path': None}
+    cached = cons_reports.get((month, year))
+    if cached is None or cached[0] != cons_report['built']:
+        report = dict(cons_report)
+        report['excel_file_path'] = generate_excel_report_file(month, year, report['engineers'], 
+                                                               report['rows'], app_path)
+        cached = (cons_report['built'], report)
+        cons_reports[(month, year)] = cached
+    return cached[1]
+
+def generate_excel_report_file(month, year, engineers, rows, app_path):
     wb = Workbook()
     ws = wb.active
     ws.title = '_'.join(['отчет', str(month), str(year)])
     if len(engineers) > 0:
-        for row_num, row in enumerate(ws.iter_rows(min_row = 1, 
-                                                   max_row = len(companies_sla) + 1, 
-                                                   max_col = len(engineers) + 1)):
-            if row_num == 0:
-                for column_num, cell in enumerate(row):
-                    if column_num == 0:
-                        cell.value = 'Заказчик/договор'
-                    else:
-                        cell.value = engineers[column_num - 1][0]
-            else:
-                for (column_num, cell), engineer in zip(enumerate(row), [(0,)] + engineers):
-                    if column_num == 0:
-                        cell.value = ' '.join(companies_sla[row_num - 1])
-                    else:
-                        try:
-                            cell.value = utils_dict[engineer[0] + ' ' + engineer[1] + ' ' + companies_sla[row_num - 1][0] + ' ' + companies_sla[row_num -1][1]]
-                        except Exception:
-                            pass
+        ws.append(['Заказчик/договор'] + [engineer[0] for engineer in engineers])
+        for company, sla, utils in rows:
+            ws.append([' '.join((company, sla))] + utils)
 
     report_file_name = 'otchet_po_trudozatratam' + str(month) + '_' + str(year) + '.xlsx'
     wb.save(app_path + '/static/' + report_file_name)
     excel_file_path = url_for('static', filename = report_file_name)   
     return excel_file_path
-
-def get_companies_sla(report_with_full_names):
-    companies_sla = set([(row[1], row[2]) for row in report_with_full_names])
-    companies_sla = sorted(list(companies_sla), key = lambda sla:sla[0], reverse = True)
-    return companies_sla
@@ -2,21 +2,29 @@ import unittest
 import time
 
 from .backend import backend
+from .timeline import timeline
 
 class resource():
     '''class represents resource(engineer) and their available func and fields'''
 
-    def __init__(self, eng_login):
+    def __init__(self, eng_login, cur_week_booking = None, eng_info = None, workload = None):
+        '''current week booking and profile are requested from backend 
+        if not given (see get_resources_from_ranked for bulk construction)'''
         self.eng_login = eng_login
-        self.cur_week_booking = backend.get_eng_booking_week(eng_login)  
-        self.workload = self.__calc_workload(self.cur_week_booking)
-        self.__set_info()
+        if cur_week_booking is None:
+            cur_week_booking = backend.get_eng_booking_week(eng_login)
+        self.cur_week_booking = cur_week_booking
+        if workload is None:
+            workload = self.__calc_workload(self.cur_week_booking)
+        self.workload = workload
+        if eng_info is None:
+            eng_info = backend.get_eng_info(eng_login)
+        self.__set_info(eng_info)
 
     def __lt__(self, other):
         return self.workload < other.workload
 
-    def __set_info(self):
-        eng_info = backend.get_eng_info(self.eng_login)
+    def __set_info(self, eng_info):
         if len(eng_info) != 0:
             self.full_name = eng_info[0][1]
             self.phone = eng_info[0][2]
@@ -33,20 +41,11 @@ class resource():
         else:
             self.full_name = ''
 
-    def __trunc_dateframes(self, cur_week_booking):
-        '''NEED TO MOVE TO dateutils.py'''
-        '''truncates start and end time in dateframes that partially belongs to current week dateframe'''
-        res_timeline = []
+    @staticmethod
+    def get_workload_window():
+        '''current week window (start, end) used for workload calculation'''
         cur_time = int(time.time())
-
-        for dateframe in cur_week_booking:
-            if dateframe[8] < cur_time: 
-                res_timeline.append((cur_time, dateframe[8]))
-            elif dateframe[9] > (cur_time + 7*24*60*60): 
-                res_timeline.append((dateframe[8], cur_time + 7*24*60*60))
-            else: 
-                res_timeline.append((dateframe[8], dateframe[9]))
-        return res_timeline
+        return cur_time, cur_time + 7*24*60*60
 
     def __calc_workload(self, cur_week_booking):
         '''calculates workload for specific engineer.
@@ -54,34 +53,15 @@ class resource():
         workload.
         Workload % = (busy timeline dateframes/overall timeline dateframe)*100%
         Busy dateframes is calculated with accounting tasks overlays'''
-        res_timeline = []
-        preproc_timeline = self.__trunc_dateframes(cur_week_booking)
-        
-        timeline = [set(range(int(x[0]/60), int(x[1]/60))) for x in preproc_timeline] 
-
-        for dateframe in timeline:
-            for n_dateframe in timeline:
-                if dateframe < n_dateframe:
-                    break
-            else:
-                res_timeline.append(dateframe)
-
-        busy_timeline = 0
-        for dateset in res_timeline:
-            busy_timeline += len(dateset)
-        
-        if busy_timeline > (7*24*60): busy_timeline = 7*24*60
-
-        workload = int((busy_timeline / (7*24*60)) * 100)
-        return workload
+        window_start, window_end = resource.get_workload_window()
+        return timeline.workload([(x[2], x[3]) for x in cur_week_booking],
+                                 window_start, window_end)
 
     @staticmethod
-    def get_resources_sorted_by_workload(logins):
-        resources = []
-        for login in logins:
-            resources.append(resource(login[0]))
-        resources_sorted_by_workload = sorted(resources)
-        return resources_sorted_by_workload
+    def get_resources_from_ranked(ranked_engineers):
+        '''build resources from profile rows ranked by backend (workload appended to row),
+        current week booking is not loaded'''
+        return [resource(row[12], [], [row[:14]], row[14]) for row in ranked_engineers]
 
     @staticmethod
     def get_engineer_info_from_request(request):
@@ -1,5 +1,97 @@
+import bisect
+import re
+import threading
+import time
+
+
 def form_search_string(request):
     search_string = request.form['search_string']
     if len(search_string) == 0:
         search_string = '%%'
     return search_string
+
+def search_pages(page, page_size, total):
+    '''previous and next page numbers of paged search result, None if there is no such page'''
+    prev_page = page - 1 if page > 0 else None
+    next_page = page + 1 if (page + 1) * page_size < total else None
+    return prev_page, next_page
+
+
+class searchIndex():
+    '''in-memory inverted index over engineers profiles:
+    token -> set of suir_ids (posting list).
+    Tokens are kept sorted for prefix lookups, index is updated incrementally'''
+
+    TOKEN_RE = re.compile(r'\w+')
+
+    def __init__(self):
+        self.__postings = {}
+        self.__tokens = []
+        self.__docs = {}
+        self.__lock = threading.RLock()
+        self.built = None
+
+    @staticmethod
+    def tokenize(text):
+        return searchIndex.TOKEN_RE.findall((text or '').lower())
+
+    @staticmethod
+    def get_profile_text(full_name, tags, skills, org_unit_id, langs):
+        '''searchable text of engineer profile'''
+        return ' '.join(field or '' for field in (full_name, tags, skills, org_unit_id, langs))
+
+    def build(self, engineers):
+        '''build index from scratch, engineers is iterable of (suir_id, text)'''
+        postings = {}
+        docs = {}
+        for suir_id, text in engineers:
+            docs[suir_id] = set(self.tokenize(text))
+            for token in docs[suir_id]:
+                postings.setdefault(token, set()).add(suir_id)
+        with self.__lock:
+            self.__postings = postings
+            self.__docs = docs
+            self.__tokens = sorted(postings)
+            self.built = time.time()
+
+    def add(self, suir_id, text):
+        '''add engineer to index or replace indexed profile,
+        not built index is left empty - changes will be picked up by build'''
+        with self.__lock:
+            if self.built is None:
+                return
+            self.remove(suir_id)
+            self.__docs[suir_id] = set(self.tokenize(text))
+            for token in self.__docs[suir_id]:
+                if token not in self.__postings:
+                    self.__postings[token] = set()
+                    bisect.insort(self.__tokens, token)
+                self.__postings[token].add(suir_id)
+
+    def remove(self, suir_id):
+        with self.__lock:
+            for token in self.__docs.pop(suir_id, set()):
+                self.__postings[token].discard(suir_id)
+                if not self.__postings[token]:
+                    del self.__postings[token]
+                    del self.__tokens[bisect.bisect_left(self.__tokens, token)]
+
+    def __get_prefix_postings(self, prefix):
+        suir_ids = set()
+        position = bisect.bisect_left(self.__tokens, prefix)
+        while position < len(self.__tokens) and self.__tokens[position].startswith(prefix):
+            suir_ids |= self.__postings[self.__tokens[position]]
+            position += 1
+        return suir_ids
+
+    def search(self, search_string, match_all = True):
+        '''suir_ids of engineers having tokens started with all (or any) search words,
+        empty search string matches all engineers'''
+        words = self.tokenize(search_string)
+        with self.__lock:
+            if len(words) == 0:
+                return sorted(self.__docs)
+            postings = sorted((self.__get_prefix_postings(word) for word in set(words)), key = len)
+        if match_all:
+            return sorted(set.intersection(*postings))
+        return sorted(set.union(*postings))
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+
+class syncState():
+    '''state of incremental sync for one external system (config section),
+    kept in JSON file shared by all sections:
+    watermark - unix time of last successful fetch, tickets modified since
+                then are fetched on next run
+    last_full - unix time of last full (reconciliation) sync
+    open      - open tickets seen so far {ext_key: [prj_id, assignee, company, sla]}'''
+
+    #tickets modified while previous run was fetching must not be lost
+    WATERMARK_OVERLAP = 5*60
+
+    def __init__(self, path, section):
+        self.path = path
+        self.section = section
+        self.watermark = None
+        self.last_full = None
+        self.open = {}
+        self.load()
+
+    def __read_file(self):
+        try:
+            with open(self.path, encoding = 'utf-8') as state_file:
+                return json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def load(self):
+        state = self.__read_file().get(self.section, {})
+        self.watermark = state.get('watermark')
+        self.last_full = state.get('last_full')
+        self.open = state.get('open', {})
+
+    def save(self):
+        '''sections of other systems are kept, file is replaced atomically'''
+        states = self.__read_file()
+        states[self.section] = {'watermark': self.watermark,
+                                'last_full': self.last_full,
+                                'open': self.open}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding = 'utf-8') as state_file:
+            json.dump(states, state_file, ensure_ascii = False)
+        os.replace(tmp_path, self.path)
+
+    def is_full_sync_due(self, full_sync_interval, now = None):
+        now = time.time() if now is None else now
+        return (self.watermark is None or self.last_full is None
+                or now - self.last_full >= full_sync_interval)
+
+    def get_modified_since(self):
+        return self.watermark - self.WATERMARK_OVERLAP
+
+    def get_booked_entries(self, entries, closed_keys = ()):
+        '''entries to book on incremental run: fetched ones and open tickets which were 
+        not fetched (not modified since last run), except tickets closed since then'''
+        fetched = {entry[4] for entry in entries}
+        return list(entries) + [tuple(entry) + (ext_key, ) for ext_key, entry in self.open.items()
+                                if ext_key not in fetched and ext_key not in closed_keys]
+
+    def commit(self, entries, started, full_sync, closed_keys = ()):
+        '''register fetched entries (prj_id, assignee, company, sla, ext_key) after 
+        successful run, returns tickets which were open but are missing in full sync 
+        result or are in closed_keys fetched by incremental sync (closed)'''
+        fetched = {entry[4]: list(entry[:4]) for entry in entries}
+        if full_sync:
+            closed = [tuple(entry) + (ext_key, ) for ext_key, entry in self.open.items()
+                      if ext_key not in fetched]
+            self.open = fetched
+            self.last_full = started
+        else:
+            self.open.update(fetched)
+            closed = [tuple(self.open.pop(ext_key)) + (ext_key, ) for ext_key in closed_keys
+                      if ext_key in self.open and ext_key not in fetched]
+        self.watermark = started
+        return closed
@@ -0,0 +1,98 @@
+import mmap
+import os
+import pickle
+import re
+import threading
+
+
+class compactWords():
+    '''read-only set of words stored in compact file: sorted, newline separated
+    UTF-8 words. File is memory-mapped and looked up with binary search,
+    so it is shared between worker processes through page cache'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as words_file:
+            if os.fstat(words_file.fileno()).st_size == 0:
+                self.__words = b''
+            else:
+                self.__words = mmap.mmap(words_file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def __contains__(self, word):
+        key = word.encode('utf-8')
+        low, high = 0, len(self.__words)
+        while low < high:
+            middle = (low + high) // 2
+            start = self.__words.rfind(b'\n', 0, middle) + 1
+            end = self.__words.find(b'\n', start)
+            if end == -1:
+                end = len(self.__words)
+            line = self.__words[start:end]
+            if line == key:
+                return True
+            if line < key:
+                low = end + 1
+            else:
+                high = start
+        return False
+
+    @staticmethod
+    def save(words, path):
+        data = b'\n'.join(sorted(word.encode('utf-8') for word in words))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as words_file:
+            words_file.write(data)
+        os.replace(tmp_path, path)
+
+
+class tagsDictionary():
+    '''tags dictionary (word -> frequency) loaded once per process and reloaded
+    when file modification time changes.
+    Pickled dict (*.pickle) or compact words file (see compactWords) are supported,
+    only words with frequency above MIN_FREQUENCY are used as tags'''
+
+    MIN_FREQUENCY = 3
+    MAX_TAGS = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.__words = None
+        self.__mtime = None
+        self.__lock = threading.Lock()
+
+    def get_words(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.__mtime:
+            with self.__lock:
+                if mtime != self.__mtime:
+                    if self.path.endswith('.pickle'):
+                        with open(self.path, 'rb') as tags_dict_file:
+                            words = pickle.load(tags_dict_file)
+                        self.__words = set(word for word, frequency in words.items()
+                                           if frequency > self.MIN_FREQUENCY)
+                    else:
+                        self.__words = compactWords(self.path)
+                    self.__mtime = mtime
+        return self.__words
+
+    def tag_text(self, text):
+        '''generate up to MAX_TAGS tags for given text'''
+        words = self.get_words()
+        tags = []
+        prep_text_rw = re.sub('[^A-Za-z]+', ' ', text.lower())
+
+        for word in prep_text_rw.split():
+            if word in words:
+                tags.append(word)
+                if len(tags) == self.MAX_TAGS: break
+
+        res_tags = set(sorted(tags, key=lambda x:x[0]))
+        return list(res_tags)
+
+    @staticmethod
+    def convert_to_compact(pickle_path, compact_path):
+        '''save words with frequency above MIN_FREQUENCY from pickled
+        dictionary to compact words file'''
+        with open(pickle_path, 'rb') as tags_dict_file:
+            words = pickle.load(tags_dict_file)
+        compactWords.save([word for word, frequency in words.items()
+                           if frequency > tagsDictionary.MIN_FREQUENCY], compact_path)
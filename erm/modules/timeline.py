@@ -0,0 +1,41 @@
+class timeline():
+    '''interval arithmetic over (start, end) pairs of unix timestamps,
+    intervals are half-open: [start, end)'''
+
+    @staticmethod
+    def clip(intervals, start, end):
+        '''truncates intervals to [start, end) window, drops intervals outside of it'''
+        clipped = []
+        for int_start, int_end in intervals:
+            int_start, int_end = max(int_start, start), min(int_end, end)
+            if int_end > int_start:
+                clipped.append((int_start, int_end))
+        return clipped
+
+    @staticmethod
+    def union(intervals):
+        '''merges overlapping and adjacent intervals with sweep line over sorted starts,
+        returns sorted list of disjoint intervals, O(n log n)'''
+        merged = []
+        for int_start, int_end in sorted(intervals):
+            if int_end <= int_start:
+                continue
+            if merged and int_start <= merged[-1][1]:
+                if int_end > merged[-1][1]:
+                    merged[-1][1] = int_end
+            else:
+                merged.append([int_start, int_end])
+        return [tuple(interval) for interval in merged]
+
+    @staticmethod
+    def busy_time(intervals):
+        '''overall length of intervals union'''
+        return sum(int_end - int_start for int_start, int_end in timeline.union(intervals))
+
+    @staticmethod
+    def workload(intervals, start, end):
+        '''percent of [start, end) window covered by intervals, as int'''
+        if end <= start:
+            return 0
+        busy = timeline.busy_time(timeline.clip(intervals, start, end))
+        return int((busy / (end - start)) * 100)
@@ -1,27 +1,62 @@
 import hashlib
 import http 
 import json
+import threading
+import time
 
 from .toolset import Toolset
 from .backend import backend
 
 
 class User():
-    def __init__(self, login, pswd):
+    '''user identified by opaque session token (user id) stored on backend.
+    Credentials are checked once on login, sessions are resolved from 
+    local cache, backend is asked only on cache miss'''
+    #caches are per worker process, so entries live for a short time only:
+    #sessions closed or user records changed through another worker are picked up 
+    #after session_cache_ttl / profile_cache_ttl seconds
+    profile_cache_ttl = 60
+    session_cache_ttl = 60
+    #user records cache shared by requests: login -> (expiration time, user record)
+    __profiles = {}
+    __profiles_lock = threading.Lock()
+    #sessions cache: token -> (cache entry expiration time, login)
+    __sessions = {}
+    __sessions_lock = threading.Lock()
+
+    def __init__(self, login, pswd = None, token = None):
         self.login = login
         self.pswd = pswd
+        self.id = token
+        self.__profile = None
+        self.__toolset_actions = None
+
+    def authenticate(self):
+        '''check credentials and open session on backend'''
+        session = backend.create_session(self.login, self.pswd)
+        self.pswd = None
+        if not session:
+            return False
+        User.__cache_session(session['token'], session['expires'], session['login'])
+        self.id = session['token']
+        return True
+
+    def close_session(self):
+        with User.__sessions_lock:
+            User.__sessions.pop(self.id, None)
+        backend.delete_session(self.id)
+        self.id = None
 
     @property
     def is_authenticated(self):
-        '''compare pswd hash from db with pswd hash from request'''
-        is_auth = backend.check_credentials(self.login, self.pswd)
-        if is_auth == True:
-            self.toolset_actions = Toolset(self.user_group, 
-                                           self.fullname, self.login).actions
-            self.id = ' '.join((self.login, self.pswd))
-            return True
-        else:
-            return False
+        return self.id is not None
+
+    @property
+    def toolset_actions(self):
+        if self.__toolset_actions is None:
+            self.__toolset_actions = Toolset(self.user_group, 
+                                             self.fullname, self.login).actions
+        return self.__toolset_actions
 
     @property
     def is_active(self):
@@ -31,23 +66,59 @@ class User():
     def is_anonymous(self):
         return False
 
+    @property
+    def profile(self):
+        '''user record from backend, memoized for the life of User object (request)
+        and cached across requests for profile_cache_ttl seconds'''
+        if self.__profile is None:
+            with User.__profiles_lock:
+                expires, profile = User.__profiles.get(self.login, (0, None))
+            if expires < time.time():
+                profile = backend.get_user(self.login)
+                if profile:
+                    with User.__profiles_lock:
+                        User.__profiles[self.login] = (time.time() + User.profile_cache_ttl, 
+                                                       profile)
+            self.__profile = profile
+        return self.__profile
+
+    @staticmethod
+    def invalidate_profile(login):
+        '''drop cached user record, must be called when user record changes.
+        Only cache of this worker is dropped, others refresh it after profile_cache_ttl'''
+        with User.__profiles_lock:
+            User.__profiles.pop(login, None)
+
     @property
     def fullname(self):
-        user_info = backend.get_user(self.login)
-        fullname = user_info['name']
+        fullname = self.profile['name']
         return fullname
 
     @property
     def user_group(self):
-        user_group = backend.get_user_group(self.login)
+        user_group = self.profile['user_group']
         return user_group 
 
     def get_id(self):
-        if self.is_authenticated:
-            return self.id
-        else:
-            return None
+        return self.id
     
     @staticmethod
     def get(user_id):
-        return User(user_id.split()[0], user_id.split()[1])
+        '''resolve session token to user, returns None for unknown or expired session'''
+        with User.__sessions_lock:
+            expires, login = User.__sessions.get(user_id, (0, None))
+        if expires < time.time():
+            session = backend.get_session(user_id)
+            if not session:
+                with User.__sessions_lock:
+                    User.__sessions.pop(user_id, None)
+                return None
+            login = session['login']
+            User.__cache_session(user_id, session['expires'], login)
+        return User(login, token = user_id)
+
+    @staticmethod
+    def __cache_session(token, expires, login):
+        '''cache session for session_cache_ttl seconds, but not beyond its expiration'''
+        with User.__sessions_lock:
+            User.__sessions[token] = (min(expires, time.time() + User.session_cache_ttl), login)
@@ -6,14 +6,18 @@ import hashlib
 import secrets
 import time
 from datetime import date, datetime, timedelta
-import pickle
 import re
 
 import psycopg2
+import psycopg2.extras
 from flask import Flask, g, request, flash, abort
+from werkzeug.exceptions import ServiceUnavailable
 
 from .modules.dateutils import dateutils as dateutils
-from .modules.message import message as msg
+from .modules.dbpool import dbPool
+from .modules.search import searchIndex
+from .modules.tagger import tagsDictionary
+from .modules.message import message as msg, smsGateway
 
 '''ERM application REST interface'''
 
@@ -40,27 +44,68 @@ def read_app_config(conf_file_name):
         exit() #need testing
     app.config['sms_login'] = config['General']['SMS_login']
     app.config['sms_pwd'] = config['General']['SMS_pwd']
+    app.config['sms_originator'] = config['General'].get('SMS_originator', '')
+    app.config['sms_outbox'] = config['General'].get('SMS_outbox', 'sms_outbox.db')
+    app.config['sms_gateway'] = config['General'].get('SMS_gateway', 'api.smstraffic.ru')
+    app.config['sms_gateway_port'] = int(config['General'].get('SMS_gateway_port', 80))
+    app.config['sms_timeout'] = float(config['General'].get('SMS_timeout', 10))
     app.config['db_name'] = config['General']['DB_name']
     app.config['db_user'] = config['General']['DB_user']
     app.config['db_pass'] = config['General']['DB_pass']
     app.config['db_host'] = config['General']['DB_host']
+    app.config['db_pool_min'] = int(config['General'].get('DB_pool_min', 1))
+    app.config['db_pool_max'] = int(config['General'].get('DB_pool_max', 10))
+    app.config['db_pool_timeout'] = float(config['General'].get('DB_pool_timeout', 10))
+    app.config['search_index'] = config['General'].get('Search_index', 'no') == 'yes'
+    app.config['search_index_ttl'] = int(config['General'].get('Search_index_ttl', 300))
+    app.config['tags_dict'] = config['General'].get('Tags_dict', 'tags_dict.pickle')
+    app.config['session_ttl'] = int(config['General'].get('Session_ttl', 28800))
 
 
 read_app_config(environ['SUIR_CFG'])
+msg.outbox_path = app.config['sms_outbox']
+#account credentials are sent at once, they must not be stored in outbox
+msg.gateway = smsGateway(app.config['sms_login'], app.config['sms_pwd'], 
+                         app.config['sms_originator'], host = app.config['sms_gateway'],
+                         port = app.config['sms_gateway_port'], 
+                         timeout = app.config['sms_timeout'])
+
+db_pool = dbPool(app.config['db_pool_min'], app.config['db_pool_max'], 
+                 timeout = app.config['db_pool_timeout'],
+                 dbname = app.config['db_name'],
+                 user = app.config['db_user'], password = app.config['db_pass'],
+                 host = app.config['db_host'])
 
 def get_db():
     if 'db' not in g:
-        g.db = psycopg2.connect(dbname = app.config['db_name'], 
-                                user = app.config['db_user'], password = app.config['db_pass'], 
-                                host = app.config['db_host'])
+        g.db = db_pool.getconn()
     return g.db
 
 @app.teardown_appcontext
 def close_connection(exception):
     db = g.pop('db', None)
     if db is not None:
-        db.commit()
-        db.close()
+        db_pool.putconn(db, failed = exception is not None)
+
+@app.errorhandler(psycopg2.OperationalError)
+@app.errorhandler(psycopg2.InterfaceError)
+def db_connection_error(error):
+    '''no free connection in pool within DB_pool_timeout or DB is not reachable'''
+    app.logger.error('DB operational error, check DB engine status, or connection to DB')
+    return ServiceUnavailable()
+
+search_index = searchIndex()
+tags_dictionary = tagsDictionary(app.config['tags_dict'])
+
+def get_search_index():
+    '''in-memory engineers search index, built on first use in every worker and 
+    rebuilt after Search_index_ttl seconds to pick up changes made through other workers'''
+    if search_index.built is None or time.time() - search_index.built > app.config['search_index_ttl']:
+        cur = get_db().cursor()
+        cur.execute('select full_name, tags, skills, org_unit_id, langs, suir_id from resources')
+        search_index.build((row[5], searchIndex.get_profile_text(*row[:5])) 
+                           for row in cur.fetchall())
+    return search_index
 
 def add_db_connection_error_msg(func):
     def func_with_msg(*args, **kwargs):
@@ -71,16 +116,67 @@ def add_db_connection_error_msg(func):
             return abort(503) 
     return func_with_msg
 
+def invalidate_consworkrep(cur, month = None, year = None):
+    '''drop materialized consolidated report of period, the row lock is held until 
+    workrep rows are committed, so report being built concurrently waits for them;
+    reports of all periods are dropped when engineers are changed'''
+    if month is None:
+        cur.execute('update consworkrep_cache set built = null, report = null '
+                    'where built is not null')
+        return
+    cur.execute('insert into consworkrep_cache (month, year) values (%s, %s) '
+                'on conflict (month, year) do update set built = null, report = null', 
+                (month, year))
+
+def get_consolidated_report(cur, month, year):
+    '''workrep of period joined to engineers names and pivoted into company/contract 
+    x engineer matrix of util hours (None if not reported), engineers who have not 
+    reported; engineer missing in resources is shown by login'''
+    cur.execute('select coalesce(r.full_name, w.resource_login), w.resource_login, '
+                'w.company, w.project_ids, w.util_hours '
+                'from workrep w left join resources r on r.suir_id = w.resource_login '
+                'where w.month = %s and w.year = %s', (month, year))
+    rows = cur.fetchall()
+    engineers = sorted({(row[0], row[1]) for row in rows})
+    companies_sla = sorted({(row[2], row[3]) for row in rows}, reverse = True)
+    columns = {engineer: column for column, engineer in enumerate(engineers)}
+    utils = {company_sla: [None] * len(engineers) for company_sla in companies_sla}
+    for name, login, company, sla, util_hours in rows:
+        column = columns[(name, login)]
+        utils[(company, sla)][column] = (utils[(company, sla)][column] or 0) + util_hours
+
+    cur.execute('select r.e_mail from resources r where r.utilized = \'yes\' and not exists '
+                '(select 1 from workrep w where w.resource_login = r.suir_id and '
+                ' w.month = %s and w.year = %s) order by r.full_name', (month, year))
+    return {'engineers': engineers, 
+            'rows': [[company, sla, utils[(company, sla)]] for company, sla in companies_sla],
+            'not_reported': [row[0] for row in cur.fetchall()]}
+
 @app.route('/rest/consworkrep/<int:month>/<int:year>', methods = ['GET'])
 def consworkrep(month, year):
+    '''consolidated report of period and time it was built, report is materialized 
+    in consworkrep_cache (migrations/007) until workrep of period or engineers 
+    are written'''
     cur = get_db().cursor()
-    cur.execute('select resource_login, company, project_ids, util_hours from workrep where month = %s and year = %s', (month, year))
-    all_reports = cur.fetchall()
-
-    if len(all_reports) == 0:
+    cur.execute('select built, report from consworkrep_cache where month = %s and year = %s', 
+                (month, year))
+    cached = cur.fetchone()
+    if cached is None or cached[0] is None:
+        cur.execute('insert into consworkrep_cache (month, year) values (%s, %s) '
+                    'on conflict (month, year) do nothing', (month, year))
+        cur.execute('select built, report from consworkrep_cache where month = %s and year = %s '
+                    'for update', (month, year))
+        cached = cur.fetchone()
+        if cached[0] is None:
+            cached = (time.time(), get_consolidated_report(cur, month, year))
+            cur.execute('update consworkrep_cache set built = %s, report = %s '
+                        'where month = %s and year = %s', 
+                        (cached[0], json.dumps(cached[1]), month, year))
+
+    if len(cached[1]['rows']) == 0:
         abort(404)
 
-    return json.dumps(all_reports)
+    return json.dumps(dict(cached[1], built = cached[0]))
 
 @app.route('/rest/workrep/<string:login>/<int:month>/<int:year>', methods = ['GET', 'POST'])
 def workrep(login, month, year):
@@ -95,6 +191,7 @@ def workrep(login, month, year):
     elif request.method == 'POST':
         report = request.form.to_dict()
         cur = get_db().cursor()
+        invalidate_consworkrep(cur, month, year)
         while report:
             util_hours = report.popitem()
             sla = report.popitem()
@@ -104,8 +201,18 @@ def workrep(login, month, year):
         return json.dumps('OK')
 
 
-@app.route('/rest/eng_booking_interval/<string:eng_login>/<string:start>/<string:end>', methods=['GET'])
-def eng_booking_interval(start = None, end = None, eng_login = None):
+#booking entry overlaps requested interval (bounds included), 
+#index probe on booking_login_end_idx (migrations/005)
+BOOKING_OVERLAP_CONDITION = (
+    'end_date >= %(req_start_date)s and start_date <= %(req_end_date)s')
+
+#columns of booking rows returned for interval (after id), used by timeline,
+#work report and activities pages
+BOOKING_INTERVAL_COLUMNS = 'project_id, start_date, end_date, company, sla'
+
+def get_request_interval(start, end):
+    '''convert ISO start and end of requested interval to unix timestamps,
+    '0' means open interval side, both '0' mean current week'''
     ONE_WEEK_SECONDS = 604800
 
     if start != '0':
@@ -121,17 +228,53 @@ def eng_booking_interval(start = None, end = None, eng_login = None):
     if start == '0' and end == '0':
         req_start_date = int(time.time())
         req_end_date = req_start_date + ONE_WEEK_SECONDS 
+    return req_start_date, req_end_date
+
+def get_series_occurrences(series_condition):
+    '''select of recurring booking occurrences overlapping requested interval 
+    with columns id, project_id, start_date, end_date, company, sla, resource_login.
+    id is minus series id as bigint, so booking oid must be cast to bigint 
+    in union (oid type would wrap it to 2^32 - id).
+    Only occurrences k inside interval are generated: for daily and weekly series
+    k is found by dividing on period, for monthly - by months difference'''
+    months = ('((extract(year from {1}) * 12 + extract(month from {1})) - '
+              '(extract(year from {0}) * 12 + extract(month from {0})))::int')
+    return ('select -s.id::bigint as id, s.project_id, o.start_date, '
+            '    o.start_date + s.duration as end_date, s.company, s.sla, s.resource_login '
+            'from booking_series s '
+            'cross join lateral (select '
+            "    to_timestamp(s.start_date) at time zone 'UTC' as first_start, "
+            "    case s.repeat when 'daily' then 86400 when 'weekly' then 604800 end as period, "
+            '    to_timestamp(greatest(s.start_date, %(req_start_date)s - s.duration)) '
+            "        at time zone 'UTC' as from_date, "
+            '    to_timestamp(least(s.end_date - s.duration, %(req_end_date)s)) '
+            "        at time zone 'UTC' as to_date) p "
+            'cross join lateral generate_series('
+            '    case when p.period is null then greatest(0, ' + 
+                     months.format('p.first_start', 'p.from_date') + ' - 1) '
+            '    else floor((extract(epoch from p.from_date) - s.start_date) / p.period)::int end, '
+            '    case when p.period is null then ' + months.format('p.first_start', 'p.to_date') + 
+            '    else floor((extract(epoch from p.to_date) - s.start_date) / p.period)::int end) k '
+            'cross join lateral (select extract(epoch from p.first_start + '
+            "    case when p.period is null then k * interval '1 month' "
+            "    else k * p.period * interval '1 second' end)::bigint as start_date) o "
+            'where s.active = 1 and s.start_date < %(req_end_date)s and '
+            '    s.end_date > %(req_start_date)s and ' + series_condition + ' and '
+            '    o.start_date + s.duration <= s.end_date and '
+            '    o.start_date < %(req_end_date)s and o.start_date + s.duration > %(req_start_date)s')
+
+@app.route('/rest/eng_booking_interval/<string:eng_login>/<string:start>/<string:end>', methods=['GET'])
+def eng_booking_interval(start = None, end = None, eng_login = None):
+    '''booking of engineer overlapping requested interval, including recurring booking
+    occurrences. Rows are id, project_id, start_date, end_date, company, sla'''
+    req_start_date, req_end_date = get_request_interval(start, end)
     
     cur = get_db().cursor() 
     
-    cur.execute('select oid, * from booking where ' 
-                'resource_login=%(eng_login)s and '
-                '((start_date >=%(req_start_date)s and end_date <= %(req_end_date)s) or '
-                '(start_date < %(req_start_date)s and '
-                'end_date >= %(req_start_date)s and end_date < %(req_end_date)s) or '
-                '(end_date > %(req_end_date)s and '
-                'start_date > %(req_start_date)s and start_date <= %(req_end_date)s) or '
-                '(start_date < %(req_start_date)s and end_date > %(req_end_date)s))', 
+    cur.execute('select oid::bigint, ' + BOOKING_INTERVAL_COLUMNS + ' from booking where ' 
+                'resource_login=%(eng_login)s and ' + BOOKING_OVERLAP_CONDITION + 
+                ' union all select id, ' + BOOKING_INTERVAL_COLUMNS + ' from (' + 
+                get_series_occurrences('s.resource_login = %(eng_login)s') + ') as occurrences', 
                  {'eng_login': eng_login, 'req_start_date': req_start_date,
                      'req_end_date': req_end_date})
 
@@ -140,7 +283,6 @@ def eng_booking_interval(start = None, end = None, eng_login = None):
         abort(404)
     return json.dumps(res)
 
-
 @app.route('/rest/eng_booking/<string:eng_login>/<string:prj_id>', methods=['POST', 'GET', 'DELETE', 'PATCH'])
 def eng_booking(eng_login, prj_id):
     cur = get_db().cursor()
@@ -148,7 +290,9 @@ def eng_booking(eng_login, prj_id):
         if prj_id  == '0':
             cur.execute('select * from booking where resource_login = %s and active = 1', (eng_login,))
         elif prj_id != '0':
-            cur.execute('select * from booking where resource_login = %s and project_id like %s and active = 1', (eng_login, '%' + prj_id + '%'))
+            cur.execute('select * from booking where resource_login = %(eng_login)s and '
+                        '(ext_key = %(prj_id)s or project_id = %(prj_id)s) and active = 1', 
+                        {'eng_login': eng_login, 'prj_id': prj_id})
         res = cur.fetchall()
         if len(res) == 0: 
             abort(404)
@@ -173,21 +317,149 @@ def eng_booking(eng_login, prj_id):
         project_id = request.form['prj_id']
         assignee = request.form['res_login']
         sla = request.form['sla']
-        one_hour_delta = timedelta(hours = 1)
-        end_datetime = datetime.today() + one_hour_delta
-        end_date = dateutils.iso2unix(str(end_datetime.date()) + 'T' + str(end_datetime.hour) + ':' + str(end_datetime.minute))
-        cur.execute('update booking set end_date=\''+ str(end_date) +'\', sla=%s where project_id like %s', (sla, project_id + '%', ))
+        if 'end_datetime' in request.form:
+            end_date = dateutils.iso2unix(request.form['end_datetime'])
+        else:
+            one_hour_delta = timedelta(hours = 1)
+            end_datetime = datetime.today() + one_hour_delta
+            end_date = dateutils.iso2unix(str(end_datetime.date()) + 'T' + str(end_datetime.hour) + ':' + str(end_datetime.minute))
+        if 'ext_key' in request.form:
+            cur.execute('update booking set end_date = %s, sla = %s '
+                        'where ext_key = %s and ext_system = %s', 
+                        (end_date, sla, request.form['ext_key'], request.form['ext_system']))
+        else:
+            cur.execute('update booking set end_date = %s, sla = %s where project_id = %s', 
+                        (end_date, sla, project_id))
         if cur.statusmessage == 'UPDATE 0':
             abort(404)
         return json.dumps('Updated booking for engineer')
 
     elif request.method == 'DELETE':
         cur.execute('delete from booking where resource_login = %s', (eng_login, ))
+        cur.execute('delete from booking_series where resource_login = %s', (eng_login, ))
         return json.dumps('Deleted engineer booking') 
 
 
-@app.route('/rest/spec_booking/<int:booking_id>', methods=['DELETE'])
+#booking created before ext_key column was added is adopted by first sync of 
+#its ticket: latest entry with the same project_id gets ticket key
+BOOKING_ADOPT_LEGACY = '''
+    update booking b set ext_system = v.ext_system, ext_key = v.ext_key
+    from (values %s) v(prj_id, ext_key, ext_system)
+    where b.oid = (select l.oid from booking l where l.ext_key is null and l.project_id = v.prj_id
+                   order by l.end_date desc limit 1) and
+          not exists (select 1 from booking k 
+                      where k.ext_key = v.ext_key and k.ext_system = v.ext_system)'''
+
+#ticket key is unique per source system (booking_ext_key_idx, migrations/006)
+BOOKING_UPSERT = '''
+    insert into booking 
+    select 'hours', null, 1, 1, 0, v.prj_id, 0, v.start_date, v.end_date, v.company, 
+           v.sla, 0, v.assignee, v.ext_system, v.ext_key
+    from (values %s) v(prj_id, assignee, company, sla, ext_key, ext_system, 
+                       start_date, end_date)
+    on conflict (ext_key, ext_system) do update set 
+        end_date = excluded.end_date, sla = excluded.sla, project_id = excluded.project_id, 
+        resource_login = excluded.resource_login, active = 1
+    returning ext_key, xmax = 0'''
+
+@app.route('/rest/eng_booking_bulk', methods=['POST'])
+def eng_booking_bulk():
+    '''Create or prolong booking of synced tickets in one transaction. 
+    entries form field is JSON list of [prj_id, assignee, company, sla, ext_key],
+    ext_system is name of source system, booking lasts from start_datetime to 
+    end_datetime. Returns [ext_key, outcome] list in the same order, 
+    outcome is updated or created'''
+    entries = json.loads(request.form['entries'])
+    ext_system = request.form['ext_system']
+    start_date = dateutils.iso2unix(request.form['start_datetime'])
+    end_date = dateutils.iso2unix(request.form['end_datetime'])
+    #last entry wins if ticket is repeated
+    rows = {}
+    for prj_id, assignee, company, sla, ext_key in entries:
+        rows[ext_key] = (prj_id, assignee, company, sla, ext_key, ext_system, 
+                         start_date, end_date)
+    if not rows:
+        return json.dumps([])
+    rows = list(rows.values())
+
+    cur = get_db().cursor()
+    psycopg2.extras.execute_values(cur, BOOKING_ADOPT_LEGACY, 
+                                   [(row[0], row[4], ext_system) for row in rows],
+                                   page_size = len(rows))
+    result = psycopg2.extras.execute_values(cur, BOOKING_UPSERT, rows, 
+                                            page_size = len(rows), fetch = True)
+    outcomes = {ext_key: 'created' if inserted else 'updated' for ext_key, inserted in result}
+    return json.dumps([[entry[4], outcomes[entry[4]]] for entry in entries])
+
+
+@app.route('/rest/eng_booking_batch', methods=['POST'])
+def eng_booking_batch():
+    '''Insert series of booking entries (e.g. occurrences of recurring booking) 
+    with one multi-row insert. entries form field is JSON list of dicts with
+    booking_type, percent, hours, resource_login, project_id, repeat, company, 
+    sla, start_date and end_date (ISO) keys. Returns list of created ids'''
+    entries = json.loads(request.form['entries'])
+    if not entries:
+        return json.dumps([])
+    rows = [(entry['booking_type'], entry['percent'], entry['hours'], 1, 0, entry['project_id'], 
+             entry['repeat'], dateutils.iso2unix(entry['start_date']), 
+             dateutils.iso2unix(entry['end_date']), entry['company'], entry['sla'], 0, 
+             entry['resource_login']) for entry in entries]
+    cur = get_db().cursor()
+    result = psycopg2.extras.execute_values(cur, 'insert into booking values %s returning oid', 
+                                            rows, page_size = len(rows), fetch = True)
+    return json.dumps([row[0] for row in result])
+
+@app.route('/rest/booking_series', methods=['POST'])
+def add_booking_series():
+    '''Create recurring booking rule (see dateutils.convert_booking_to_series),
+    start_datetime is start of first occurrence, end_datetime - end of series,
+    duration - length of occurrence in seconds. Returns series id'''
+    cur = get_db().cursor()
+    cur.execute('insert into booking_series (booking_type, percent, hours, project_id, repeat, '
+                'start_date, end_date, duration, company, sla, resource_login) '
+                'values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) returning id',
+                (request.form['booking_type'], request.form['percent'], request.form['hours'],
+                 request.form['project_id'], request.form['repeat'],
+                 dateutils.iso2unix(request.form['start_datetime']),
+                 dateutils.iso2unix(request.form['end_datetime']),
+                 int(request.form['duration']), request.form['company'], request.form['sla'],
+                 request.form['res_login']))
+    return json.dumps(cur.fetchone()[0])
+
+@app.route('/rest/booking_series/<int:series_id>', methods=['PATCH', 'DELETE'])
+def booking_series(series_id):
+    '''Edit or cancel whole series with one row update. PATCH accepts 
+    end_datetime (e.g. to stop series from some date), project_id, company and sla'''
+    cur = get_db().cursor()
+    if request.method == 'PATCH':
+        changes = {}
+        for field in ('project_id', 'company', 'sla'):
+            if field in request.form:
+                changes[field] = request.form[field]
+        if 'end_datetime' in request.form:
+            changes['end_date'] = dateutils.iso2unix(request.form['end_datetime'])
+        if not changes:
+            abort(400)
+        cur.execute('update booking_series set ' + 
+                    ', '.join('{0} = %({0})s'.format(field) for field in changes) + 
+                    ' where id = %(series_id)s', dict(changes, series_id = series_id))
+        if cur.rowcount == 0:
+            abort(404)
+        return json.dumps('Updated booking series')
+
+    elif request.method == 'DELETE':
+        cur.execute('delete from booking_series where id = %s', (series_id, ))
+        if cur.rowcount == 0:
+            abort(404)
+        return json.dumps('Deleted booking series')
+
+@app.route('/rest/spec_booking/<int(signed=True):booking_id>', methods=['DELETE'])
 def spec_booking(booking_id):
+    '''occurrences of booking series have negative ids (see get_series_occurrences),
+    the whole series is deleted for them'''
+    if booking_id < 0:
+        return booking_series(-booking_id)
     return json.dumps('Deleted booking info with id = {0}'.format(booking_id))
 
 @app.route('/rest/eng/<string:eng_login>', methods = ['GET', 'POST', 'PATCH', 'DELETE'])
@@ -220,11 +492,16 @@ def operate_on_engineer_data(eng_login):
         cur.execute('insert into resources values(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)', 
                     (fullname, phone, tags, skills, org_unit, eng_type, email, 
                      rem_id, jira_id, sharepoint_id, util, suir_id, langs))
+        invalidate_consworkrep(cur)
+        search_index.add(suir_id, searchIndex.get_profile_text(fullname, tags, skills, 
+                                                               org_unit, langs))
         return json.dumps('Added new engineer')
 
 
     elif request.method == 'DELETE':
         cur.execute('delete from resources where suir_id = %s', (eng_login, ))
+        invalidate_consworkrep(cur)
+        search_index.remove(eng_login)
         app.logger.info('Deleted engineer with suir_id = {0}'.format(eng_login))
 
     elif request.method == 'PATCH':
@@ -243,6 +520,10 @@ def operate_on_engineer_data(eng_login):
         langs = request.form['langs']
 
         cur.execute('update resources set full_name = %s, phone = %s, tags = %s, skills = %s, org_unit_id = %s, type = %s, e_mail = %s, rem_id = %s, jira_id = %s, sharepoint_id = %s, suir_id = %s, utilized = %s, langs = %s where suir_id=%s', (fullname, phone, tags, skills, org_unit, eng_type, email, rem_id, jira_id, sharepoint_id, suir_id, util, langs, eng_login)) 
+        invalidate_consworkrep(cur)
+        search_index.remove(eng_login)
+        search_index.add(suir_id, searchIndex.get_profile_text(fullname, tags, skills, 
+                                                               org_unit, langs))
         return json.dumps('Updated record')
 
 
@@ -256,29 +537,94 @@ def eng_list():
             abort(404)
         return json.dumps(res)
  
+#searchable text of engineer profile, must match expression of 
+#resources_search_trgm_idx index (see migrations/001_resources_search_index.sql)
+SEARCH_DOCUMENT = ("(coalesce(skills, '') || ' ' || coalesce(tags, '') || ' ' || "
+                   "coalesce(org_unit_id, '') || ' ' || coalesce(full_name, ''))")
+
 @app.route('/rest/search/<string:search_string>', methods = ['GET'])
 def search_rest(search_string):
-    cur = get_db().cursor()
-    res = []
-    for search_word in search_string.split():
-        search_word_like = '%' + search_word + '%'
-
-        cur.execute('select suir_id from resources where skills ilike %s', (search_word_like, ))
-        res_skills = cur.fetchall()
-        cur.execute('select suir_id from resources where tags ilike %s', (search_word_like, ))
-        res_tags = cur.fetchall()
-        cur.execute('select suir_id from resources where org_unit_id ilike %s', (search_word_like, ))
-        res_org_unit = cur.fetchall()
-        cur.execute('select suir_id from resources where full_name ilike %s', (search_word_like, ))
-        res_full_name = cur.fetchall()
-        
-        res = res + res_skills + res_tags + res_full_name + res_org_unit
-
-        res = list(set(res))
+    '''find engineers by any (mode=or, default) or all (mode=and) of search words 
+    in one indexed query ordered by relevance, or in in-memory search index 
+    (by words prefixes) if it is enabled'''
+    match_all = request.args.get('mode') == 'and'
+    if app.config['search_index']:
+        res = [[suir_id] for suir_id in get_search_index().search(search_string, match_all)]
+    else:
+        search_condition, search_params = get_search_condition(search_string, match_all)
+        if search_condition is None:
+            abort(404)
+        cur = get_db().cursor()
+        cur.execute('select suir_id from resources where ' + search_condition + 
+                    ' order by word_similarity(%(search_string)s, ' + SEARCH_DOCUMENT + ') desc, full_name',
+                    dict(search_params, search_string = search_string))
+        res = cur.fetchall()
     if len(res) == 0:
         abort(404)
     return json.dumps(res)
 
+def get_search_condition(search_string, match_all = False):
+    '''SQL condition matching engineers by any (or all) of search words in skills, tags,
+    org unit or full name, candidates are taken from in-memory search index if it is enabled.
+    Returns condition (None for empty search string) and its parameters'''
+    if app.config['search_index']:
+        return ('suir_id = any(%(candidate_ids)s)', 
+                {'candidate_ids': get_search_index().search(search_string, match_all)})
+    #one ilike term per word, so planner combines trigram index scans (BitmapAnd/BitmapOr),
+    #ilike all(array) can not use the index at all
+    search_words = {'search_word_{0}'.format(num): '%' + search_word + '%' 
+                    for num, search_word in enumerate(search_string.split())}
+    if len(search_words) == 0:
+        return None, {}
+    condition = (' and ' if match_all else ' or ').join(SEARCH_DOCUMENT + ' ilike %(' + name + ')s' 
+                                                       for name in search_words)
+    return '(' + condition + ')', search_words
+
+@app.route('/rest/ranked_search/<string:search_string>/<string:start>/<string:end>', methods = ['GET'])
+def ranked_search(search_string, start, end):
+    '''engineers found by search string ranked by workload in requested interval.
+    Busy time is union of engineer's booking entries, calculated in DB with 
+    running max of entries ends (sweep line over entries sorted by start).
+    Supports limit and offset query args, returns dict with total found engineers 
+    count and list of engineer profile rows with workload percent appended'''
+    req_start_date, req_end_date = get_request_interval(start, end)
+    search_condition, search_params = get_search_condition(search_string, 
+                                                           request.args.get('mode') == 'and')
+    if search_condition is None:
+        abort(404)
+
+    cur = get_db().cursor()
+    cur.execute('with candidates as (select oid, * from resources where ' + search_condition + '), '
+                'clipped as (select resource_login, '
+                '    greatest(start_date, %(req_start_date)s) as busy_start, '
+                '    least(end_date, %(req_end_date)s) as busy_end '
+                '    from booking where resource_login in (select suir_id from candidates) and '
+                '    start_date < %(req_end_date)s and end_date > %(req_start_date)s '
+                '    union all '
+                '    select resource_login, greatest(start_date, %(req_start_date)s), '
+                '    least(end_date, %(req_end_date)s) from (' + 
+                get_series_occurrences('s.resource_login in (select suir_id from candidates)') + 
+                ') as occurrences), '
+                'reached as (select resource_login, busy_start, busy_end, '
+                '    max(busy_end) over (partition by resource_login order by busy_start, busy_end '
+                '                        rows between unbounded preceding and 1 preceding) as prev_end '
+                '    from clipped), '
+                'busy as (select resource_login, '
+                '    sum(greatest(0, busy_end - greatest(busy_start, coalesce(prev_end, busy_start)))) as busy_time '
+                '    from reached group by resource_login) '
+                'select c.*, floor(coalesce(b.busy_time, 0) * 100.0 / %(window)s)::int as workload, '
+                '    count(*) over () as total '
+                'from candidates c left join busy b on b.resource_login = c.suir_id '
+                'order by workload, c.full_name limit %(limit)s offset %(offset)s', 
+                dict(search_params, req_start_date = req_start_date, 
+                     req_end_date = req_end_date, window = req_end_date - req_start_date,
+                     limit = request.args.get('limit', None, type = int), 
+                     offset = request.args.get('offset', 0, type = int)))
+    res = cur.fetchall()
+    if len(res) == 0:
+        abort(404)
+    return json.dumps({'total': res[0][-1], 'engineers': [list(row[:-1]) for row in res]})
+
 @app.route('/rest/get_eng_login/<string:fullname>', methods = ['GET'])
 def get_eng_login(fullname):
     cur = get_db().cursor()
@@ -291,26 +637,11 @@ def get_eng_login(fullname):
 @app.route('/rest/gentags', methods = ['POST'])
 def gen_tags():
     '''Generate tags for given text on predefined tags dictionary basis''' 
-    with open('tags_dict.pickle', 'rb') as tags_dict_file:
-        words = pickle.load(tags_dict_file)
+    return json.dumps(tags_dictionary.tag_text(request.form['texttotag']))
 
-    tags = []
-    prep_text_rw = re.sub('[^A-Za-z]+', ' ', request.form['texttotag'].lower())
-
-    for word in prep_text_rw.split():
-        if word in words:
-            if words[word] > 3: 
-                tags.append(word)
-                if len(tags) == 10: break
-    
-    res_tags = set(sorted(tags, key=lambda x:x[0]))
-    
-    return json.dumps(list(res_tags))
-
-@app.route('/rest/check_credentials/<string:login>/<string:pswd>', 
-           methods = ['GET'])
-def check_credentials(login, pswd):
-    cur = get_db().cursor()
+def verify_credentials(cur, login, pswd):
+    '''compare pswd hash from db with hash of given pswd, 
+    updates last logged in time on success'''
     cur.execute('select pswd_hash, salt from users where login = %s',
                 (login, ))
     res = cur.fetchall()
@@ -318,16 +649,51 @@ def check_credentials(login, pswd):
         pswd_hash = res[0][0]
         salt = res[0][1]
     else:
-        return json.dumps(False)
+        return False
 
     hsh =  bytes(''.join((pswd, salt)), 'UTF-8')
     given_pswd_hash = hashlib.sha256(hsh).hexdigest()
     if given_pswd_hash == pswd_hash:
         cur.execute('update users set last_logged_in=%s where login=%s',
                     (int(time.time()), login))
-        return json.dumps(True)
+        return True
     else:
+        return False
+
+@app.route('/rest/check_credentials/<string:login>/<string:pswd>', 
+           methods = ['GET'])
+def check_credentials(login, pswd):
+    cur = get_db().cursor()
+    return json.dumps(verify_credentials(cur, login, pswd))
+
+@app.route('/rest/sessions', methods = ['POST'])
+def sessions():
+    '''check credentials once and open session, returns opaque session token
+    with expiration time, or false if credentials are wrong'''
+    cur = get_db().cursor()
+    if not verify_credentials(cur, request.form['login'], request.form['pswd']):
         return json.dumps(False)
+    token = secrets.token_urlsafe(32)
+    expires = int(time.time()) + app.config['session_ttl']
+    cur.execute('delete from sessions where expires < %s', (int(time.time()), ))
+    cur.execute('insert into sessions values(%s, %s, %s)', 
+                (token, request.form['login'], expires))
+    return json.dumps({'token': token, 'login': request.form['login'], 'expires': expires})
+
+@app.route('/rest/sessions/<string:token>', methods = ['GET', 'DELETE'])
+def session(token):
+    cur = get_db().cursor()
+    if request.method == 'GET':
+        cur.execute('select login, expires from sessions where token = %s and expires > %s', 
+                    (token, int(time.time())))
+        res = cur.fetchall()
+        if len(res) == 0:
+            return json.dumps(None)
+        return json.dumps({'token': token, 'login': res[0][0], 'expires': res[0][1]})
+
+    elif request.method == 'DELETE':
+        cur.execute('delete from sessions where token = %s', (token, ))
+        return json.dumps('Closed session')
 
 @app.route('/rest/get_user_group/<string:login>', methods = ['GET'])
 def get_user_group(login):
@@ -394,15 +760,13 @@ def users():
                      int(time.time()), 0, request.form['user_group'], 
                      request.form['phone']))
 
-        msg_send_status = msg.send_sms(' '.join(('Вам создана учетная запись', 
-                                                 'на http://st-erm ', 
-                                                 request.form['login'],
-                                                 pswd)), 
-                                       0, app.config['sms_login'], 
-                                       app.config['sms_pwd'],
-                                       request.form['phone'])
-        if msg_send_status == 'ERROR': 
-            app.logger.error('Error sending SMS')
+        msg_send_status = msg.send_secret_sms(' '.join(('Вам создана учетная запись', 
+                                                        'на http://st-erm ', 
+                                                        request.form['login'],
+                                                        pswd)), 
+                                              request.form['phone'])
+        if msg_send_status[0] == 'ERROR': 
+            app.logger.error(' '.join(('Error sending SMS', msg_send_status[1])))
             flash('Не удалось отправить SMS пользователю. Обратитесь к разработчику', 'error')
         return json.dumps(pswd)
     elif request.method == 'PATCH':
@@ -0,0 +1,39 @@
+from modules.backend import backend
+from modules.message import smsOutbox, smsGateway, smsDispatcher
+import configparser
+import sys
+import time
+
+
+def get_phones(eng_logins):
+    '''phones of engineers by one request of engineers list'''
+    return smsDispatcher.get_engineers_phones(eng_logins, backend.get_engineers_list())
+
+
+config = configparser.ConfigParser()
+try:
+    config.read(sys.argv[1])
+    general = config['General']
+except (IndexError, KeyError, configparser.ParsingError):
+    print('''Usage: sms_dispatcher.py <config file name> [--once]\n\n
+    This utility sends SMS queued by ERSMM frontend and backend (SMS_outbox file).\n
+    Run it as a service next to them, or add it to cron tasks with --once option.''')
+else:
+    outbox = smsOutbox(general.get('SMS_outbox', 'sms_outbox.db'))
+    gateway = smsGateway(general['SMS_login'], general['SMS_pwd'], 
+                         general.get('SMS_originator', ''),
+                         host = general.get('SMS_gateway', 'api.smstraffic.ru'),
+                         port = general.getint('SMS_gateway_port', 80),
+                         timeout = general.getfloat('SMS_timeout', 10),
+                         rate_limit = general.getfloat('SMS_rate_limit', 0))
+    dispatcher = smsDispatcher(outbox, gateway, get_phones)
+    interval = general.getfloat('SMS_dispatch_interval', 5)
+
+    while True:
+        sent, failed = dispatcher.dispatch()
+        if sent or failed:
+            print('{0}: {1} sent, {2} failed'.format(time.strftime('%Y-%m-%d %H:%M:%S'), 
+                                                     sent, failed))
+        if '--once' in sys.argv:
+            break
+        time.sleep(interval)
@@ -1,7 +1,33 @@
 from modules.backend import backend
-from modules.integration import Remedy_HPD, Remedy_CHG, Jira, Sharepoint
+from modules.integration import externalSystem, Remedy_HPD, Remedy_CHG, Jira, Sharepoint
+from modules.syncstate import syncState
 import configparser
+import os
+import statistics
 import sys
+import time
+
+
+def has_account_in_system(system, engineer):
+    '''check if engineer has login in external system'''
+    if system == 'Remedy_HPD' and engineer[8] != None: 
+        return True
+    elif system == 'Remedy_CHG' and engineer[8] != None: 
+        return True
+    elif system == 'Jira' and engineer[9] != '' and engineer[9] != None: 
+        return True
+    elif system == 'Sharepoint' and engineer[10] != '' and engineer[10] != None: 
+        return True
+    return False
+
+def print_fetch_summary(system, stats):
+    latencies = stats['latencies']
+    if latencies:
+        print('{0}: {1} requests, latency min/median/max {2:.2f}/{3:.2f}/{4:.2f} s, {5} failed'.format(
+              system, len(latencies), min(latencies), statistics.median(latencies), 
+              max(latencies), len(stats['failures'])))
+    for eng_login, error in stats['failures']:
+        print('{0}: failed to get entries for {1}: {2!r}'.format(system, eng_login, error))
 
 
 config = configparser.ConfigParser()
@@ -18,30 +44,73 @@ else:
     sysTypes = {'Remedy_HPD': Remedy_HPD, 'Remedy_CHG': Remedy_CHG, 
                 'JIRA': Jira, 'Sharepoint': Sharepoint}
 
+    state_path = None
+    if config.has_section('General'):
+        #incremental sync is enabled if state file is set
+        state_path = config['General'].get('State_file')
+        #WSDLs are cached next to state file by default, so every run does not refetch them
+        default_wsdl_cache = (os.path.join(os.path.dirname(os.path.abspath(state_path)), 'wsdl_cache.db')
+                              if state_path else externalSystem.wsdl_cache_path)
+        externalSystem.wsdl_cache_path = config['General'].get('WSDL_cache', default_wsdl_cache)
+        externalSystem.wsdl_cache_ttl = config['General'].getint('WSDL_cache_ttl', 
+                                                                 externalSystem.wsdl_cache_ttl)
+
+    summary = {}
     for system in config.sections():
         if system != 'General':
             url = config[system]['URL']
             user = config[system]['User']
             pswd = config[system]['Password']
-            external_system = sysTypes[config[system]['Type']](url, user, pswd)
+            concurrency = config[system].getint('Concurrency', 8)
+            timeout = config[system].getfloat('Timeout', 30)
+            external_system = sysTypes[config[system]['Type']](url, user, pswd, timeout = timeout,
+                                                               source = system)
+            external_system.batch_size = config[system].getint('Batch_size', 
+                                                               external_system.batch_size)
 
-            print('\nSynchronizing with {0}...'.format(system))
+            full_sync_interval = config[system].getint('Full_sync_interval', 24*60*60)
+            state, full_sync = None, True
+            if state_path:
+                state = syncState(state_path, system)
+                full_sync = state.is_full_sync_due(full_sync_interval)
+                if not full_sync:
+                    external_system.modified_since = state.get_modified_since()
+
+            print('\nSynchronizing with {0} ({1})...'.format(system, 
+                                                           'full' if full_sync else 'incremental'))
+            started = time.time()
             external_system.connect()
-            entriesList = []
-            for engineer in backend.get_engineers_list():
-                entries = []
-                if system == 'Remedy_HPD' and engineer[8] != None: 
-                    entries = external_system.get_entries(engineer)
-                elif system == 'Remedy_CHG' and engineer[8] != None: 
-                    entries = external_system.get_entries(engineer)
-                elif system == 'Jira' and engineer[9] != '' and engineer[9] != None: 
-                    entries = external_system.get_entries(engineer)
-                elif system == 'Sharepoint' and engineer[10] != '' and engineer[10] != None: 
-                    entries = external_system.get_entries(engineer)
-
-                if entries != []: 
-                    entriesList = entriesList + entries
+            engineers = [engineer for engineer in backend.get_engineers_list()
+                         if has_account_in_system(system, engineer)]
+            entriesList, summary[system] = external_system.get_entries_for_engineers(engineers, 
+                                                                                      concurrency)
 
             preprocessed_entries = external_system.preprocess_entries(entriesList)
             print(preprocessed_entries)
-            external_system.send_booking_to_backend(preprocessed_entries)
+
+            #incremental sync fetches only modified tickets: open tickets which were not 
+            #modified are booked from state, tickets closed since last run are fetched 
+            #separately and their booking is ended
+            booked_entries, closed_keys = preprocessed_entries, []
+            if not full_sync:
+                external_system.fetch_closed = True
+                closedList, closed_stats = external_system.get_entries_for_engineers(engineers, 
+                                                                                      concurrency)
+                external_system.fetch_closed = False
+                summary[system]['latencies'].extend(closed_stats['latencies'])
+                summary[system]['failures'].extend(closed_stats['failures'])
+                closed_keys = [entry[4] for entry in external_system.preprocess_entries(closedList)]
+                booked_entries = state.get_booked_entries(preprocessed_entries, closed_keys)
+            external_system.send_booking_to_backend(booked_entries)
+
+            #watermark is not moved and closed tickets are not detected
+            #if some engineers were not fetched
+            if state is not None and not summary[system]['failures']:
+                closed_entries = state.commit(preprocessed_entries, started, full_sync, closed_keys)
+                print('Closed: {0}'.format(closed_entries))
+                external_system.close_booking(closed_entries)
+                state.save()
+
+    print('\nSync summary:')
+    for system, stats in summary.items():
+        print_fetch_summary(system, stats)
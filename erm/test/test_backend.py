@@ -0,0 +1,102 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from suir.modules.backend import backendClient, read_client_config
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps([self.path]).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DroppingHandler(KeepAliveHandler):
+    '''answers as keep-alive but closes connection after every response'''
+    posts = 0
+
+    def do_GET(self):
+        super().do_GET()
+        self.close_connection = True
+
+    def do_POST(self):
+        DroppingHandler.posts += 1
+        self.do_GET()
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_client_reuses_keep_alive_connection(server):
+    client = backendClient('127.0.0.1', server.server_port, pool_size = 2)
+    for _ in range(5):
+        data, status = client.request('GET', '/rest/eng_list')
+        assert status == 200
+        assert json.loads(data) == ['/rest/eng_list']
+    assert client.stats()['misses'] == 1
+    assert client.stats()['hits'] == 4
+    client.close()
+
+
+def test_client_pool_is_bounded(server):
+    client = backendClient('127.0.0.1', server.server_port, pool_size = 3)
+    threads = [threading.Thread(target=client.request, args=('GET', '/rest/users'))
+               for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.stats()['misses'] <= 3
+    assert client.stats()['hits'] + client.stats()['misses'] == 20
+    client.close()
+
+
+def test_client_raises_connection_error_when_backend_is_down():
+    client = backendClient('127.0.0.1', 1, pool_size = 1, timeout = 1)
+    with pytest.raises(ConnectionError):
+        client.request('GET', '/rest/eng_list')
+    #slot must be released after failure
+    with pytest.raises(ConnectionError):
+        client.request('GET', '/rest/eng_list')
+
+
+def test_client_retries_only_get_on_dropped_keep_alive_connection():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), DroppingHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = backendClient('127.0.0.1', httpd.server_port, pool_size = 1)
+    DroppingHandler.posts = 0
+
+    assert client.request('GET', '/rest/eng_list')[1] == 200
+    assert client.request('GET', '/rest/eng_list')[1] == 200
+    assert client.stats()['misses'] == 2
+    #POST is not resent, backend could have applied it before connection was dropped
+    with pytest.raises(ConnectionError):
+        client.request('POST', '/rest/eng_booking/t_testov/0', 'a=1',
+                       {'Content-type': 'application/x-www-form-urlencoded'})
+    assert client.stats()['misses'] == 2
+    assert client.request('POST', '/rest/eng_booking/t_testov/0', 'a=1',
+                          {'Content-type': 'application/x-www-form-urlencoded'})[1] == 200
+    assert DroppingHandler.posts == 1
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_read_client_config_defaults():
+    assert read_client_config(None) == {'pool_size': 10, 'timeout': 10.0}
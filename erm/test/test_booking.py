@@ -1,6 +1,7 @@
 import pytest
 import unittest.mock as mock
 
+from suir.modules.backend import backend
 from suir.modules.booking import *
 
 
@@ -38,25 +39,16 @@ def test_get_booking_info_from_request():
     assert booking == get_booking_info_from_request(request)
 
 
-def get_config():
-    config = {}
-    config['sms_login'] = 'sms_login'
-    config['sms_pwd'] = 'some_sms_pswd'
-    config['sms_originator'] = 'COMPANY'
-    return config
-
 @mock.patch('suir.modules.booking.msg', autospec=True)
 def test_send_task_added_messages_is_ok(msg):
     msg.send_sms.return_value = 'OK'
-    config = get_config()
-    assert send_task_added_messages('Задача 1', 'n_boss', 't_testov', config) == 'OK'
+    assert send_task_added_messages('Задача 1', 'n_boss', 't_testov') == 'OK'
 
 
 @mock.patch('suir.modules.booking.msg', autospec=True)
 def test_send_task_added_messages_with_error(msg):
     msg.send_sms.return_value = 'ERROR'
-    config = get_config()
-    assert send_task_added_messages('Задача 1', 'n_boss', 't_testov', config) == 'ERROR'
+    assert send_task_added_messages('Задача 1', 'n_boss', 't_testov') == 'ERROR'
 
 
 def test_set_timeline_as_history():
@@ -71,8 +63,40 @@ def test_set_timeline_as_active():
 @mock.patch('suir.modules.booking.flash', autospec=True)
 def test_adding_booking_entries(flash, backend):
     booking_entries = [form_booking() for x in range(0,10)] 
-    backend.add_booking_entry.return_value = [], '200', ''
-    assert add_booking_entries(booking_entries) == '200' 
+    backend.add_booking_entries.return_value = list(range(1, 11))
+    assert add_booking_entries(booking_entries) == list(range(1, 11))
+    backend.add_booking_entries.assert_called_once_with(booking_entries)
+    assert backend.add_booking_entry.call_count == 0
+    flash.assert_called_once_with('Задача успешно добавлена', 'info')
+
+
+@mock.patch('suir.modules.booking.backend', autospec=True)
+@mock.patch('suir.modules.booking.flash', autospec=True)
+def test_adding_recurring_booking_as_series(flash, backend):
+    booking = form_booking()
+    booking['percent'] = ''
+    booking['start_date'] = '2020-01-08T10:20'
+    booking['end_date'] = '2020-03-08T15:30'
+    backend.add_booking_series.return_value = 7
+    assert add_booking(booking) == 7
+    series = backend.add_booking_series.call_args[0][0]
+    assert (series['start_date'], series['end_date'], series['duration']) == ('2020-01-08T10:20',
+                                                                              '2020-03-08T15:30',
+                                                                              5 * 3600 + 10 * 60)
+    assert backend.add_booking_entries.call_count == 0
+
+@mock.patch('suir.modules.booking.backend', autospec=True)
+@mock.patch('suir.modules.booking.flash', autospec=True)
+def test_adding_not_recurring_booking_as_entry(flash, backend):
+    booking = form_booking()
+    booking['repeat'] = 'no'
+    booking['percent'] = ''
+    booking['start_date'] = '2020-01-08T10:20'
+    booking['end_date'] = '2020-01-08T15:30'
+    backend.add_booking_entries.return_value = [1]
+    assert add_booking(booking) == [1]
+    assert len(backend.add_booking_entries.call_args[0][0]) == 1
+    assert backend.add_booking_series.call_count == 0
 
 
 def form_activities(eng_list_login_name):
@@ -83,9 +107,7 @@ def form_activities(eng_list_login_name):
     return activities
 
 def return_different_engineers_booking(eng_login, start_date, end_date):
-    return [[57795, "hours", "", "", 1, 0,
-             "test 5", "no", 1579514400, 1582196400, 
-             "Beeline", "sla2", 0, eng_login]]
+    return [[57795, "test 5", 1579514400, 1582196400, "Beeline", "sla2"]]
 
 @mock.patch('suir.modules.booking.backend', autospec=True)
 def test_get_booking_entries_short_description(backend):
@@ -98,3 +120,14 @@ def test_get_booking_entries_short_description(backend):
     assert get_booking_entries_short_description(eng_list_login_name, 
                                             '2020-01-20T10:00', 
                                             '2020-02-20T11-00') == activities
+
+@pytest.mark.parametrize('call, expected', [
+    [lambda: backend.update_booking_series(3, {'sla': 'ST1'}), ('PATCH', '/rest/booking_series/3')],
+    [lambda: backend.delete_booking_series(3), ('DELETE', '/rest/booking_series/3')],
+    [lambda: backend.delete_booking(-3), ('DELETE', '/rest/spec_booking/-3')]])
+def test_booking_series_is_changed_through_backend(call, expected):
+    client = mock.Mock()
+    client.request.return_value = ('"Deleted booking series"', 200)
+    with mock.patch.object(backend, 'client', return_value = client):
+        assert call() == []
+    assert client.request.call_args[0][:2] == expected
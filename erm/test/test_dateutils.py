@@ -155,10 +155,8 @@ def test_convert_booking_to_entries_norepeat():
                                                              'resource_login': 't_testov'}]
 
 def test_replace_tmstps():
-    bkinfo = (1, 'hours', 20, '20', 1, 5, 'проект 11', None, 
-              1539770940, 1540065600)
-    res_bk = (1, 'hours', 20, '20', 1, 5, 'проект 11', None, 
-              '2018-10-17T10:09', '2018-10-20T20:00')
+    bkinfo = (1, 'проект 11', 1539770940, 1540065600, 'Company1', 'SLA1')
+    res_bk = (1, 'проект 11', '2018-10-17T10:09', '2018-10-20T20:00', 'Company1', 'SLA1')
     assert dateutils.replace_timestamps(bkinfo) == list(res_bk)
 
 @mock.patch('suir.modules.dateutils.time.time')
@@ -167,3 +165,28 @@ def test_get_last_week_time_interval(time):
     start_date = '2020-02-13T11:38'
     end_date = '2020-02-20T11:38'
     assert dateutils.get_last_week_time_interval() == (start_date, end_date)
+
+def test_convert_booking_to_series_keeps_daterange_timeframe():
+    assert dateutils.convert_booking_to_series('hours', '', '', 'weekly',
+                                               '2018-10-10T10:00', 
+                                               '2018-12-24T16:00', 
+                                               'Company1', 
+                                               'SLA1', 'Задача 1', 't_testov') == {'booking_type': 'hours',
+           'company': 'Company1',
+           'start_date': '2018-10-10T10:00',
+           'end_date': '2018-12-24T16:00',
+           'duration': 6 * 3600,
+           'hours': '',
+           'percent': '',
+           'repeat': 'weekly',
+           'sla': 'SLA1',
+           'project_id': 'Задача 1',
+           'resource_login': 't_testov'}
+
+def test_convert_booking_to_series_duration_keeps_minutes():
+    series = dateutils.convert_booking_to_series('percent', '50', '', 'daily',
+                                                 '2018-10-10', '2018-10-20', 
+                                                 'Company1', 'SLA1', 'Задача 1', 't_testov')
+    assert series['start_date'] == '2018-10-10T10:00'
+    assert series['end_date'] == '2018-10-20T14:30'
+    assert series['duration'] == 4.5 * 3600
@@ -0,0 +1,105 @@
+import threading
+import unittest.mock as mock
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from suir.modules.dbpool import dbPool
+
+
+class FakeConnection():
+    '''stands for psycopg2 connection, counts round trips to server'''
+
+    def __init__(self, *args, **kwargs):
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.info = self
+        self.alive = True
+        self.queries = 0
+
+    @property
+    def transaction_status(self):
+        return self.status
+
+    def get_transaction_status(self):
+        return self.status
+
+    def cursor(self):
+        cur = mock.Mock()
+        def execute(query):
+            self.queries += 1
+            if not self.alive:
+                raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        cur.execute.side_effect = execute
+        return cur
+
+    def commit(self):
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        if not self.alive:
+            raise psycopg2.InterfaceError('connection already closed')
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool():
+    with mock.patch('psycopg2.connect', side_effect = FakeConnection):
+        yield dbPool(1, 2, dbname = 'erm')
+
+
+def test_connection_is_reused_without_round_trip(pool):
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.queries == 0
+
+def test_connection_left_in_transaction_is_rolled_back(pool):
+    conn = pool.getconn()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+def test_broken_connection_is_replaced_after_failed_request(pool):
+    conn = pool.getconn()
+    conn.alive = False
+    pool.putconn(conn, failed = True)
+    assert conn.closed
+    new_conn = pool.getconn()
+    assert new_conn is not conn
+    assert not new_conn.closed
+
+def test_alive_connection_is_kept_after_failed_request(pool):
+    conn = pool.getconn()
+    pool.putconn(conn, failed = True)
+    assert conn.queries == 1
+    assert pool.getconn() is conn
+
+def test_closed_connection_is_replaced_on_checkout(pool):
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.closed = 2
+    assert pool.getconn() is not conn
+
+def test_checkout_over_maxconn_waits_for_returned_connection(pool):
+    conns = [pool.getconn(), pool.getconn()]
+    waiting = []
+    thread = threading.Thread(target = lambda: waiting.append(pool.getconn()))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+    pool.putconn(conns[0])
+    thread.join(1)
+    assert waiting == [conns[0]]
+
+def test_checkout_over_maxconn_times_out(pool):
+    pool.timeout = 0.1
+    pool.getconn()
+    pool.getconn()
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
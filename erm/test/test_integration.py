@@ -1,8 +1,16 @@
+import gzip
+import json
+import threading
+import time
+import urllib.parse
 import unittest.mock as mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 import pytest
+import zeep.cache
+import zeep.exceptions
 
-from suir.modules.integration import externalSystem, Jira, Remedy_CHG, Remedy_HPD
+from suir.modules.integration import externalSystem, Jira, Remedy_CHG, Remedy_HPD, Sharepoint
 from suir.modules.exceptions import NoDataError
 
 def get_external_system_instance(system_class):
@@ -86,10 +94,10 @@ def test_connecting_and_getting_entries_from_external_system(system_class, expec
                                                                        [('SERVICEML-5 Task description', 
                                                                          't_testov', 
                                                                          'Стэп Лоджик', 
-                                                                         'SERVICEML'), 
+                                                                         'SERVICEML', 'SERVICEML-5'), 
                                                                          ('ERM-73 Task description', 
                                                                           't_testov', 'Стэп Лоджик', 
-                                                                          'ERM')]], 
+                                                                          'ERM', 'ERM-73')]], 
                                                                      [Remedy_HPD, [1, 2, 3]],
                                                                      [Remedy_CHG, [1, 2, 3]]])
 def test_external_system_entries_preprocessing(system_class, expected_preproced_entries):
@@ -106,11 +114,11 @@ def test_external_system_entries_preprocessing(system_class, expected_preproced_
     assert preprocessed_entries == expected_preproced_entries 
 
 
-@mock.patch('suir.modules.backend.backend.update_booking')
+@mock.patch('suir.modules.backend.backend.upsert_bookings')
 @pytest.mark.parametrize('system_class', [Jira, Remedy_HPD, Remedy_CHG])
-def test_sending_external_system_tasks_to_backend_for_booking_update(update_booking, system_class):
-    update_booking.return_value = '200'
-
+@pytest.mark.parametrize('outcome', ['updated', 'created'])
+def test_sending_external_system_tasks_to_backend_in_one_request(upsert_bookings, 
+                                                                 system_class, outcome):
     engineer = [57790,  'Умаров Герман Шавкатович',
                '9851799623', 'web php javascript bmc remedy linux',
                'test', '1522-6 Отдел автоматизации ИТ процессов',
@@ -122,28 +130,337 @@ def test_sending_external_system_tasks_to_backend_for_booking_update(update_book
 
     entries = get_entries_from_system(external_system, engineer)
     preprocessed_entries = external_system.preprocess_entries(entries)
+    upsert_bookings.return_value = [[entry[4], outcome] for entry in preprocessed_entries]
     status = external_system.send_booking_to_backend(preprocessed_entries)
     assert status == '200'
+    assert upsert_bookings.call_count == (1 if preprocessed_entries else 0)
+    if preprocessed_entries:
+        assert upsert_bookings.call_args[0][0] == [list(entry) for entry in preprocessed_entries]
+        assert upsert_bookings.call_args[0][1] == system_class.__name__
 
-@mock.patch('suir.modules.backend.backend.add_booking_entry')
-@mock.patch('suir.modules.backend.backend.update_booking')
-@pytest.mark.parametrize('system_class', [Jira, Remedy_HPD, Remedy_CHG])
-def test_sending_external_system_tasks_to_backend_for_booking_create(update_booking,
-                                                                     add_booking_entry, 
-                                                                     system_class):
-    add_booking_entry.return_value = '200'
-    update_booking.side_effect = NoDataError('по задачам')
-    
-    engineer = [57790,  'Умаров Герман Шавкатович',
-               '9851799623', 'web php javascript bmc remedy linux',
-               'test', '1522-6 Отдел автоматизации ИТ процессов',
-               'Начальник отдела',
-               'umarov.german@gmail.com',
-               'german', 'g_umarov', '', 'yes', 't_testov', 'Английский']
+def test_getting_entries_for_engineers_concurrently_keeps_order_and_failures():
+    engineers = [[n, 'name', '', '', '', '', '', '', 'rem', 'jira', '', 'yes', 'login_%d' % n, '']
+                 for n in range(6)]
 
-    external_system = get_external_system_instance(system_class)
+    def get_entries(engineer):
+        if engineer[0] == 3:
+            raise ConnectionError('timed out')
+        return [engineer[0]]
 
-    entries = get_entries_from_system(external_system, engineer)
-    preprocessed_entries = external_system.preprocess_entries(entries)
-    status = external_system.send_booking_to_backend(preprocessed_entries)
-    assert status == '200'
+    external_system = Jira('url', 'usr', 'pswd', timeout = 5)
+    external_system.batch_size = 0
+    with mock.patch.object(external_system, 'get_entries', side_effect = get_entries):
+        entries, stats = external_system.get_entries_for_engineers(engineers, concurrency = 4)
+
+    assert entries == [0, 1, 2, 4, 5]
+    assert len(stats['latencies']) == 6
+    assert [login for login, error in stats['failures']] == ['login_3']
+
+def test_sharepoint_list_is_fetched_once_for_all_engineers():
+    from lxml import etree
+    rows = [etree.Element('row', ows_ID = str(n), ows_Title = 'Task %d' % n,
+                          ows_sl_WFSAssignedTo = assignee, ows_sl_WFSStatus = status,
+                          ows_sl_WFSPriority = '1')
+            for n, (assignee, status) in enumerate([('ivanov', 'Выполнение'), 
+                                                    ('petrov', 'Выполнение'),
+                                                    ('ivanov', 'Закрыта'),
+                                                    ('ivanov', 'Выполнение')])]
+    engineers = [[n, 'name', '', '', '', '', '', '', None, '', sp_login, 'yes', 'login_%d' % n, '']
+                 for n, sp_login in enumerate(['ivanov', 'petrov', 'sidorov'])]
+
+    external_system = Sharepoint('url', 'usr', 'pswd')
+    with mock.patch.object(external_system, 'get_list_rows', return_value = rows) as get_list_rows:
+        entries, stats = external_system.get_entries_for_engineers(engineers, concurrency = 3)
+
+    get_list_rows.assert_called_once_with()
+    assert [(entry['key'], entry['eng_id']) for entry in entries] == [('0', 'login_0'), 
+                                                                      ('3', 'login_0'), 
+                                                                      ('1', 'login_1')]
+
+    external_system.fetch_closed = True
+    with mock.patch.object(external_system, 'get_list_rows', return_value = rows) as get_list_rows:
+        entries, stats = external_system.get_entries_for_engineers(engineers, concurrency = 3)
+    assert [(entry['key'], entry['eng_id']) for entry in entries] == [('2', 'login_0')]
+
+WSDL = b'''<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+             xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:tns="urn:stub" targetNamespace="urn:stub">
+  <types>
+    <xsd:schema targetNamespace="urn:stub">
+      <xsd:element name="Ping" type="xsd:string"/>
+    </xsd:schema>
+  </types>
+  <message name="PingMessage"><part name="body" element="tns:Ping"/></message>
+  <portType name="StubPort">
+    <operation name="Ping"><input message="tns:PingMessage"/><output message="tns:PingMessage"/></operation>
+  </portType>
+  <binding name="StubBinding" type="tns:StubPort">
+    <soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="Ping">
+      <soap:operation soapAction="Ping"/>
+      <input><soap:body use="literal"/></input><output><soap:body use="literal"/></output>
+    </operation>
+  </binding>
+  <service name="StubService">
+    <port name="StubPort" binding="tns:StubBinding"><soap:address location="http://stub/"/></port>
+  </service>
+</definitions>'''
+
+
+class WSDLStubHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(WSDL)))
+        self.end_headers()
+        self.wfile.write(WSDL)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_wsdl_is_fetched_once_across_sync_runs(tmp_path):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), WSDLStubHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    WSDLStubHandler.requests = []
+    url = 'http://127.0.0.1:{0}/HPD_WS'.format(httpd.server_port)
+    clients = []
+    #default cache lives in user cache dir
+    with mock.patch('zeep.cache._get_default_cache_path', return_value = str(tmp_path / 'cache.db')), \
+         mock.patch.object(externalSystem, '_soap_clients', {}), \
+         mock.patch.object(externalSystem, '_sessions', {}), \
+         mock.patch.object(zeep.cache.InMemoryCache, '_cache', {}):
+        for run in range(2):
+            #every sync run is a new process without shared clients and in-memory caches
+            externalSystem._soap_clients.clear()
+            externalSystem._sessions.clear()
+            zeep.cache.InMemoryCache._cache.clear()
+            clients.append(Remedy_HPD(url, 'usr', 'pswd').get_soap_client())
+            assert Remedy_HPD(url, 'usr', 'pswd').get_soap_client() is clients[-1]
+    httpd.shutdown()
+    httpd.server_close()
+
+    assert WSDLStubHandler.requests == ['/HPD_WS']
+    assert clients[0] is not clients[1]
+
+def test_remedy_batch_query_pages_and_splits_entries_by_assignee():
+    incidents = [{'Incident_Number': 'INC%d' % n, 'Assignee_Login_ID': login}
+                 for n, login in enumerate(['german', 'Ivanov', 'german', 'stranger', 'ivanov', None])]
+    incidents.append({'Incident_Number': 'INC6', 'Assignee_Login_ID': ''})
+    pages = [incidents[0:2], incidents[2:4], incidents[4:6], incidents[6:]]
+    client = mock.MagicMock()
+    client.service.HelpDesk_QueryList_Service.side_effect = pages
+    engineers = [[n, 'name', '', '', '', '', '', '', rem_id, '', '', 'yes', 'login_%d' % n, '']
+                 for n, rem_id in enumerate(['german', 'ivanov'])]
+
+    external_system = Remedy_HPD('url', 'usr', 'pswd')
+    external_system.connection = (client, 'header')
+    external_system.page_size = 2
+    external_system.batch_size = 50
+    entries, stats = external_system.get_entries_for_engineers(engineers)
+
+    assert [(entry['Incident_Number'], entry['eng_id']) for entry in entries] == [
+        ('INC0', 'login_0'), ('INC1', 'login_1'), ('INC2', 'login_0'), ('INC4', 'login_1')]
+    assert len(stats['latencies']) == 1
+    assert stats['failures'] == []
+    calls = client.service.HelpDesk_QueryList_Service.call_args_list
+    assert [call[1]['startRecord'] for call in calls] == [0, 2, 4, 6]
+    assert calls[0][1]['Qualification'] == ('(\'Assignee Login ID\'="german" OR '
+                                            '\'Assignee Login ID\'="ivanov") AND \'Status\' < 4')
+
+def test_remedy_chg_batch_query_splits_entries_by_cab_manager():
+    changes = [{'Infrastructure_Change_ID': 'CRQ%d' % n, 'CAB_Manager___Change_Co-ord__': login}
+               for n, login in enumerate(['german', 'stranger', 'IVANOV'])]
+    client = mock.MagicMock()
+    client.service.Change_QueryList_Service.return_value = changes
+    engineers = [[n, 'name', '', '', '', '', '', '', rem_id, '', '', 'yes', 'login_%d' % n, '']
+                 for n, rem_id in enumerate(['german', 'ivanov'])]
+
+    external_system = Remedy_CHG('url', 'usr', 'pswd')
+    external_system.connection = (client, 'header')
+    external_system.batch_size = 50
+    entries, stats = external_system.get_entries_for_engineers(engineers)
+
+    assert [(entry['Infrastructure_Change_ID'], entry['eng_id']) for entry in entries] == [
+        ('CRQ0', 'login_0'), ('CRQ2', 'login_1')]
+    assert stats['failures'] == []
+    qualification = client.service.Change_QueryList_Service.call_args[1]['Qualification']
+    assert qualification.startswith('(\'CAB Manager ( Change Co-ord )\'="german" OR ')
+
+def test_remedy_batch_fails_when_entries_have_no_assignee_field():
+    client = mock.MagicMock()
+    client.service.Change_QueryList_Service.return_value = [{'Infrastructure_Change_ID': 'CRQ0', 
+                                                             'CAB_Manager_Login': 'german'}]
+    engineers = [[n, 'name', '', '', '', '', '', '', rem_id, '', '', 'yes', 'login_%d' % n, '']
+                 for n, rem_id in enumerate(['german', 'ivanov'])]
+    external_system = Remedy_CHG('url', 'usr', 'pswd')
+    external_system.connection = (client, 'header')
+    external_system.batch_size = 50
+    entries, stats = external_system.get_entries_for_engineers(engineers)
+    assert entries == []
+    assert [login for login, error in stats['failures']] == ['login_0', 'login_1']
+
+def test_remedy_is_queried_per_engineer_by_default():
+    client = mock.MagicMock()
+    client.service.HelpDesk_QueryList_Service.return_value = []
+    engineers = [[n, 'name', '', '', '', '', '', '', rem_id, '', '', 'yes', 'login_%d' % n, '']
+                 for n, rem_id in enumerate(['german', 'ivanov'])]
+    external_system = Remedy_HPD('url', 'usr', 'pswd')
+    external_system.connection = (client, 'header')
+    entries, stats = external_system.get_entries_for_engineers(engineers)
+    assert client.service.HelpDesk_QueryList_Service.call_count == 2
+    assert len(stats['latencies']) == 2
+
+def test_remedy_qualification_quotes_values():
+    engineers = [[0, 'name', '', '', '', '', '', '', 'o\'brien', '', '', 'yes', 'login_0', ''],
+                 [1, 'name', '', '', '', '', '', '', 'x" OR "1"="1', '', '', 'yes', 'login_1', '']]
+    qualification = Remedy_HPD('url', 'usr', 'pswd').get_qualification(engineers)
+    assert qualification == ('(\'Assignee Login ID\'="o\'brien" OR '
+                             '\'Assignee Login ID\'="x"" OR ""1""=""1") AND \'Status\' < 4')
+
+@pytest.mark.parametrize('fault, failed', [['ERROR (302): Entry does not exist in database', False],
+                                           ['ERROR (623): Authentication failed', True]])
+def test_remedy_faults(fault, failed):
+    client = mock.MagicMock()
+    client.service.HelpDesk_QueryList_Service.side_effect = zeep.exceptions.Fault(fault)
+    engineer = [0, 'name', '', '', '', '', '', '', 'german', '', '', 'yes', 'login_0', '']
+    external_system = Remedy_HPD('url', 'usr', 'pswd')
+    external_system.connection = (client, 'header')
+    entries, stats = external_system.get_entries_for_engineers([engineer])
+    assert entries == []
+    assert [login for login, error in stats['failures']] == (['login_0'] if failed else [])
+
+
+class JiraStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    issues = [{'key': 'ERM-%d' % n, 'fields': {'summary': 'Task %d' % n, 
+                                              'assignee': {'name': login}}}
+              for n, login in enumerate(['g_umarov', 'i_ivanov', 'G_Umarov', 'stranger', 'i_ivanov'])]
+    requests = []
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        self.requests.append((self.client_address, query))
+        start, limit = int(query['startAt'][0]), int(query['maxResults'][0])
+        body = gzip.compress(json.dumps({'total': len(self.issues), 
+                                         'issues': self.issues[start:start + limit]}).encode())
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_jira_batch_search_pages_over_one_connection():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), JiraStubHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    engineers = [[n, 'name', '', '', '', '', '', '', None, jira_id, '', 'yes', 'login_%d' % n, '']
+                 for n, jira_id in enumerate(['g_umarov', 'i_ivanov'])]
+
+    external_system = Jira('127.0.0.1', 'usr', 'pswd')
+    external_system.port = httpd.server_port
+    external_system.page_size = 2
+    entries, stats = external_system.get_entries_for_engineers(engineers)
+    httpd.shutdown()
+    httpd.server_close()
+
+    assert [(entry['key'], entry['eng_id']) for entry in entries] == [
+        ('ERM-0', 'login_0'), ('ERM-1', 'login_1'), ('ERM-2', 'login_0'), ('ERM-4', 'login_1')]
+    assert stats['failures'] == []
+    assert len(JiraStubHandler.requests) == 3
+    assert len(set(address for address, query in JiraStubHandler.requests)) == 1
+    query = JiraStubHandler.requests[0][1]
+    assert query['fields'] == ['key,summary,assignee']
+    assert query['jql'][0].endswith('assignee in ("g_umarov", "i_ivanov")')
+
+class SlowJiraStubHandler(JiraStubHandler):
+    '''answers first request after client timeout'''
+    delays = []
+
+    def do_GET(self):
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        super().do_GET()
+
+
+def test_jira_does_not_reuse_connection_after_timeout():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), SlowJiraStubHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    SlowJiraStubHandler.requests = []
+    SlowJiraStubHandler.delays = [0.5]
+    external_system = Jira('127.0.0.1', 'usr', 'pswd', timeout = 0.2)
+    external_system.port = httpd.server_port
+    external_system.page_size = 10
+    with pytest.raises(TimeoutError):
+        external_system.search('first')
+    time.sleep(0.5)
+    issues = external_system.search('second')
+    httpd.shutdown()
+    httpd.server_close()
+
+    assert [issue['key'] for issue in issues] == ['ERM-%d' % n for n in range(5)]
+    assert [query['jql'] for address, query in SlowJiraStubHandler.requests] == [['first'], 
+                                                                                ['second']]
+    assert len(set(address for address, query in SlowJiraStubHandler.requests)) == 2
+
+class StrictJiraStubHandler(JiraStubHandler):
+    '''rejects JQL with unknown assignee like Jira does'''
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        if '"ghost"' in query['jql'][0]:
+            self.requests.append((self.client_address, query))
+            body = b'{"errorMessages": ["The value \'ghost\' does not exist for the field \'assignee\'."]}'
+            self.send_response(400)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            super().do_GET()
+
+
+def test_jira_batch_rejected_for_unknown_assignee_is_queried_per_engineer():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StrictJiraStubHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    StrictJiraStubHandler.requests = []
+    engineers = [[n, 'name', '', '', '', '', '', '', None, jira_id, '', 'yes', 'login_%d' % n, '']
+                 for n, jira_id in enumerate(['g_umarov', 'ghost', 'i_ivanov'])]
+
+    external_system = Jira('127.0.0.1', 'usr', 'pswd')
+    external_system.port = httpd.server_port
+    external_system.page_size = 10
+    entries, stats = external_system.get_entries_for_engineers(engineers)
+    httpd.shutdown()
+    httpd.server_close()
+
+    assert [entry['eng_id'] for entry in entries] == ['login_0'] * 5 + ['login_2'] * 5
+    assert [login for login, error in stats['failures']] == ['login_1']
+    assert stats['failures'][0][1].status == 400
+    assert [query['jql'][0].split('assignee in ')[1] for address, query in 
+            StrictJiraStubHandler.requests] == ['("g_umarov", "ghost", "i_ivanov")', 
+                                                '("g_umarov")', '("ghost")', '("i_ivanov")']
+
+def test_incremental_queries_filter_by_modification_time():
+    engineer = [1, 'name', '', '', '', '', '', '', 'german', 'g_umarov', '', 'yes', 't_testov', '']
+    jira = Jira('url', 'usr', 'pswd')
+    remedy = Remedy_HPD('url', 'usr', 'pswd')
+    assert 'updated' not in jira.get_jql([engineer])
+    assert 'Last Modified Date' not in remedy.get_qualification([engineer])
+
+    jira.modified_since = remedy.modified_since = 1539338400
+    assert jira.get_jql([engineer]).endswith(' AND updated >= "{0}"'.format(
+        time.strftime('%Y/%m/%d %H:%M', time.localtime(1539338400))))
+    assert remedy.get_qualification([engineer]).endswith(" AND 'Last Modified Date' > 1539338400")
+
+def test_closed_tickets_queries():
+    engineer = [1, 'name', '', '', '', '', '', '', 'german', 'g_umarov', '', 'yes', 't_testov', '']
+    jira = Jira('url', 'usr', 'pswd')
+    remedy = Remedy_CHG('url', 'usr', 'pswd')
+    jira.fetch_closed = remedy.fetch_closed = True
+    assert jira.get_jql([engineer]).startswith('NOT ({0}) AND assignee in'.format(Jira.OPEN_ISSUES_JQL))
+    assert remedy.get_qualification([engineer]).endswith(" AND NOT ('Change Request Status' < 9)")
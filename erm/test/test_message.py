@@ -0,0 +1,188 @@
+import threading
+import time
+import urllib.parse
+import unittest.mock as mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from suir.modules.message import message, smsOutbox, smsGateway, smsDispatcher
+
+
+class GatewayStubHandler(BaseHTTPRequestHandler):
+    '''answers like smstraffic.ru multi.php, fails requests while failures > 0'''
+    failures = 0
+    requests = []
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        GatewayStubHandler.requests.append(form)
+        if GatewayStubHandler.failures > 0:
+            GatewayStubHandler.failures -= 1
+            result, code, description = 'ERROR', '500', 'gateway is busy'
+        else:
+            result, code, description = 'OK', '0', 'queued'
+        body = '<reply><result>{0}</result><code>{1}</code><description>{2}</description></reply>'.format(
+            result, code, description).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_gateway():
+    GatewayStubHandler.failures = 0
+    GatewayStubHandler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), GatewayStubHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def stop_gateway(httpd):
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_send_sms_only_enqueues(tmp_path):
+    message.outbox_path = str(tmp_path / 'outbox.db')
+    status, description = message.send_sms('Задача', 't_testov')
+    assert status == 'OK'
+    msg_id = int(description.split()[1])
+    outbox = smsOutbox(message.outbox_path)
+    assert outbox.get_due() == [(msg_id, 't_testov', None, 'Задача', None, None)]
+    assert outbox.get_status(msg_id) == ('pending', 0, None)
+
+def test_outbox_is_opened_once(tmp_path):
+    message.outbox_path = str(tmp_path / 'outbox.db')
+    with mock.patch('suir.modules.message.smsOutbox', wraps = smsOutbox) as outbox_class:
+        message.send_sms('Задача 1', 't_testov')
+        message.send_sms('Задача 2', 't_testov')
+    assert outbox_class.call_count == 1
+    assert len(smsOutbox(message.outbox_path).get_due()) == 2
+
+def test_secret_sms_is_sent_at_once_and_not_stored(tmp_path):
+    message.outbox_path = str(tmp_path / 'outbox.db')
+    httpd = start_gateway()
+    message.gateway = smsGateway('l', 'p', 'ERM', host = '127.0.0.1', port = httpd.server_port,
+                                 timeout = 5)
+    status, _ = message.send_secret_sms('Вам создана учетная запись t_testov 1a2b3c4d', 
+                                        '79990000001')
+    stop_gateway(httpd)
+    message.gateway = None
+
+    assert status == 'OK'
+    assert GatewayStubHandler.requests[0]['phones'] == ['79990000001']
+    assert GatewayStubHandler.requests[0]['message'] == ['Вам создана учетная запись t_testov 1a2b3c4d']
+    assert not (tmp_path / 'outbox.db').exists()
+
+def test_phones_are_taken_from_engineers_list_rows():
+    #oid, full_name, phone, tags, skills, org_unit_id, type, e_mail, rem_id, jira_id, 
+    #sharepoint_id, utilized, suir_id, langs
+    engineers = [[1, 'Тестов Т.', '79990000001', '', '', '', '', 't@company.ru', None, 
+                  None, None, 'yes', 't_testov', ''],
+                 [2, 'Иванов И.', '79990000002', '', '', '', '', 'i@company.ru', None, 
+                  None, None, 'yes', 'i_ivanov', '']]
+    assert smsDispatcher.get_engineers_phones({'t_testov', 'stranger'}, engineers) == {
+        't_testov': '79990000001'}
+
+def test_dispatcher_batches_recipients_of_same_text(tmp_path):
+    outbox = smsOutbox(str(tmp_path / 'outbox.db'))
+    first = outbox.enqueue('Задача', eng_login = 't_testov', now = 0)
+    second = outbox.enqueue('Задача', eng_login = 'i_ivanov', now = 0)
+    other = outbox.enqueue('Учетная запись', phone = '79990000003', now = 0)
+    unknown = outbox.enqueue('Задача', eng_login = 'stranger', now = 0)
+    resolved = []
+    def get_phones(eng_logins):
+        resolved.append(eng_logins)
+        return {'t_testov': '79990000001', 'i_ivanov': '79990000002'}
+
+    httpd = start_gateway()
+    gateway = smsGateway('l', 'p', 'ERM', host = '127.0.0.1', port = httpd.server_port, timeout = 5)
+    sent, failed = smsDispatcher(outbox, gateway, get_phones).dispatch(now = 1)
+    stop_gateway(httpd)
+
+    assert (sent, failed) == (3, 1)
+    assert resolved == [{'t_testov', 'i_ivanov', 'stranger'}]
+    assert sorted(request['phones'][0] for request in GatewayStubHandler.requests) == [
+        '79990000001,79990000002', '79990000003']
+    assert GatewayStubHandler.requests[0]['originator'] == ['ERM']
+    assert [outbox.get_status(msg_id)[0] for msg_id in (first, second, other)] == ['sent'] * 3
+    assert outbox.get_status(unknown) == ('failed', 1, 'no phone')
+    assert outbox.get_due(now = 10**10) == []
+
+def test_dispatcher_retries_with_backoff(tmp_path):
+    outbox = smsOutbox(str(tmp_path / 'outbox.db'))
+    msg_id = outbox.enqueue('Задача', phone = '79990000001', now = 0)
+    httpd = start_gateway()
+    GatewayStubHandler.failures = 2
+    gateway = smsGateway('l', 'p', 'ERM', host = '127.0.0.1', port = httpd.server_port, timeout = 5)
+    dispatcher = smsDispatcher(outbox, gateway, lambda eng_logins: {})
+
+    assert dispatcher.dispatch(now = 0) == (0, 1)
+    assert outbox.get_status(msg_id) == ('pending', 1, '500 gateway is busy')
+    #not due before retry delay
+    assert dispatcher.dispatch(now = smsOutbox.RETRY_DELAY - 1) == (0, 0)
+    assert dispatcher.dispatch(now = smsOutbox.RETRY_DELAY) == (0, 1)
+    assert dispatcher.dispatch(now = smsOutbox.RETRY_DELAY * 2) == (0, 0)
+    assert dispatcher.dispatch(now = smsOutbox.RETRY_DELAY * 3) == (1, 0)
+    stop_gateway(httpd)
+
+    assert outbox.get_status(msg_id) == ('sent', 3, '0 queued')
+    assert len(GatewayStubHandler.requests) == 3
+
+def test_unavailable_gateway_keeps_messages_pending(tmp_path):
+    outbox = smsOutbox(str(tmp_path / 'outbox.db'))
+    msg_id = outbox.enqueue('Задача', phone = '79990000001', now = 0)
+    httpd = start_gateway()
+    port = httpd.server_port
+    stop_gateway(httpd)
+    gateway = smsGateway('l', 'p', 'ERM', host = '127.0.0.1', port = port, timeout = 1)
+
+    assert smsDispatcher(outbox, gateway, lambda eng_logins: {}).dispatch(now = 0) == (0, 1)
+    status, attempts, _ = outbox.get_status(msg_id)
+    assert (status, attempts) == ('pending', 1)
+
+def test_notifications_of_recipient_are_coalesced_into_digest(tmp_path):
+    outbox = smsOutbox(str(tmp_path / 'outbox.db'))
+    def notify(eng_login, project_id, now):
+        return outbox.enqueue('Задача ' + project_id, eng_login = eng_login, digest = 'Задачи:', 
+                              digest_item = project_id, window = 60, now = now)
+    first = [notify('t_testov', 'ERM-%d' % n, n) for n in range(12)]
+    single = notify('i_ivanov', 'ERM-20', 30)
+    late = notify('t_testov', 'ERM-30', 70)
+    outbox.enqueue('Учетная запись', phone = '79990000001', now = 0)
+
+    httpd = start_gateway()
+    gateway = smsGateway('l', 'p', 'ERM', host = '127.0.0.1', port = httpd.server_port, timeout = 5)
+    dispatcher = smsDispatcher(outbox, gateway, 
+                               lambda eng_logins: {'t_testov': '79990000001', 
+                                                   'i_ivanov': '79990000002'})
+    #only plain message is due before coalescing window ends
+    assert dispatcher.dispatch(now = 59) == (1, 0)
+    #pending notifications of recipient are sent when the first of them is due
+    assert dispatcher.dispatch(now = 60) == (13, 0)
+    assert dispatcher.dispatch(now = 90) == (1, 0)
+    assert dispatcher.dispatch(now = 200) == (0, 0)
+    stop_gateway(httpd)
+
+    messages = [(request['phones'][0], request['message'][0]) 
+                for request in GatewayStubHandler.requests]
+    assert messages[0] == ('79990000001', 'Учетная запись')
+    assert sorted(messages[1:]) == [
+        ('79990000001', 'Задачи: ' + '; '.join('ERM-%d' % n for n in range(10)) + ' и еще 3'),
+        ('79990000002', 'Задача ERM-20')]
+    assert [outbox.get_status(msg_id)[0] for msg_id in first + [single, late]] == ['sent'] * 14
+
+def test_gateway_requests_are_rate_limited_per_account():
+    httpd = start_gateway()
+    gateways = [smsGateway('account', 'p', 'ERM', host = '127.0.0.1', port = httpd.server_port, 
+                           rate_limit = 20) for _ in range(2)]
+    started = time.monotonic()
+    for n in range(3):
+        for gateway in gateways:
+            assert gateway.send(['7999000000%d' % n], 'Задача')[0] == 'OK'
+    elapsed = time.monotonic() - started
+    stop_gateway(httpd)
+
+    assert len(GatewayStubHandler.requests) == 6
+    assert elapsed >= 5 / 20
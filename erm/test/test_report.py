@@ -0,0 +1,34 @@
+import unittest.mock as mock
+
+from suir.modules.report import *
+
+
+@mock.patch('suir.modules.report.generate_excel_report_file', autospec=True)
+@mock.patch('suir.modules.report.backend', autospec=True)
+def test_consolidated_report_is_prepared_only_when_rebuilt(backend, generate_excel_report_file):
+    cons_reports.clear()
+    backend.get_all_workreports.side_effect = lambda month, year: {
+        'built': 1.0, 'engineers': [['Тестов Т.', 'testov']], 
+        'rows': [['Вектор-М', 'ERM', [10]]], 'not_reported': ['ivanov@company.ru']}
+    generate_excel_report_file.return_value = '/static/otchet.xlsx'
+
+    report = get_consolidated_report(10, 2026, '/app')
+    assert report['engineers'] == [['Тестов Т.', 'testov']]
+    assert report['rows'] == [['Вектор-М', 'ERM', [10]]]
+    assert report['not_reported'] == ['ivanov@company.ru']
+    assert report['excel_file_path'] == '/static/otchet.xlsx'
+    assert get_consolidated_report(10, 2026, '/app') is report
+    assert generate_excel_report_file.call_count == 1
+    assert backend.get_eng_info.call_count == 0
+    assert backend.get_engineers_list.call_count == 0
+
+    backend.get_all_workreports.side_effect = lambda month, year: {
+        'built': 2.0, 'engineers': [['Тестов Т.', 'testov']], 
+        'rows': [['Вектор-М', 'ERM', [12]]], 'not_reported': []}
+    assert get_consolidated_report(10, 2026, '/app')['rows'] == [['Вектор-М', 'ERM', [12]]]
+    assert generate_excel_report_file.call_count == 2
+
+@mock.patch('suir.modules.report.backend', autospec=True)
+def test_consolidated_report_without_data(backend):
+    backend.get_all_workreports.return_value = []
+    assert get_consolidated_report(10, 2026, '/app')['rows'] == []
@@ -0,0 +1,97 @@
+import os
+import urllib.parse
+
+import pytest
+import unittest.mock as mock
+from flask import Flask, render_template
+
+from suir.modules.backend import backend
+from suir.modules.search import form_search_string, search_pages, searchIndex
+
+
+def build_index():
+    index = searchIndex()
+    index.build([('t_testov', 'Тестов Тест linux python bmc remedy'),
+                 ('p_petrov', 'Петров Петр linux windows Английский'),
+                 ('s_sidorov', 'Сидоров Сидор remedy java 1522-6 Отдел автоматизации')])
+    return index
+
+def test_form_search_string_empty():
+    request = mock.Mock()
+    request.form = {'search_string': ''}
+    assert form_search_string(request) == '%%'
+
+def test_search_intersects_words():
+    index = build_index()
+    assert index.search('linux remedy') == ['t_testov']
+
+def test_search_any_word():
+    index = build_index()
+    assert index.search('windows java', match_all = False) == ['p_petrov', 's_sidorov']
+
+@pytest.mark.parametrize('search_string, expected', [['rem', ['s_sidorov', 't_testov']],
+                                                     ['англ', ['p_petrov']],
+                                                     ['ОТДЕЛ автомат', ['s_sidorov']],
+                                                     ['nothing', []]])
+def test_search_by_prefix(search_string, expected):
+    index = build_index()
+    assert index.search(search_string) == expected
+
+def test_empty_search_matches_all():
+    index = build_index()
+    assert index.search('%%') == ['p_petrov', 's_sidorov', 't_testov']
+
+def test_incremental_updates():
+    index = build_index()
+    index.add('n_new', 'Новый Инженер docker')
+    index.add('t_testov', 'Тестов Тест windows')
+    index.remove('p_petrov')
+    assert index.search('docker') == ['n_new']
+    assert index.search('windows') == ['t_testov']
+    assert index.search('linux') == []
+    assert index.search('петр') == []
+
+def test_not_built_index_ignores_updates():
+    index = searchIndex()
+    index.add('n_new', 'docker')
+    assert index.search('docker') == []
+
+
+@pytest.mark.parametrize('page, total, expected', [[0, 120, (None, 1)],
+                                                   [1, 120, (0, 2)],
+                                                   [2, 120, (1, None)],
+                                                   [0, 50, (None, None)],
+                                                   [0, 0, (None, None)]])
+def test_search_pages(page, total, expected):
+    assert search_pages(page, 50, total) == expected
+
+def test_ranked_engineers_page_is_requested_from_backend():
+    client = mock.Mock()
+    client.request.return_value = ('{"total": 120, "engineers": []}', 200)
+    with mock.patch.object(backend, 'client', return_value = client):
+        ranked = backend.get_ranked_engineers('linux python', '0', '0', 50, 100)
+    assert ranked == {'total': 120, 'engineers': []}
+    url = urllib.parse.urlsplit(client.request.call_args[0][1])
+    assert url.path == '/rest/ranked_search/linux%20python/0/0'
+    assert urllib.parse.parse_qs(url.query) == {'limit': ['50'], 'offset': ['100']}
+
+def render_search_result(**kwargs):
+    app = Flask(__name__, template_folder = os.path.join(os.path.dirname(__file__), 
+                                                         '..', 'templates_ru'))
+    app.add_url_rule('/search', 'search')
+    with app.test_request_context():
+        return render_template('search_result.html', resources = [], username = '', 
+                               toolset = [], **kwargs)
+
+def test_search_result_posts_neighbour_pages():
+    html = render_search_result(total = 120, first = 51, prev_page = 0, next_page = 2,
+                                search_string = 'linux')
+    assert '<input type="hidden" name="page" value="0">' in html
+    assert '<input type="hidden" name="page" value="2">' in html
+    assert html.count('name="search_string" value="linux"') == 2
+
+def test_search_result_last_page_has_no_next_control():
+    html = render_search_result(total = 120, first = 101, prev_page = 1, next_page = None,
+                                search_string = 'linux')
+    assert '<input type="hidden" name="page" value="1">' in html
+    assert 'вперед' not in html
@@ -0,0 +1,52 @@
+from suir.modules.syncstate import syncState
+
+
+def test_first_run_is_full_sync(tmp_path):
+    state = syncState(str(tmp_path / 'state.json'), 'Jira')
+    assert state.is_full_sync_due(3600, now = 1000)
+
+def test_state_is_saved_per_section(tmp_path):
+    path = str(tmp_path / 'state.json')
+    jira = syncState(path, 'Jira')
+    jira.commit([('ERM-1 Task', 't_testov', 'Стэп Лоджик', 'ERM', 'ERM-1')], 1000, full_sync = True)
+    jira.save()
+    remedy = syncState(path, 'Remedy_HPD')
+    remedy.commit([], 2000, full_sync = True)
+    remedy.save()
+
+    jira = syncState(path, 'Jira')
+    assert jira.watermark == 1000
+    assert jira.open == {'ERM-1': ['ERM-1 Task', 't_testov', 'Стэп Лоджик', 'ERM']}
+    assert not jira.is_full_sync_due(3600, now = 2000)
+    assert jira.is_full_sync_due(3600, now = 4600)
+    assert jira.get_modified_since() == 1000 - syncState.WATERMARK_OVERLAP
+    assert syncState(path, 'Remedy_HPD').watermark == 2000
+
+def test_incremental_sync_keeps_open_tickets_and_full_sync_detects_closed(tmp_path):
+    state = syncState(str(tmp_path / 'state.json'), 'Jira')
+    state.commit([('ERM-1 A', 'a', 'c', 'ERM', 'ERM-1'), ('ERM-2 B', 'b', 'c', 'ERM', 'ERM-2')], 
+                 1000, full_sync = True)
+
+    assert state.commit([('ERM-3 C', 'a', 'c', 'ERM', 'ERM-3')], 2000, full_sync = False) == []
+    assert sorted(state.open) == ['ERM-1', 'ERM-2', 'ERM-3']
+    assert state.last_full == 1000
+
+    closed = state.commit([('ERM-1 A', 'a', 'c', 'ERM', 'ERM-1')], 3000, full_sync = True)
+    assert sorted(closed) == [('ERM-2 B', 'b', 'c', 'ERM', 'ERM-2'), 
+                              ('ERM-3 C', 'a', 'c', 'ERM', 'ERM-3')]
+    assert list(state.open) == ['ERM-1']
+    assert state.last_full == state.watermark == 3000
+
+def test_incremental_sync_books_unmodified_tickets_and_closes_fetched_closed(tmp_path):
+    state = syncState(str(tmp_path / 'state.json'), 'Jira')
+    state.commit([('ERM-1 A', 'a', 'c', 'ERM', 'ERM-1'), ('ERM-2 B', 'b', 'c', 'ERM', 'ERM-2'),
+                  ('ERM-3 C', 'a', 'c', 'ERM', 'ERM-3')], 1000, full_sync = True)
+
+    modified = [('ERM-1 A renamed', 'a', 'c', 'ERM', 'ERM-1')]
+    assert sorted(state.get_booked_entries(modified, closed_keys = ['ERM-2', 'ERM-9'])) == [
+        ('ERM-1 A renamed', 'a', 'c', 'ERM', 'ERM-1'), ('ERM-3 C', 'a', 'c', 'ERM', 'ERM-3')]
+
+    closed = state.commit(modified, 2000, full_sync = False, closed_keys = ['ERM-2', 'ERM-9'])
+    assert closed == [('ERM-2 B', 'b', 'c', 'ERM', 'ERM-2')]
+    assert sorted(state.open) == ['ERM-1', 'ERM-3']
+    assert state.open['ERM-1'][0] == 'ERM-1 A renamed'
@@ -0,0 +1,46 @@
+import os
+import pickle
+from collections import Counter
+
+import pytest
+
+from suir.modules.tagger import compactWords, tagsDictionary
+
+
+@pytest.fixture
+def tags_dict_path(tmp_path):
+    path = str(tmp_path / 'tags_dict.pickle')
+    with open(path, 'wb') as tags_dict_file:
+        pickle.dump(Counter({'cisco': 15, 'linux': 7, 'zabbix': 7, 'it': 1, 'oracle': 4}),
+                    tags_dict_file)
+    return path
+
+def test_tag_text_uses_frequent_words_only(tags_dict_path):
+    tags = tagsDictionary(tags_dict_path)
+    assert sorted(tags.tag_text('Настройка Cisco и Linux, IT мониторинг zabbix')) == ['cisco', 'linux', 'zabbix']
+
+def test_dictionary_is_reloaded_when_file_changes(tags_dict_path):
+    tags = tagsDictionary(tags_dict_path)
+    assert tags.tag_text('docker') == []
+    with open(tags_dict_path, 'wb') as tags_dict_file:
+        pickle.dump(Counter({'docker': 10}), tags_dict_file)
+    stat = os.stat(tags_dict_path)
+    os.utime(tags_dict_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert tags.tag_text('docker') == ['docker']
+
+def test_compact_dictionary_gives_same_tags(tags_dict_path, tmp_path):
+    compact_path = str(tmp_path / 'tags_dict.words')
+    tagsDictionary.convert_to_compact(tags_dict_path, compact_path)
+    text = 'cisco it linux oracle zabbix zzz aaa'
+    assert sorted(tagsDictionary(compact_path).tag_text(text)) == \
+           sorted(tagsDictionary(tags_dict_path).tag_text(text))
+
+@pytest.mark.parametrize('words', [[], ['a'], ['b', 'a', 'c', 'abc', 'ab', 'zz']])
+def test_compact_words_lookup(words, tmp_path):
+    path = str(tmp_path / 'words')
+    compactWords.save(words, path)
+    compact = compactWords(path)
+    for word in words:
+        assert word in compact
+    for word in ['', 'aa', 'abcd', 'bb', 'z', 'zzz']:
+        assert word not in compact
@@ -0,0 +1,43 @@
+
+from suir.modules.timeline import timeline
+
+
+WEEK_START = 1539338400
+WEEK_END = WEEK_START + 7*24*60*60
+
+
+def minute_sets_workload(intervals):
+    '''previous per-minute sets implementation of resource workload'''
+    sets = [set(range(int(x[0]/60), int(x[1]/60))) for x in intervals]
+    res_timeline = []
+    for dateframe in sets:
+        for n_dateframe in sets:
+            if dateframe < n_dateframe:
+                break
+        else:
+            res_timeline.append(dateframe)
+    busy_timeline = min(sum(len(dateset) for dateset in res_timeline), 7*24*60)
+    return int((busy_timeline / (7*24*60)) * 100)
+
+
+def test_union_merges_partial_overlaps():
+    assert timeline.union([(10, 20), (15, 30), (40, 50), (30, 35)]) == [(10, 35), (40, 50)]
+
+def test_union_drops_empty_intervals():
+    assert timeline.union([(10, 10), (20, 15)]) == []
+
+def test_busy_time_counts_partial_overlap_once():
+    assert timeline.busy_time([(0, 60), (30, 90)]) == 90
+
+def test_clip_truncates_to_window():
+    assert timeline.clip([(0, 100), (150, 300), (400, 500)], 50, 200) == [(50, 100), (150, 200)]
+
+def test_workload_matches_minute_sets_for_nested_intervals():
+    intervals = [(WEEK_START + 3600, WEEK_START + 10*3600),
+                 (WEEK_START + 2*3600, WEEK_START + 5*3600),
+                 (WEEK_START + 24*3600, WEEK_START + 60*3600),
+                 (WEEK_START + 30*3600, WEEK_START + 31*3600)]
+    assert timeline.workload(intervals, WEEK_START, WEEK_END) == minute_sets_workload(intervals)
+
+def test_workload_is_limited_by_window():
+    assert timeline.workload([(0, WEEK_END + 100)], WEEK_START, WEEK_END) == 100
@@ -0,0 +1,86 @@
+import unittest.mock as mock
+
+from suir.modules.user import User
+
+
+def get_user_record(login):
+    return {'name': 'Тестов Тест', 'login': login, 'active': 1,
+            'user_group': 'engineer', 'phone': '9000000000'}
+
+@mock.patch('suir.modules.user.backend', autospec=True)
+def test_profile_is_requested_once_for_request(backend):
+    backend.get_user.side_effect = get_user_record
+    User.invalidate_profile('t_testov')
+    user = User('t_testov', '123')
+    assert user.fullname == 'Тестов Тест'
+    assert user.user_group == 'engineer'
+    assert user.fullname == 'Тестов Тест'
+    assert backend.get_user.call_count == 1
+    backend.get_user_group.assert_not_called()
+
+@mock.patch('suir.modules.user.backend', autospec=True)
+def test_profile_is_cached_across_requests_until_invalidated(backend):
+    backend.get_user.side_effect = get_user_record
+    User.invalidate_profile('t_testov')
+    assert User('t_testov', '123').user_group == 'engineer'
+    assert User('t_testov', '123').user_group == 'engineer'
+    assert backend.get_user.call_count == 1
+
+    User.invalidate_profile('t_testov')
+    assert User('t_testov', '123').fullname == 'Тестов Тест'
+    assert backend.get_user.call_count == 2
+
+@mock.patch('suir.modules.user.time.time')
+@mock.patch('suir.modules.user.backend', autospec=True)
+def test_profile_cache_expires(backend, time):
+    backend.get_user.side_effect = get_user_record
+    User.invalidate_profile('t_testov')
+    time.return_value = 1000
+    User('t_testov', '123').fullname
+    time.return_value = 1000 + User.profile_cache_ttl + 1
+    User('t_testov', '123').fullname
+    assert backend.get_user.call_count == 2
+
+@mock.patch('suir.modules.user.backend', autospec=True)
+def test_session_is_resolved_from_local_cache(backend):
+    backend.create_session.return_value = {'token': 'abc', 'login': 't_testov', 
+                                           'expires': 4102444800}
+    user = User('t_testov', '123')
+    assert user.authenticate() == True
+    assert user.get_id() == 'abc'
+    assert user.pswd is None
+
+    assert User.get('abc').login == 't_testov'
+    backend.get_session.assert_not_called()
+    backend.check_credentials.assert_not_called()
+
+@mock.patch('suir.modules.user.backend', autospec=True)
+def test_unknown_session_is_resolved_by_backend(backend):
+    backend.get_session.side_effect = [{'token': 'xyz', 'login': 'p_petrov', 
+                                        'expires': 4102444800}, None]
+    assert User.get('xyz').login == 'p_petrov'
+    assert User.get('xyz').login == 'p_petrov'
+    assert backend.get_session.call_count == 1
+    assert User.get('old session id') is None
+
+@mock.patch('suir.modules.user.backend', autospec=True)
+def test_wrong_credentials(backend):
+    backend.create_session.return_value = False
+    user = User('t_testov', 'wrong')
+    assert user.authenticate() == False
+    assert user.is_authenticated == False
+
+@mock.patch('suir.modules.user.time.time')
+@mock.patch('suir.modules.user.backend', autospec=True)
+def test_session_cache_expires_before_session(backend, time):
+    backend.get_session.side_effect = [{'token': 'ttl', 'login': 'p_petrov', 
+                                        'expires': 4102444800}, None]
+    time.return_value = 1000
+    assert User.get('ttl').login == 'p_petrov'
+    time.return_value = 1000 + User.session_cache_ttl - 1
+    assert User.get('ttl').login == 'p_petrov'
+    assert backend.get_session.call_count == 1
+    #session closed through another worker
+    time.return_value = 1000 + User.session_cache_ttl + 1
+    assert User.get('ttl') is None
+    assert backend.get_session.call_count == 2